@@ -1,18 +1,22 @@
-from fastapi import APIRouter, Depends, Request, Form, HTTPException
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Request, Form, HTTPException, File, UploadFile, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, schemas
+from app import crud_async, rate_import, rollups, schemas
 from app.auth import get_current_admin_user
-from app.database import get_db
+from app.database import get_async_db
 from app.dependencies import templates
+from app.principal_cache import principal_cache
 
 admin_router = APIRouter(dependencies=[Depends(get_current_admin_user)])
 
 @admin_router.get("/", response_class=HTMLResponse)
-async def admin_dashboard(request: Request, db: Session = Depends(get_db)):
-    rates = crud.get_currency_rates(db)
-    users = crud.get_users(db)
+async def admin_dashboard(request: Request, db: AsyncSession = Depends(get_async_db)):
+    rates = await crud_async.get_currency_rates(db)
+    users = await crud_async.get_users(db)
     return templates.TemplateResponse("admin_dashboard.html", {
         "request": request,
         "rates": rates,
@@ -21,8 +25,8 @@ async def admin_dashboard(request: Request, db: Session = Depends(get_db)):
     })
 
 @admin_router.get("/rates", response_class=HTMLResponse)
-async def admin_rates(request: Request, db: Session = Depends(get_db)):
-    rates = crud.get_currency_rates(db)
+async def admin_rates(request: Request, db: AsyncSession = Depends(get_async_db)):
+    rates = await crud_async.get_currency_rates(db)
     return templates.TemplateResponse("admin_rates.html", {
         "request": request,
         "rates": rates,
@@ -30,14 +34,78 @@ async def admin_rates(request: Request, db: Session = Depends(get_db)):
     })
 
 @admin_router.get("/users", response_class=HTMLResponse)
-async def admin_users(request: Request, db: Session = Depends(get_db)):
-    users = crud.get_users(db)
+async def admin_users(request: Request, db: AsyncSession = Depends(get_async_db)):
+    users = await crud_async.get_users(db)
     return templates.TemplateResponse("admin_users.html", {
         "request": request,
         "users": users,
         "active_tab": "users"
     })
 
+def _currency_filter(value: Optional[str]) -> Optional[str]:
+    return value.strip().upper() or None if value else None
+
+async def _load_rollups(db: AsyncSession, granularity: str, date_from: Optional[datetime],
+                        date_to: Optional[datetime], from_currency: Optional[str], to_currency: Optional[str]):
+    default_from, default_to = rollups.default_range(granularity)
+    date_from = date_from or default_from
+    date_to = date_to or default_to
+    items = await rollups.get_rollups(
+        db, granularity, date_from, date_to, _currency_filter(from_currency), _currency_filter(to_currency)
+    )
+    return items, date_from, date_to
+
+@admin_router.get("/analytics", response_class=HTMLResponse)
+async def admin_analytics(
+    request: Request,
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    from_currency: Optional[str] = None,
+    to_currency: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    error = None
+    try:
+        items, date_from, date_to = await _load_rollups(db, granularity, date_from, date_to, from_currency, to_currency)
+    except ValueError as e:
+        items, error = [], str(e)
+
+    totals = {}
+    for item in items:
+        pair = totals.setdefault((item.from_currency, item.to_currency), [0, 0.0, 0.0])
+        pair[0] += item.conversion_count
+        pair[1] += item.amount_total
+        pair[2] += item.converted_total
+
+    return templates.TemplateResponse("admin_analytics.html", {
+        "request": request,
+        "rollups": items,
+        "totals": sorted(totals.items(), key=lambda pair: -pair[1][0]),
+        "granularity": granularity,
+        "date_from": date_from,
+        "date_to": date_to,
+        "from_currency": from_currency or "",
+        "to_currency": to_currency or "",
+        "error": error,
+        "active_tab": "analytics"
+    })
+
+@admin_router.get("/api/analytics", response_model=List[schemas.ConversionRollupResponse])
+async def admin_analytics_api(
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    from_currency: Optional[str] = None,
+    to_currency: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        items, _, _ = await _load_rollups(db, granularity, date_from, date_to, from_currency, to_currency)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return items
+
 # === УПРАВЛЕНИЕ КУРСАМИ (только POST методы для HTML-форм) ===
 
 @admin_router.post("/api/rates", response_class=HTMLResponse)
@@ -46,7 +114,7 @@ async def create_rate(
     base_currency: str = Form(...),
     target_currency: str = Form(...),
     rate: float = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         currency_rate = schemas.CurrencyRateCreate(
@@ -54,24 +122,42 @@ async def create_rate(
             target_currency=target_currency.upper(),
             rate=rate
         )
-        crud.create_currency_rate(db, currency_rate)
+        await crud_async.create_currency_rate(db, currency_rate)
         return RedirectResponse(url="/admin/rates?success=Курс успешно добавлен", status_code=303)
     except Exception as e:
         return RedirectResponse(url=f"/admin/rates?error={str(e)}", status_code=303)
 
+@admin_router.post("/api/rates/import", response_class=HTMLResponse)
+async def import_rates(
+    request: Request,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    fmt = rate_import.detect_format(file.filename or "", file.content_type or "")
+    try:
+        result = await rate_import.import_rates(db, await file.read(), fmt)
+    except (ValueError, UnicodeDecodeError) as e:
+        return RedirectResponse(url=f"/admin/rates?error=Не удалось прочитать файл: {str(e)}", status_code=303)
+
+    rates = await crud_async.get_currency_rates(db)
+    return templates.TemplateResponse("admin_rates.html", {
+        "request": request,
+        "rates": rates,
+        "import_result": result,
+        "active_tab": "rates"
+    })
+
 @admin_router.post("/api/rates/{rate_id}/toggle", response_class=HTMLResponse)
 async def toggle_rate(
     rate_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        rate = crud.get_currency_rate(db, rate_id)
+        rate = await crud_async.toggle_currency_rate(db, rate_id)
         if not rate:
             return RedirectResponse(url="/admin/rates?error=Курс не найден", status_code=303)
         
-        rate.is_active = not rate.is_active
-        db.commit()
         return RedirectResponse(url="/admin/rates?success=Статус курса изменен", status_code=303)
     except Exception as e:
         return RedirectResponse(url=f"/admin/rates?error={str(e)}", status_code=303)
@@ -80,10 +166,10 @@ async def toggle_rate(
 async def delete_rate(
     rate_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        success = crud.delete_currency_rate(db, rate_id)
+        success = await crud_async.delete_currency_rate(db, rate_id)
         if not success:
             return RedirectResponse(url="/admin/rates?error=Курс не найден", status_code=303)
         return RedirectResponse(url="/admin/rates?success=Курс успешно удален", status_code=303)
@@ -96,10 +182,10 @@ async def update_rate(
     request: Request,
     rate: float = Form(...),
     is_active: bool = Form(False),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        current_rate = crud.get_currency_rate(db, rate_id)
+        current_rate = await crud_async.get_currency_rate(db, rate_id)
         if not current_rate:
             return RedirectResponse(url="/admin/rates?error=Курс не найден", status_code=303)
         
@@ -107,7 +193,7 @@ async def update_rate(
             rate=rate,
             is_active=is_active
         )
-        updated_rate = crud.update_currency_rate(db, rate_id, rate_update)
+        updated_rate = await crud_async.update_currency_rate(db, rate_id, rate_update)
         if not updated_rate:
             return RedirectResponse(url="/admin/rates?error=Курс не найден", status_code=303)
         return RedirectResponse(url="/admin/rates?success=Курс успешно обновлен", status_code=303)
@@ -120,10 +206,10 @@ async def update_rate(
 async def toggle_user_active(
     user_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        user = crud.get_user(db, user_id)
+        user = await crud_async.get_user(db, user_id)
         if not user:
             return RedirectResponse(url="/admin/users?error=Пользователь не найден", status_code=303)
         
@@ -132,7 +218,8 @@ async def toggle_user_active(
             return RedirectResponse(url="/admin/users?error=Нельзя изменить статус самого себя", status_code=303)
         
         user.is_active = not user.is_active
-        db.commit()
+        await db.commit()
+        principal_cache.invalidate_user(user.id)
         return RedirectResponse(url="/admin/users?success=Статус пользователя изменен", status_code=303)
     except Exception as e:
         return RedirectResponse(url=f"/admin/users?error={str(e)}", status_code=303)
@@ -141,10 +228,10 @@ async def toggle_user_active(
 async def toggle_user_admin(
     user_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        user = crud.get_user(db, user_id)
+        user = await crud_async.get_user(db, user_id)
         if not user:
             return RedirectResponse(url="/admin/users?error=Пользователь не найден", status_code=303)
         
@@ -153,7 +240,8 @@ async def toggle_user_admin(
             return RedirectResponse(url="/admin/users?error=Нельзя изменить права самого себя", status_code=303)
         
         user.is_admin = not user.is_admin
-        db.commit()
+        await db.commit()
+        principal_cache.invalidate_user(user.id)
         return RedirectResponse(url="/admin/users?success=Права пользователя изменены", status_code=303)
     except Exception as e:
         return RedirectResponse(url=f"/admin/users?error={str(e)}", status_code=303)
@@ -162,14 +250,14 @@ async def toggle_user_admin(
 async def delete_user(
     user_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         current_user = request.state.user if hasattr(request, 'state') and hasattr(request.state, 'user') else None
         if current_user and user_id == current_user.id:
             return RedirectResponse(url="/admin/users?error=Нельзя удалить самого себя", status_code=303)
         
-        success = crud.delete_user(db, user_id)
+        success = await crud_async.delete_user(db, user_id)
         if not success:
             return RedirectResponse(url="/admin/users?error=Пользователь не найден", status_code=303)
         return RedirectResponse(url="/admin/users?success=Пользователь успешно удален", status_code=303)
@@ -1,17 +1,31 @@
+import asyncio
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app import models, schemas, crud
-from app.database import get_db
+from app import models, schemas, crud, crud_async
+from app.database import get_async_db
 from app.config import settings
+from app.principal_cache import principal_cache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+# bcrypt отпускает GIL, поэтому хеширование идёт в отдельном пуле потоков,
+# а не в event loop. Очередь ожидания ограничена: лишние запросы получают отказ.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_PENDING)
+
+class PasswordHashingBusy(Exception):
+    pass
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     if len(plain_password.encode('utf-8')) > 72:
         plain_password = plain_password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
@@ -22,12 +36,43 @@ def get_password_hash(password: str) -> str:
         password = password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
     return pwd_context.hash(password)
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+async def _run_hashing(func, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_slots.release()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
 def authenticate_user(db: Session, username: str, password: str):
     user = crud.get_user_by_username(db, username)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
         return False
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = get_password_hash(password)
+        db.commit()
+    return user
+
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    user = await crud_async.get_user_by_username(db, username)
+    if not user:
+        return False
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = await get_password_hash_async(password)
+        await db.commit()
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -42,13 +87,18 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    generation = principal_cache.generation()
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
@@ -58,10 +108,12 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = crud.get_user_by_username(db, username=token_data.username)
+    user = await crud_async.get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    principal = schemas.UserInDB.model_validate(user)
+    principal_cache.put(token, principal, token_expires_at=payload.get("exp"), generation=generation)
+    return principal
 
 async def get_current_active_user(current_user: schemas.UserInDB = Depends(get_current_user)):
     if not current_user.is_active:
@@ -71,4 +123,13 @@ async def get_current_active_user(current_user: schemas.UserInDB = Depends(get_c
 async def get_current_admin_user(current_user: schemas.UserInDB = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_metrics_reader(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # В метриках трафик по маршрутам и парам валют — анонимно их не отдаём
+    if settings.METRICS_TOKEN and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+        return None
+    return await get_current_admin_user(await get_current_user(token, db))
@@ -8,18 +8,130 @@ class Settings:
     
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./currency_converter.db")
     
+    # Файл блокировки разовой подготовки БД при старте; пусто — во временном каталоге по хешу DATABASE_URL
+    STARTUP_LOCK_PATH: str = os.getenv("STARTUP_LOCK_PATH", "")
+    
+    # Общая для воркеров таблица курсов в разделяемой памяти (mmap)
+    SHARED_RATES_ENABLED: bool = os.getenv("SHARED_RATES_ENABLED", "true").lower() in ("1", "true", "yes")
+    SHARED_RATES_PATH: str = os.getenv("SHARED_RATES_PATH", "")
+    SHARED_RATES_CAPACITY: int = int(os.getenv("SHARED_RATES_CAPACITY", "256"))
+    SHARED_RATES_POLL_MS: int = int(os.getenv("SHARED_RATES_POLL_MS", "500"))
+    
+    # Профиль движка БД: auto (по URL), sqlite, server или basic (настройки SQLAlchemy по умолчанию)
+    DB_PROFILE: str = os.getenv("DB_PROFILE", "auto")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    # Отрицательное значение — размер в КиБ, как в PRAGMA cache_size
+    SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+    
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
     
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+    
+    PRINCIPAL_CACHE_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+    PRINCIPAL_CACHE_TTL_SECONDS: int = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+    # Поколения инвалидаций в разделяемой памяти: смена ролей и блокировка видны всем воркерам хоста
+    # сразу. Воркеры на разных хостах этот файл не делят — там кеш нужно выключить (PRINCIPAL_CACHE_SIZE=0)
+    PRINCIPAL_CACHE_SHARED_PATH: str = os.getenv("PRINCIPAL_CACHE_SHARED_PATH", "")
+    
+    CONVERT_BATCH_MAX_ITEMS: int = int(os.getenv("CONVERT_BATCH_MAX_ITEMS", "1000"))
+    
+    # Idempotency-Key для POST /api/v1/convert: LRU в памяти воркера, таблица idempotency_keys — общая
+    IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+    IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    # Сколько повтор ждёт запрос с тем же ключом, выполняющийся в другом воркере, прежде чем ответить 409
+    IDEMPOTENCY_WAIT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+    # Захват, который владелец не продлевал дольше этого, считается брошенным (воркер упал)
+    # и перехватывается; живой владелец продлевает его каждую треть срока
+    IDEMPOTENCY_LOCK_TIMEOUT_SECONDS: int = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT_SECONDS", "60"))
+    
+    # Сколько секунд клиенты и прокси могут отдавать курсы из своего кэша
+    RATES_CACHE_MAX_AGE: int = int(os.getenv("RATES_CACHE_MAX_AGE", "5"))
+    
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    # Bearer-токен для сборщика метрик (Prometheus); без него /metrics отдаётся только администраторам
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    
+    # В режиме отладки ответы получают заголовок Server-Timing с числом и временем SQL-запросов
+    DEBUG: bool = os.getenv("DEBUG", "false").lower() in ("1", "true", "yes")
+    SQL_STATS_ENABLED: bool = os.getenv("SQL_STATS_ENABLED", "true").lower() in ("1", "true", "yes")
+    # Сколько одинаковых запросов за один HTTP-запрос считать подозрением на N+1 (0 — не проверять)
+    N_PLUS_ONE_THRESHOLD: int = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+    
+    # Отложенная запись истории конвертаций. ID воркеры резервируют у БД блоками,
+    # принятые строки до записи в БД лежат в журнале на диске.
+    HISTORY_WRITE_BEHIND: bool = os.getenv("HISTORY_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+    HISTORY_QUEUE_MAX_SIZE: int = int(os.getenv("HISTORY_QUEUE_MAX_SIZE", "10000"))
+    HISTORY_FLUSH_BATCH_SIZE: int = int(os.getenv("HISTORY_FLUSH_BATCH_SIZE", "500"))
+    HISTORY_FLUSH_INTERVAL_MS: int = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+    HISTORY_ID_BLOCK_SIZE: int = int(os.getenv("HISTORY_ID_BLOCK_SIZE", "1000"))
+    HISTORY_JOURNAL_DIR: str = os.getenv("HISTORY_JOURNAL_DIR", "./history_journal")
+    HISTORY_RETRY_MAX_SECONDS: float = float(os.getenv("HISTORY_RETRY_MAX_SECONDS", "5"))
+    
+    # Разбиение conversion_history по месяцам: сколько месяцев (включая текущий) живёт
+    # в горячей таблице, сколько всего хранится в БД и куда уходят архивы старше этого
+    HISTORY_HOT_MONTHS: int = int(os.getenv("HISTORY_HOT_MONTHS", "3"))
+    HISTORY_RETENTION_MONTHS: int = int(os.getenv("HISTORY_RETENTION_MONTHS", "12"))
+    HISTORY_ARCHIVE_DIR: str = os.getenv("HISTORY_ARCHIVE_DIR", "./archive")
+    
     def __init__(self):
         try:
             from dotenv import load_dotenv
             load_dotenv()
             
             self.DATABASE_URL = os.getenv("DATABASE_URL", self.DATABASE_URL)
+            self.STARTUP_LOCK_PATH = os.getenv("STARTUP_LOCK_PATH", self.STARTUP_LOCK_PATH)
+            self.SHARED_RATES_ENABLED = os.getenv("SHARED_RATES_ENABLED", str(self.SHARED_RATES_ENABLED)).lower() in ("1", "true", "yes")
+            self.SHARED_RATES_PATH = os.getenv("SHARED_RATES_PATH", self.SHARED_RATES_PATH)
+            self.SHARED_RATES_CAPACITY = int(os.getenv("SHARED_RATES_CAPACITY", str(self.SHARED_RATES_CAPACITY)))
+            self.SHARED_RATES_POLL_MS = int(os.getenv("SHARED_RATES_POLL_MS", str(self.SHARED_RATES_POLL_MS)))
+            self.DB_PROFILE = os.getenv("DB_PROFILE", self.DB_PROFILE)
+            self.DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(self.DB_POOL_SIZE)))
+            self.DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(self.DB_MAX_OVERFLOW)))
+            self.DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", str(self.DB_POOL_TIMEOUT)))
+            self.DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", str(self.DB_POOL_RECYCLE)))
+            self.SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", str(self.SQLITE_BUSY_TIMEOUT_MS)))
+            self.SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", self.SQLITE_SYNCHRONOUS)
+            self.SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(self.SQLITE_MMAP_SIZE)))
+            self.SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", str(self.SQLITE_CACHE_SIZE)))
             self.SECRET_KEY = os.getenv("SECRET_KEY", self.SECRET_KEY)
             self.ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", str(self.ACCESS_TOKEN_EXPIRE_MINUTES)))
+            self.BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", str(self.BCRYPT_ROUNDS)))
+            self.PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(self.PASSWORD_HASH_WORKERS)))
+            self.PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(self.PASSWORD_HASH_MAX_PENDING)))
+            self.PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", str(self.PRINCIPAL_CACHE_SIZE)))
+            self.PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", str(self.PRINCIPAL_CACHE_TTL_SECONDS)))
+            self.PRINCIPAL_CACHE_SHARED_PATH = os.getenv("PRINCIPAL_CACHE_SHARED_PATH", self.PRINCIPAL_CACHE_SHARED_PATH)
+            self.CONVERT_BATCH_MAX_ITEMS = int(os.getenv("CONVERT_BATCH_MAX_ITEMS", str(self.CONVERT_BATCH_MAX_ITEMS)))
+            self.IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", str(self.IDEMPOTENCY_CACHE_SIZE)))
+            self.IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(self.IDEMPOTENCY_TTL_SECONDS)))
+            self.IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", str(self.IDEMPOTENCY_WAIT_SECONDS)))
+            self.IDEMPOTENCY_LOCK_TIMEOUT_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT_SECONDS", str(self.IDEMPOTENCY_LOCK_TIMEOUT_SECONDS)))
+            self.RATES_CACHE_MAX_AGE = int(os.getenv("RATES_CACHE_MAX_AGE", str(self.RATES_CACHE_MAX_AGE)))
+            self.METRICS_ENABLED = os.getenv("METRICS_ENABLED", str(self.METRICS_ENABLED)).lower() in ("1", "true", "yes")
+            self.METRICS_TOKEN = os.getenv("METRICS_TOKEN", self.METRICS_TOKEN)
+            self.DEBUG = os.getenv("DEBUG", str(self.DEBUG)).lower() in ("1", "true", "yes")
+            self.SQL_STATS_ENABLED = os.getenv("SQL_STATS_ENABLED", str(self.SQL_STATS_ENABLED)).lower() in ("1", "true", "yes")
+            self.N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", str(self.N_PLUS_ONE_THRESHOLD)))
+            self.HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", str(self.HISTORY_WRITE_BEHIND)).lower() in ("1", "true", "yes")
+            self.HISTORY_HOT_MONTHS = int(os.getenv("HISTORY_HOT_MONTHS", str(self.HISTORY_HOT_MONTHS)))
+            self.HISTORY_RETENTION_MONTHS = int(os.getenv("HISTORY_RETENTION_MONTHS", str(self.HISTORY_RETENTION_MONTHS)))
+            self.HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", self.HISTORY_ARCHIVE_DIR)
+            self.HISTORY_QUEUE_MAX_SIZE = int(os.getenv("HISTORY_QUEUE_MAX_SIZE", str(self.HISTORY_QUEUE_MAX_SIZE)))
+            self.HISTORY_FLUSH_BATCH_SIZE = int(os.getenv("HISTORY_FLUSH_BATCH_SIZE", str(self.HISTORY_FLUSH_BATCH_SIZE)))
+            self.HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", str(self.HISTORY_FLUSH_INTERVAL_MS)))
+            self.HISTORY_ID_BLOCK_SIZE = int(os.getenv("HISTORY_ID_BLOCK_SIZE", str(self.HISTORY_ID_BLOCK_SIZE)))
+            self.HISTORY_JOURNAL_DIR = os.getenv("HISTORY_JOURNAL_DIR", self.HISTORY_JOURNAL_DIR)
+            self.HISTORY_RETRY_MAX_SECONDS = float(os.getenv("HISTORY_RETRY_MAX_SECONDS", str(self.HISTORY_RETRY_MAX_SECONDS)))
         except ImportError:
             pass
 
@@ -1,8 +1,10 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import List, Optional
-from app import models, schemas
+from sqlalchemy import and_, or_, insert
+from typing import List, Optional, Tuple
+from app import models, partitions, schemas, rate_history, rate_versions, user_stats, rollups
 from app.auth import get_password_hash
+from app.rate_cache import rate_cache
+from app.principal_cache import principal_cache
 from datetime import datetime, timedelta
 
 def get_user(db: Session, user_id: int):
@@ -11,8 +13,13 @@ def get_user(db: Session, user_id: int):
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = db.query(models.User).order_by(models.User.id)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
 
 def create_user(db: Session, user: schemas.UserCreate):
     hashed_password = get_password_hash(user.password)
@@ -39,20 +46,36 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
     
     db.commit()
     db.refresh(db_user)
+    principal_cache.invalidate_user(user_id)
     return db_user
 
 def delete_user(db: Session, user_id: int):
     db_user = get_user(db, user_id)
     if db_user:
+        first_conversion_at = db.query(models.UserStats.first_conversion_at).filter(
+            models.UserStats.user_id == user_id
+        ).scalar()
+        partitions.anonymize_user(db, user_id)
+        # SQLite не проверяет внешние ключи, поэтому зависимые строки удаляем сами
+        db.query(models.UserStats).filter(models.UserStats.user_id == user_id).delete(synchronize_session=False)
+        db.query(models.UserCurrencyStats).filter(models.UserCurrencyStats.user_id == user_id).delete(synchronize_session=False)
+        db.query(models.IdempotencyKey).filter(models.IdempotencyKey.user_id == user_id).delete(synchronize_session=False)
         db.delete(db_user)
         db.commit()
+        principal_cache.invalidate_user(user_id)
+        partitions.anonymize_archives(db.scalars(partitions.user_archives_query(first_conversion_at)).all(), user_id)
     return db_user
 
 def get_currency_rate(db: Session, rate_id: int):
     return db.query(models.CurrencyRate).filter(models.CurrencyRate.id == rate_id).first()
 
-def get_currency_rates(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.CurrencyRate).offset(skip).limit(limit).all()
+def get_currency_rates(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = db.query(models.CurrencyRate).order_by(models.CurrencyRate.id)
+    if after_id is not None:
+        query = query.filter(models.CurrencyRate.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
 
 def get_active_currency_rate(db: Session, base_currency: str, target_currency: str):
     return db.query(models.CurrencyRate).filter(
@@ -67,12 +90,19 @@ def create_currency_rate(db: Session, currency_rate: schemas.CurrencyRateCreate)
     existing_rate = get_active_currency_rate(db, currency_rate.base_currency, currency_rate.target_currency)
     if existing_rate:
         existing_rate.is_active = False
-        db.commit()
     
+    # Замена курса — одна транзакция вместе с журналом изменений и версией таблицы курсов
     db_currency_rate = models.CurrencyRate(**currency_rate.dict())
     db.add(db_currency_rate)
+    db.flush()
+    changes = [rate_history.change_row(db_currency_rate, True)]
+    if existing_rate:
+        changes.insert(0, rate_history.change_row(existing_rate, False))
+    rate_history.record_changes(db, changes)
+    rate_versions.bump(db)
     db.commit()
     db.refresh(db_currency_rate)
+    rate_cache.rebuild(db)
     return db_currency_rate
 
 def update_currency_rate(db: Session, rate_id: int, rate_update: schemas.CurrencyRateUpdate):
@@ -80,41 +110,99 @@ def update_currency_rate(db: Session, rate_id: int, rate_update: schemas.Currenc
     if db_rate:
         for field, value in rate_update.dict(exclude_unset=True).items():
             setattr(db_rate, field, value)
+        rate_history.record_changes(db, [rate_history.change_row(db_rate, db_rate.is_active)])
+        rate_versions.bump(db)
         db.commit()
         db.refresh(db_rate)
+        rate_cache.rebuild(db)
     return db_rate
 
 def delete_currency_rate(db: Session, rate_id: int):
     db_currency_rate = get_currency_rate(db, rate_id)
     if db_currency_rate:
         db.delete(db_currency_rate)
+        rate_history.record_changes(db, [rate_history.change_row(db_currency_rate, False)])
+        rate_versions.bump(db)
         db.commit()
+        rate_cache.rebuild(db)
     return db_currency_rate
 
 # Conversion History CRUD
 def create_conversion(db: Session, conversion: schemas.ConversionResponse, user_id: int):
-    db_conversion = models.ConversionHistory(
-        user_id=user_id,
-        amount=conversion.amount,
-        from_currency=conversion.from_currency,
-        to_currency=conversion.to_currency,
-        converted_amount=conversion.converted_amount,
-        rate_used=conversion.rate_used
-    )
+    row = conversion_row(conversion, user_id)
+    db_conversion = models.ConversionHistory(**row)
     db.add(db_conversion)
+    apply_conversion_aggregates(db, [row])
     db.commit()
     db.refresh(db_conversion)
     return db_conversion
 
-def get_user_conversions(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.ConversionHistory).filter(
+def apply_conversion_aggregates(db: Session, rows: List[dict]):
+    # Статистика пользователей и сводки пишутся в той же транзакции, что и история
+    user_stats.apply_conversions(db, rows)
+    rollups.apply_conversions(db, rows)
+
+def conversion_row(conversion: schemas.ConversionResponse, user_id: int) -> dict:
+    return {
+        "user_id": user_id,
+        "amount": conversion.amount,
+        "from_currency": conversion.from_currency,
+        "to_currency": conversion.to_currency,
+        "converted_amount": conversion.converted_amount,
+        "rate_used": conversion.rate_used,
+        "timestamp": conversion.timestamp,
+    }
+
+def create_conversions(db: Session, conversions: List[schemas.ConversionResponse], user_id: int):
+    if not conversions:
+        return []
+    rows = [conversion_row(conversion, user_id) for conversion in conversions]
+    stmt = insert(models.ConversionHistory).returning(
+        models.ConversionHistory.id, sort_by_parameter_order=True
+    )
+    ids = db.scalars(stmt, rows).all()
+    apply_conversion_aggregates(db, rows)
+    db.commit()
+    return ids
+
+def insert_conversion_rows(db: Session, rows: List[dict]):
+    if rows:
+        db.execute(insert(models.ConversionHistory), rows)
+        apply_conversion_aggregates(db, rows)
+        db.commit()
+
+def conversion_keyset_clause(after: Tuple[datetime, int]):
+    timestamp, conversion_id = after
+    return or_(
+        models.ConversionHistory.timestamp < timestamp,
+        and_(
+            models.ConversionHistory.timestamp == timestamp,
+            models.ConversionHistory.id < conversion_id
+        )
+    )
+
+def conversion_history_order():
+    return (models.ConversionHistory.timestamp.desc(), models.ConversionHistory.id.desc())
+
+def get_user_conversions(db: Session, user_id: int, skip: int = 0, limit: int = 100,
+                         after: Optional[Tuple[datetime, int]] = None):
+    query = db.query(models.ConversionHistory).filter(
         models.ConversionHistory.user_id == user_id
-    ).order_by(models.ConversionHistory.timestamp.desc()).offset(skip).limit(limit).all()
+    ).order_by(*conversion_history_order())
+    if after is not None:
+        query = query.filter(conversion_keyset_clause(after))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
 
 def get_conversion_by_id(db: Session, conversion_id: int):
     return db.query(models.ConversionHistory).filter(models.ConversionHistory.id == conversion_id).first()
 
-def get_all_conversions(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.ConversionHistory).order_by(
-        models.ConversionHistory.timestamp.desc()
-    ).offset(skip).limit(limit).all()
\ No newline at end of file
+def get_all_conversions(db: Session, skip: int = 0, limit: int = 100,
+                        after: Optional[Tuple[datetime, int]] = None):
+    query = db.query(models.ConversionHistory).order_by(*conversion_history_order())
+    if after is not None:
+        query = query.filter(conversion_keyset_clause(after))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
\ No newline at end of file
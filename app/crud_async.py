@@ -0,0 +1,306 @@
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, case, delete, func, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+from typing import List, Optional, Tuple
+from app import models, partitions, schemas, crud, auth, rate_history, rate_versions, user_stats, rollups
+from app.rate_cache import rate_cache
+from app.principal_cache import principal_cache
+
+# Строк на одну вставку истории в SQLite: 7 параметров на строку, старые сборки принимают не больше 999
+SQLITE_INSERT_CHUNK = 100
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.scalar(select(models.User).where(models.User.id == user_id))
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username))
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    stmt = select(models.User)
+    if after_id is not None:
+        stmt = stmt.where(models.User.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+    return (await db.scalars(stmt.order_by(models.User.id).limit(limit))).all()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await auth.get_password_hash_async(user.password)
+    db_user = models.User(
+        username=user.username,
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def update_user(db: AsyncSession, user_id: int, user_update: schemas.UserUpdate):
+    db_user = await get_user(db, user_id)
+    if not db_user:
+        return None
+
+    update_data = user_update.dict(exclude_unset=True)
+    if "password" in update_data:
+        update_data["hashed_password"] = await auth.get_password_hash_async(update_data.pop("password"))
+
+    for field, value in update_data.items():
+        setattr(db_user, field, value)
+
+    await db.commit()
+    await db.refresh(db_user)
+    principal_cache.invalidate_user(user_id)
+    return db_user
+
+async def delete_user(db: AsyncSession, user_id: int):
+    db_user = await get_user(db, user_id)
+    if db_user:
+        first_conversion_at = await db.scalar(
+            select(models.UserStats.first_conversion_at).where(models.UserStats.user_id == user_id)
+        )
+        await db.run_sync(partitions.anonymize_user, user_id)
+        # SQLite не проверяет внешние ключи, поэтому зависимые строки удаляем сами
+        await db.execute(delete(models.UserStats).where(models.UserStats.user_id == user_id))
+        await db.execute(delete(models.UserCurrencyStats).where(models.UserCurrencyStats.user_id == user_id))
+        await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.user_id == user_id))
+        await db.delete(db_user)
+        await db.commit()
+        principal_cache.invalidate_user(user_id)
+        archives = (await db.scalars(partitions.user_archives_query(first_conversion_at))).all()
+        if archives:
+            await asyncio.to_thread(partitions.anonymize_archives, archives, user_id)
+    return db_user
+
+async def get_currency_rate(db: AsyncSession, rate_id: int):
+    return await db.scalar(select(models.CurrencyRate).where(models.CurrencyRate.id == rate_id))
+
+async def get_currency_rates(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    stmt = select(models.CurrencyRate)
+    if after_id is not None:
+        stmt = stmt.where(models.CurrencyRate.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+    return (await db.scalars(stmt.order_by(models.CurrencyRate.id).limit(limit))).all()
+
+async def get_active_currency_rate(db: AsyncSession, base_currency: str, target_currency: str):
+    return await db.scalar(select(models.CurrencyRate).where(
+        and_(
+            models.CurrencyRate.base_currency == base_currency,
+            models.CurrencyRate.target_currency == target_currency,
+            models.CurrencyRate.is_active == True
+        )
+    ).limit(1))
+
+async def create_currency_rate(db: AsyncSession, currency_rate: schemas.CurrencyRateCreate):
+    existing_rate = await get_active_currency_rate(db, currency_rate.base_currency, currency_rate.target_currency)
+    if existing_rate:
+        existing_rate.is_active = False
+
+    db_currency_rate = models.CurrencyRate(**currency_rate.dict())
+    db.add(db_currency_rate)
+    await db.flush()
+    changes = [rate_history.change_row(db_currency_rate, True)]
+    if existing_rate:
+        changes.insert(0, rate_history.change_row(existing_rate, False))
+    await rate_history.record_changes_async(db, changes)
+    await rate_versions.bump_async(db)
+    await db.commit()
+    await db.refresh(db_currency_rate)
+    await rate_cache.rebuild_async(db)
+    return db_currency_rate
+
+async def update_currency_rate(db: AsyncSession, rate_id: int, rate_update: schemas.CurrencyRateUpdate):
+    db_rate = await get_currency_rate(db, rate_id)
+    if db_rate:
+        for field, value in rate_update.dict(exclude_unset=True).items():
+            setattr(db_rate, field, value)
+        await rate_history.record_changes_async(db, [rate_history.change_row(db_rate, db_rate.is_active)])
+        await rate_versions.bump_async(db)
+        await db.commit()
+        await db.refresh(db_rate)
+        await rate_cache.rebuild_async(db)
+    return db_rate
+
+async def toggle_currency_rate(db: AsyncSession, rate_id: int):
+    db_rate = await get_currency_rate(db, rate_id)
+    if db_rate:
+        db_rate.is_active = not db_rate.is_active
+        await rate_history.record_changes_async(db, [rate_history.change_row(db_rate, db_rate.is_active)])
+        await rate_versions.bump_async(db)
+        await db.commit()
+        await rate_cache.rebuild_async(db)
+    return db_rate
+
+async def import_currency_rates(db: AsyncSession, rates: List[schemas.CurrencyRateCreate]) -> dict:
+    # Одна выборка, один UPDATE, один INSERT и один коммит на весь файл
+    requested = {(rate.base_currency, rate.target_currency): rate.rate for rate in rates}
+    rows = (await db.execute(
+        select(
+            models.CurrencyRate.id,
+            models.CurrencyRate.base_currency,
+            models.CurrencyRate.target_currency,
+            models.CurrencyRate.rate,
+        ).where(
+            models.CurrencyRate.is_active == True,
+            models.CurrencyRate.base_currency.in_({base for base, _ in requested}),
+        ).order_by(models.CurrencyRate.id)
+    )).all()
+
+    active = {}
+    active_rows = {}
+    for row in rows:
+        pair = (row.base_currency, row.target_currency)
+        if pair in requested:
+            active[pair] = row.rate
+            active_rows.setdefault(pair, []).append(row)
+
+    changed = [pair for pair, value in requested.items() if active.get(pair) != value]
+    superseded = [row for pair in changed for row in active_rows.get(pair, ())]
+
+    if changed:
+        if superseded:
+            await db.execute(
+                update(models.CurrencyRate)
+                .where(models.CurrencyRate.id.in_([row.id for row in superseded]))
+                .values(is_active=False)
+            )
+        created = (await db.execute(
+            insert(models.CurrencyRate).returning(
+                models.CurrencyRate.id,
+                models.CurrencyRate.base_currency,
+                models.CurrencyRate.target_currency,
+                models.CurrencyRate.rate,
+                sort_by_parameter_order=True,
+            ),
+            [
+                {
+                    "base_currency": base,
+                    "target_currency": target,
+                    "rate": requested[(base, target)],
+                    "is_active": True,
+                }
+                for base, target in changed
+            ],
+        )).all()
+        await rate_history.record_changes_async(
+            db,
+            [rate_history.change_row(row, False) for row in superseded]
+            + [rate_history.change_row(row, True) for row in created],
+        )
+        await rate_versions.bump_async(db)
+        await db.commit()
+        await rate_cache.rebuild_async(db)
+
+    return {
+        "created": len(changed),
+        "deactivated": len(superseded),
+        "unchanged": len(requested) - len(changed),
+        "changed_pairs": [f"{base}/{target}" for base, target in changed],
+    }
+
+async def delete_currency_rate(db: AsyncSession, rate_id: int):
+    db_currency_rate = await get_currency_rate(db, rate_id)
+    if db_currency_rate:
+        await db.delete(db_currency_rate)
+        await rate_history.record_changes_async(db, [rate_history.change_row(db_currency_rate, False)])
+        await rate_versions.bump_async(db)
+        await db.commit()
+        await rate_cache.rebuild_async(db)
+    return db_currency_rate
+
+# Conversion History CRUD
+async def create_conversion(db: AsyncSession, conversion: schemas.ConversionResponse, user_id: int):
+    row = crud.conversion_row(conversion, user_id)
+    db_conversion = models.ConversionHistory(**row)
+    db.add(db_conversion)
+    await apply_conversion_aggregates(db, [row])
+    await db.commit()
+    await db.refresh(db_conversion)
+    return db_conversion
+
+async def apply_conversion_aggregates(db: AsyncSession, rows: List[dict]):
+    await user_stats.apply_conversions_async(db, rows)
+    await rollups.apply_conversions_async(db, rows)
+
+async def create_conversions(db: AsyncSession, conversions: List[schemas.ConversionResponse], user_id: int,
+                             commit: bool = True):
+    if not conversions:
+        return []
+    rows = [crud.conversion_row(conversion, user_id) for conversion in conversions]
+    table = models.ConversionHistory
+    if db.bind.dialect.name == "sqlite":
+        # SQLite не сопоставляет RETURNING с порядком строк, и SQLAlchemy вставлял бы их по одной.
+        # Одна вставка с VALUES раздаёт id по возрастанию в порядке строк, поэтому порядок даёт сортировка
+        ids = []
+        for start in range(0, len(rows), SQLITE_INSERT_CHUNK):
+            stmt = insert(table).values(rows[start:start + SQLITE_INSERT_CHUNK]).returning(table.id)
+            ids.extend(sorted((await db.scalars(stmt)).all()))
+    else:
+        stmt = insert(table).returning(table.id, sort_by_parameter_order=True)
+        ids = (await db.scalars(stmt, rows)).all()
+    await apply_conversion_aggregates(db, rows)
+    if commit:
+        await db.commit()
+    return ids
+
+async def insert_conversion_rows(db: AsyncSession, rows: List[dict]):
+    if rows:
+        await db.execute(insert(models.ConversionHistory), rows)
+        await apply_conversion_aggregates(db, rows)
+        await db.commit()
+
+async def reserve_conversion_ids(db: AsyncSession, count: int) -> List[int]:
+    """Резервирует у БД count id для conversion_history: их не выдаст ни другой воркер, ни автоинкремент Postgres."""
+    if db.bind.dialect.name == "postgresql":
+        ids = (await db.scalars(
+            text("SELECT nextval(pg_get_serial_sequence('conversion_history', 'id')) FROM generate_series(1, :count)"),
+            {"count": count},
+        )).all()
+        await db.commit()
+        return list(ids)
+
+    table = models.IdAllocation
+    # Строки, вставленные мимо резерва, сдвигают начало следующего блока за свой id
+    first_free = select(func.coalesce(func.max(models.ConversionHistory.id), 0) + 1).scalar_subquery()
+    while True:
+        result = await db.execute(
+            update(table).where(table.name == "conversion_history")
+            .values(next_id=case((table.next_id > first_free, table.next_id), else_=first_free) + count)
+        )
+        if result.rowcount == 0:
+            try:
+                await db.execute(insert(table).values(name="conversion_history", next_id=first_free + count))
+            except IntegrityError:
+                # Строку счётчика одновременно завёл другой воркер
+                await db.rollback()
+                continue
+        end = await db.scalar(select(table.next_id).where(table.name == "conversion_history"))
+        await db.commit()
+        return list(range(end - count, end))
+
+async def get_existing_conversion_ids(db: AsyncSession, ids: List[int]) -> set:
+    return set((await db.scalars(
+        select(models.ConversionHistory.id).where(models.ConversionHistory.id.in_(ids))
+    )).all())
+
+async def get_user_conversions(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100,
+                               after: Optional[Tuple[datetime, int]] = None):
+    stmt = select(models.ConversionHistory).where(models.ConversionHistory.user_id == user_id)
+    if after is not None:
+        stmt = stmt.where(crud.conversion_keyset_clause(after))
+    else:
+        stmt = stmt.offset(skip)
+    return (await db.scalars(stmt.order_by(*crud.conversion_history_order()).limit(limit))).all()
+
+async def get_conversion_by_id(db: AsyncSession, conversion_id: int):
+    return await db.scalar(select(models.ConversionHistory).where(models.ConversionHistory.id == conversion_id))
+
+async def get_all_conversions(db: AsyncSession, skip: int = 0, limit: int = 100,
+                              after: Optional[Tuple[datetime, int]] = None):
+    stmt = select(models.ConversionHistory)
+    if after is not None:
+        stmt = stmt.where(crud.conversion_keyset_clause(after))
+    else:
+        stmt = stmt.offset(skip)
+    return (await db.scalars(stmt.order_by(*crud.conversion_history_order()).limit(limit))).all()
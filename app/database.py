@@ -1,15 +1,157 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
+from app.config import settings
+
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./currency_converter.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Асинхронный драйвер для каждой СУБД; синхронный драйвер из DATABASE_URL
+# (postgresql+psycopg2, sqlite+pysqlite, ...) заменяется на него
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+KNOWN_ASYNC_DRIVERS = {"aiosqlite", "asyncpg", "psycopg_async", "aiomysql", "asyncmy"}
+
+
+def get_async_database_url(url: str) -> str:
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    parsed = make_url(url)
+    if parsed.get_driver_name() in KNOWN_ASYNC_DRIVERS:
+        return url
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(
+            f"No async driver known for database URL scheme '{parsed.drivername}'; set ASYNC_DATABASE_URL explicitly"
+        )
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", get_async_database_url(SQLALCHEMY_DATABASE_URL))
+
+DB_PROFILES = ("basic", "sqlite", "server")
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return url.rstrip("/") in ("sqlite:", "sqlite+aiosqlite:") or ":memory:" in url or "mode=memory" in url
+
+
+def resolve_profile(url: str, name: str = "auto") -> str:
+    name = (name or "auto").lower()
+    if name == "auto":
+        return "sqlite" if _is_sqlite(url) else "server"
+    if name not in DB_PROFILES:
+        raise ValueError(f"Unknown database profile: {name}")
+    return name
+
+
+def sqlite_pragmas(url: str) -> dict:
+    pragmas = {
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+    }
+    # У базы в памяти нет файла журнала, WAL ей не нужен
+    if not _is_memory_sqlite(url):
+        pragmas = {"journal_mode": "WAL", **pragmas}
+    return pragmas
+
+
+def engine_options(url: str, profile: str) -> dict:
+    options = {}
+    if _is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+    if profile == "basic":
+        return options
+
+    # Для StaticPool/SingletonThreadPool (SQLite в памяти) параметры пула не применимы
+    if not _is_memory_sqlite(url):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    if profile == "server":
+        options.update(pool_pre_ping=True, pool_recycle=settings.DB_POOL_RECYCLE)
+    return options
+
+
+def apply_sqlite_pragmas(sync_engine, pragmas: dict):
+    """Выполняет PRAGMA на каждом новом соединении. Для async-движка передаётся async_engine.sync_engine."""
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def make_engine(url: str, profile: str = "auto"):
+    profile = resolve_profile(url, profile)
+    db_engine = create_engine(url, **engine_options(url, profile))
+    if profile == "sqlite" and _is_sqlite(url):
+        apply_sqlite_pragmas(db_engine, sqlite_pragmas(url))
+    return db_engine
+
+
+def make_async_engine(url: str, profile: str = "auto"):
+    profile = resolve_profile(url, profile)
+    options = engine_options(url, profile)
+    # aiosqlite и так держит соединение в своём потоке
+    options.pop("connect_args", None)
+    db_engine = create_async_engine(url, **options)
+    if profile == "sqlite" and _is_sqlite(url):
+        apply_sqlite_pragmas(db_engine.sync_engine, sqlite_pragmas(url))
+    return db_engine
+
+
+def pool_stats(db_engine) -> dict:
+    pool = db_engine.pool
+    stats = {"pool": type(pool).__name__}
+    # У QueuePool это методы, у SingletonThreadPool size — просто число
+    for name in ("size", "checkedin", "checkedout", "overflow", "timeout"):
+        value = getattr(pool, name, None)
+        if callable(value):
+            stats[name] = value()
+        elif value is not None:
+            stats[name] = value
+    return stats
+
+
+DB_PROFILE = resolve_profile(SQLALCHEMY_DATABASE_URL, settings.DB_PROFILE)
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL, DB_PROFILE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = make_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, DB_PROFILE)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+def database_stats() -> dict:
+    stats = {
+        "profile": DB_PROFILE,
+        "dialect": engine.dialect.name,
+        "pools": {
+            "sync": pool_stats(engine),
+            "async": pool_stats(async_engine.sync_engine),
+        },
+    }
+    if DB_PROFILE == "sqlite" and _is_sqlite(SQLALCHEMY_DATABASE_URL):
+        stats["sqlite_pragmas"] = sqlite_pragmas(SQLALCHEMY_DATABASE_URL)
+    return stats
+
 Base = declarative_base()
 
 def get_db():
@@ -17,4 +159,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,108 @@
+import csv
+import heapq
+import io
+import json
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+from app import partitions
+from app.database import SessionLocal
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    "id",
+    "timestamp",
+    "amount",
+    "from_currency",
+    "to_currency",
+    "converted_amount",
+    "rate_used",
+)
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def conversion_export_query(
+    user_id: int,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    from_currency: Optional[str] = None,
+    to_currency: Optional[str] = None,
+):
+    # Горячая таблица вместе с помесячными партициями; выгруженные в архив месяцы добавляет iter_rows
+    history = partitions.history_view.c
+    stmt = select(*(getattr(history, column) for column in EXPORT_COLUMNS)).where(history.user_id == user_id)
+    if date_from is not None:
+        stmt = stmt.where(history.timestamp >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(history.timestamp < date_to)
+    if from_currency is not None:
+        stmt = stmt.where(history.from_currency == from_currency)
+    if to_currency is not None:
+        stmt = stmt.where(history.to_currency == to_currency)
+    return stmt.order_by(history.timestamp, history.id)
+
+
+def _order_key(row):
+    timestamp = row[1]
+    return (partitions.naive_utc(timestamp) if timestamp is not None else datetime.min, row[0])
+
+
+def iter_rows(stmt, chunk_size: int = EXPORT_CHUNK_SIZE,
+              archived: Optional[partitions.ArchiveFilter] = None) -> Iterator[list]:
+    db = SessionLocal()
+    try:
+        archives = partitions.iter_archived(db, archived, EXPORT_COLUMNS) if archived is not None else []
+        result = db.execute(stmt.execution_options(yield_per=chunk_size, stream_results=True))
+        if not archives:
+            for partition in result.partitions():
+                yield partition
+            return
+        # Архивы почти всегда старше строк в БД, но общий порядок (timestamp, id) держим слиянием
+        merged = heapq.merge(*archives, result, key=_order_key)
+        while True:
+            chunk = list(islice(merged, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        db.close()
+
+
+def _format_timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_csv(stmt, archived: Optional[partitions.ArchiveFilter] = None,
+             chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in iter_rows(stmt, chunk_size, archived):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((row[0], _format_timestamp(row[1]), *row[2:]) for row in rows)
+        yield buffer.getvalue()
+
+
+def iter_ndjson(stmt, archived: Optional[partitions.ArchiveFilter] = None,
+                chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    for rows in iter_rows(stmt, chunk_size, archived):
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, (row[0], _format_timestamp(row[1]), *row[2:]))), ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+
+EXPORT_FORMATTERS = {
+    "csv": iter_csv,
+    "ndjson": iter_ndjson,
+}
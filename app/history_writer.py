@@ -0,0 +1,352 @@
+import asyncio
+import glob
+import json
+import os
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app import crud, crud_async, schemas
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.startup import try_lock_file
+
+_STOP = object()
+RETRY_BASE_SECONDS = 0.1
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _decode(row: dict) -> dict:
+    if row.get("timestamp") is not None:
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return row
+
+
+class JournalSegment:
+    __slots__ = ("path", "file", "written", "pending")
+
+    def __init__(self, path: str, file):
+        self.path = path
+        self.file = file
+        self.written = 0
+        # Строки из сегмента, которые ещё не записаны в БД
+        self.pending = 0
+
+
+class HistoryJournal:
+    """Журнал принятых, но ещё не записанных в БД строк истории.
+
+    Строка попадает в журнал до ответа клиенту. Сегмент удаляется, когда все его строки
+    записаны; сегменты упавшего процесса дописывает в БД следующий запуск. Файл сегмента
+    заблокирован, пока его процесс жив, поэтому чужие сегменты воркеры не трогают.
+    """
+
+    def __init__(self, directory: str, rotate_rows: int):
+        self.directory = directory
+        self.rotate_rows = rotate_rows
+        self._segment: Optional[JournalSegment] = None
+        self._segments = 0
+
+    def _open_segment(self) -> JournalSegment:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"history-{os.getpid()}-{time.time_ns()}.ndjson")
+        file = open(path, "a", encoding="utf-8")
+        try_lock_file(file)
+        self._segments += 1
+        return JournalSegment(path, file)
+
+    def append(self, rows: List[dict]) -> JournalSegment:
+        segment = self._segment
+        if segment is None or segment.written >= self.rotate_rows:
+            if segment is not None and segment.pending == 0:
+                self._remove(segment)
+            segment = self._segment = self._open_segment()
+        segment.file.write("".join(json.dumps(row, default=_encode) + "\n" for row in rows))
+        # Без fsync: строки переживут падение процесса, но не сбой питания
+        segment.file.flush()
+        segment.written += len(rows)
+        segment.pending += len(rows)
+        return segment
+
+    def done(self, segment: JournalSegment, count: int):
+        segment.pending -= count
+        if segment.pending == 0 and segment is not self._segment:
+            self._remove(segment)
+
+    def _remove(self, segment: JournalSegment):
+        try:
+            os.remove(segment.path)
+        except OSError as e:
+            print(f"⚠️ Не удалось удалить сегмент журнала {segment.path}: {e}")
+        segment.file.close()
+        self._segments -= 1
+
+    def close(self):
+        segment, self._segment = self._segment, None
+        if segment is None:
+            return
+        if segment.pending == 0:
+            self._remove(segment)
+        else:
+            segment.file.close()
+            self._segments -= 1
+
+    def claim_orphans(self) -> List[Tuple[JournalSegment, List[dict]]]:
+        """Захватывает сегменты завершившихся процессов и читает их строки."""
+        orphans = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "history-*.ndjson"))):
+            file = open(path, "r+", encoding="utf-8")
+            if not try_lock_file(file):
+                # Сегмент живого воркера
+                file.close()
+                continue
+            file.seek(0)
+            rows = []
+            for line in file:
+                try:
+                    rows.append(_decode(json.loads(line)))
+                except ValueError:
+                    # Процесс упал на середине записи: клиент этот ответ не получил
+                    print(f"⚠️ Пропущена недописанная строка в {path}")
+            orphans.append((JournalSegment(path, file), rows))
+        return orphans
+
+    def release_orphan(self, segment: JournalSegment):
+        os.remove(segment.path)
+        segment.file.close()
+
+    def reject(self, rows: List[dict]):
+        """Откладывает строки, которые БД отвергает, в отдельный файл для ручного разбора."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"rejected-{os.getpid()}.ndjson")
+        with open(path, "a", encoding="utf-8") as file:
+            file.write("".join(json.dumps(row, default=_encode) + "\n" for row in rows))
+
+    @property
+    def segments(self) -> int:
+        return self._segments
+
+
+class HistoryWriter:
+    def __init__(self, max_queue_size: int, batch_size: int, flush_interval: float,
+                 id_block_size: int, journal_dir: str, retry_max_seconds: float):
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self.retry_max_seconds = retry_max_seconds
+        self.journal = HistoryJournal(journal_dir, rotate_rows=max(batch_size, max_queue_size))
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._free_ids: deque = deque()
+        self._id_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self._abandoned = 0
+        self.enqueued = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.rejected_rows = 0
+        self.recovered_rows = 0
+        self.id_blocks = 0
+        self.backpressure_waits = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._abandoned = 0
+        self._id_lock = asyncio.Lock()
+        await self._recover()
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        task = self._task
+        self._stopping = True
+        if not self._queue.full():
+            self._queue.put_nowait(_STOP)
+        await task
+        self._task = None
+        left = self._abandoned
+        while not self._queue.empty():
+            if self._queue.get_nowait() is not _STOP:
+                left += 1
+        if left:
+            print(f"⚠️ {left} строк истории не записаны в БД и будут дописаны из журнала при следующем запуске")
+        self.journal.close()
+
+    async def _recover(self):
+        for segment, rows in self.journal.claim_orphans():
+            if rows:
+                await self._write(rows)
+                self.recovered_rows += len(rows)
+                print(f"✅ Из журнала дописано строк истории: {len(rows)}")
+            self.journal.release_orphan(segment)
+
+    async def allocate_ids(self, count: int) -> List[int]:
+        async with self._id_lock:
+            while len(self._free_ids) < count:
+                async with AsyncSessionLocal() as db:
+                    self._free_ids.extend(await crud_async.reserve_conversion_ids(
+                        db, max(self.id_block_size, count - len(self._free_ids))
+                    ))
+                self.id_blocks += 1
+            return [self._free_ids.popleft() for _ in range(count)]
+
+    async def submit(self, conversions: List[schemas.ConversionResponse], user_id: int) -> List[int]:
+        if not self.running:
+            raise RuntimeError("History writer is not running")
+        ids = await self.allocate_ids(len(conversions))
+        rows = []
+        for conversion_id, conversion in zip(ids, conversions):
+            row = crud.conversion_row(conversion, user_id)
+            row["id"] = conversion_id
+            rows.append(row)
+        segment = self.journal.append(rows)
+        for row in rows:
+            if self._queue.full():
+                self.backpressure_waits += 1
+            await self._queue.put((segment, row))
+            self.enqueued += 1
+        return ids
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                written = await self._write([row for _, row in batch])
+            except Exception as e:
+                # Строки пакета остаются в журнале, поток записи продолжает работу
+                print(f"❌ Сбой потока записи истории: {str(e)}")
+                continue
+            if not written:
+                self._abandoned = len(batch)
+                break
+            for segment, count in Counter(segment for segment, _ in batch).items():
+                self.journal.done(segment, count)
+            if self._stopping and queue.empty():
+                break
+
+    async def _write(self, rows: List[dict]) -> bool:
+        """Пишет строки, повторяя с нарастающей паузой; False — только если при остановке БД недоступна."""
+        delay = RETRY_BASE_SECONDS
+        dedupe = isolate = False
+        while True:
+            started = time.perf_counter()
+            try:
+                if dedupe:
+                    remaining = await self._unwritten(rows)
+                    # Ни одна строка не записана: БД отвергает саму строку, а не повтор
+                    isolate = len(remaining) == len(rows)
+                    rows, dedupe = remaining, False
+                    if not rows:
+                        return True
+                if isolate:
+                    await self._write_each(rows)
+                else:
+                    async with AsyncSessionLocal() as db:
+                        await crud_async.insert_conversion_rows(db, rows)
+            except IntegrityError:
+                # Повтор после обрыва на commit: часть строк с этими id уже в БД
+                dedupe = True
+                continue
+            except Exception as e:
+                self.flush_errors += 1
+                print(f"❌ Ошибка записи истории конвертаций ({len(rows)} строк): {str(e)}")
+                if self._stopping:
+                    return False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max_seconds)
+                continue
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+            self.last_flush_seconds = elapsed
+            self.total_flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            return True
+
+    async def _unwritten(self, rows: List[dict]) -> List[dict]:
+        async with AsyncSessionLocal() as db:
+            existing = await crud_async.get_existing_conversion_ids(db, [row["id"] for row in rows])
+        return [row for row in rows if row["id"] not in existing]
+
+    async def _write_each(self, rows: List[dict]):
+        for row in rows:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await crud_async.insert_conversion_rows(db, [row])
+            except IntegrityError as e:
+                if not await self._unwritten([row]):
+                    continue
+                self.rejected_rows += 1
+                self.journal.reject([row])
+                print(f"❌ БД отвергла строку истории {row['id']}, она сохранена в журнале отклонённых: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.HISTORY_WRITE_BEHIND,
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max_size": self.max_queue_size,
+            "enqueued": self.enqueued,
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "rejected_rows": self.rejected_rows,
+            "recovered_rows": self.recovered_rows,
+            "journal_segments": self.journal.segments,
+            "reserved_id_blocks": self.id_blocks,
+            "free_reserved_ids": len(self._free_ids),
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.flushes if self.flushes else 0.0,
+        }
+
+
+history_writer = HistoryWriter(
+    max_queue_size=settings.HISTORY_QUEUE_MAX_SIZE,
+    batch_size=settings.HISTORY_FLUSH_BATCH_SIZE,
+    flush_interval=settings.HISTORY_FLUSH_INTERVAL_MS / 1000,
+    id_block_size=settings.HISTORY_ID_BLOCK_SIZE,
+    journal_dir=settings.HISTORY_JOURNAL_DIR,
+    retry_max_seconds=settings.HISTORY_RETRY_MAX_SECONDS,
+)
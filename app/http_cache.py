@@ -0,0 +1,57 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+from app.config import settings
+from app.rate_cache import RateSnapshot
+
+
+def _as_utc(moment: datetime) -> datetime:
+    # SQLite отдаёт время без часового пояса, но хранит его в UTC
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def rates_etag(snapshot: RateSnapshot) -> str:
+    return f'"rates-{snapshot.version}"'
+
+
+def rates_cache_headers(snapshot: RateSnapshot) -> Dict[str, str]:
+    headers = {
+        "ETag": rates_etag(snapshot),
+        "Cache-Control": f"public, max-age={settings.RATES_CACHE_MAX_AGE}, must-revalidate",
+    }
+    if snapshot.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_as_utc(snapshot.last_modified), usegmt=True)
+    return headers
+
+
+def _modified_since(last_modified: Optional[datetime], header: str) -> bool:
+    if last_modified is None:
+        return True
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return _as_utc(last_modified).replace(microsecond=0) > since
+
+
+def is_not_modified(request: Request, snapshot: RateSnapshot) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = rates_etag(snapshot)
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        return not _modified_since(snapshot.last_modified, if_modified_since)
+    return False
+
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
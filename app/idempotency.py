@@ -0,0 +1,312 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# Как часто (в захватах новых ключей) удалять из таблицы просроченные записи
+PURGE_EVERY = 1000
+POLL_SECONDS = 0.05
+
+
+class IdempotencyError(Exception):
+    status_code = 409
+
+
+class IdempotencyKeyReused(IdempotencyError):
+    status_code = 422
+
+
+class IdempotencyInProgress(IdempotencyError):
+    status_code = 409
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    body: str
+
+
+def request_fingerprint(payload: str) -> str:
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    # SQLite отдаёт время без пояса (в UTC), Postgres — с поясом
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+class IdempotencyStore:
+    """Ответы на запросы с Idempotency-Key: LRU воркера поверх таблицы idempotency_keys.
+
+    Все обращения идут из event loop, поэтому LRU и словарь выполняющихся запросов
+    не защищены блокировкой. Дубликаты внутри воркера ждут future первого запроса,
+    между воркерами — незавершённую запись в таблице. Пока запрос выполняется, владелец
+    продлевает heartbeat_at; перехватить ключ можно только у владельца без продлений.
+    compute не делает commit: ответ сохраняется в той же транзакции, что и его записи.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, wait_seconds: float, lock_timeout_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.lock_timeout_seconds = lock_timeout_seconds
+        self._entries: "OrderedDict[Tuple[int, str], tuple]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._claims = 0
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.db_waits = 0
+        self.conflicts = 0
+        self.takeovers = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    async def run(self, db: AsyncSession, user_id: int, key: str, request_hash: str,
+                  compute: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """Возвращает (тело ответа, повтор ли это). compute вызывается не больше одного раза на ключ."""
+        cache_key = (user_id, key)
+        while True:
+            stored = self._get(cache_key)
+            if stored is not None:
+                self.hits += 1
+                return self._replay(stored, request_hash), True
+
+            inflight = self._inflight.get(cache_key)
+            if inflight is None:
+                break
+            self.waits += 1
+            # shield: отмена ожидающего запроса не должна отменять первый
+            stored = await asyncio.shield(inflight)
+            if stored is not None:
+                return self._replay(stored, request_hash), True
+            # Первый запрос упал — ничего не сохранено, пробуем выполнить сами
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        stored = None
+        try:
+            stored, replayed = await self._run_owner(db, user_id, key, request_hash, compute)
+            return stored.body, replayed
+        finally:
+            del self._inflight[cache_key]
+            future.set_result(stored)
+
+    async def _run_owner(self, db: AsyncSession, user_id: int, key: str, request_hash: str,
+                         compute: Callable[[], Awaitable[str]]) -> Tuple[StoredResponse, bool]:
+        stored, expires_at, owner = await self._claim(db, user_id, key, request_hash)
+        if stored is not None:
+            self.db_hits += 1
+            self._put((user_id, key), stored, expires_at)
+            return stored, True
+
+        self.misses += 1
+        table = models.IdempotencyKey
+        finished = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(user_id, key, owner, finished))
+        try:
+            body = await compute()
+            result = await db.execute(
+                update(table)
+                .where(table.user_id == user_id, table.key == key, table.owner == owner)
+                .values(status_code=200, response_body=body)
+            )
+            if result.rowcount != 1:
+                # Ключ перехватили: откатываем свои записи, ответ сохранит новый владелец
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+            await db.commit()
+        except BaseException:
+            await self._release(db, user_id, key, owner)
+            raise
+        finally:
+            # Не отменяем задачу посреди запроса к БД, а даём ей выйти самой
+            finished.set()
+            await heartbeat
+        stored = StoredResponse(request_hash, body)
+        self._put((user_id, key), stored, expires_at)
+        return stored, False
+
+    async def _claim(self, db: AsyncSession, user_id: int, key: str,
+                     request_hash: str) -> Tuple[Optional[StoredResponse], datetime, Optional[str]]:
+        """Заводит незавершённую запись под ключ или возвращает уже сохранённый ответ."""
+        table = models.IdempotencyKey
+        where = (table.user_id == user_id, table.key == key)
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            now = _utcnow()
+            row = (await db.execute(
+                select(table.request_hash, table.status_code, table.response_body, table.created_at,
+                       table.expires_at, table.owner, table.heartbeat_at)
+                .where(*where)
+            )).first()
+
+            if row is None:
+                expires_at = now + timedelta(seconds=self.ttl_seconds)
+                owner = uuid.uuid4().hex
+                try:
+                    await db.execute(insert(table).values(
+                        user_id=user_id, key=key, request_hash=request_hash, created_at=now, expires_at=expires_at,
+                        owner=owner, heartbeat_at=now,
+                    ))
+                    await db.commit()
+                except IntegrityError:
+                    # Тот же ключ только что захватил другой воркер
+                    await db.rollback()
+                    continue
+                await self._maybe_purge(db, now)
+                return None, expires_at, owner
+
+            stored_hash, status_code, body, created_at, expires_at, seen_owner, heartbeat_at = row
+            if _naive_utc(expires_at) <= _naive_utc(now):
+                await db.execute(delete(table).where(*where, table.expires_at == expires_at))
+                await db.commit()
+                continue
+            if stored_hash != request_hash:
+                self.conflicts += 1
+                raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+            if status_code is not None:
+                await db.rollback()
+                return StoredResponse(stored_hash, body), expires_at, None
+
+            last_seen = heartbeat_at or created_at
+            if _naive_utc(last_seen) <= _naive_utc(now) - timedelta(seconds=self.lock_timeout_seconds):
+                # Владелец давно не продлевал захват — его процесс завершился
+                owner = uuid.uuid4().hex
+                result = await db.execute(
+                    update(table).where(
+                        *where, table.status_code.is_(None), table.owner == seen_owner,
+                        table.heartbeat_at == heartbeat_at,
+                    ).values(owner=owner, heartbeat_at=now)
+                )
+                await db.commit()
+                if result.rowcount == 1:
+                    self.takeovers += 1
+                    return None, expires_at, owner
+                continue
+
+            await db.rollback()
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+            self.db_waits += 1
+            await asyncio.sleep(POLL_SECONDS)
+
+    async def _heartbeat(self, user_id: int, key: str, owner: str, finished: asyncio.Event):
+        """Продлевает захват, пока владелец выполняет запрос. Отдельная сессия: сессия запроса занята compute."""
+        table = models.IdempotencyKey
+        while True:
+            try:
+                await asyncio.wait_for(finished.wait(), self.lock_timeout_seconds / 3)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(table).where(
+                            table.user_id == user_id, table.key == key, table.owner == owner,
+                            table.status_code.is_(None),
+                        ).values(heartbeat_at=_utcnow())
+                    )
+                    await db.commit()
+            except Exception as e:
+                print(f"⚠️ Не удалось продлить захват Idempotency-Key: {e}")
+
+    async def _release(self, db: AsyncSession, user_id: int, key: str, owner: str):
+        """Откатывает записи запроса и снимает захват, чтобы повтор выполнил запрос заново."""
+        table = models.IdempotencyKey
+        try:
+            await db.rollback()
+            await db.execute(delete(table).where(
+                table.user_id == user_id, table.key == key, table.owner == owner, table.status_code.is_(None)
+            ))
+            await db.commit()
+        except Exception as e:
+            print(f"⚠️ Не удалось снять захват Idempotency-Key: {e}")
+
+    async def _maybe_purge(self, db: AsyncSession, now: datetime):
+        self._claims += 1
+        if self._claims % PURGE_EVERY:
+            return
+        await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= now))
+        await db.commit()
+
+    def _replay(self, stored: StoredResponse, request_hash: str) -> str:
+        if stored.request_hash != request_hash:
+            self.conflicts += 1
+            raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+        return stored.body
+
+    def _get(self, cache_key: Tuple[int, str]) -> Optional[StoredResponse]:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, stored = entry
+        if expires_at <= time.monotonic():
+            del self._entries[cache_key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(cache_key)
+        return stored
+
+    def _put(self, cache_key: Tuple[int, str], stored: StoredResponse, expires_at: datetime):
+        if self.max_size <= 0:
+            return
+        # Запись в таблице живёт до expires_at — в памяти держим не дольше
+        ttl = (_naive_utc(expires_at) - _naive_utc(_utcnow())).total_seconds()
+        if ttl <= 0:
+            return
+        self._entries[cache_key] = (time.monotonic() + ttl, stored)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.db_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "replay_rate": (self.hits + self.db_hits) / lookups if lookups else 0.0,
+            "waits": self.waits,
+            "db_waits": self.db_waits,
+            "conflicts": self.conflicts,
+            "takeovers": self.takeovers,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+idempotency_store = IdempotencyStore(
+    max_size=settings.IDEMPOTENCY_CACHE_SIZE,
+    ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+    wait_seconds=settings.IDEMPOTENCY_WAIT_SECONDS,
+    lock_timeout_seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT_SECONDS,
+)
@@ -1,55 +1,82 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+# Импортируется первым, чтобы замер времени старта включал импорт остальных модулей
+from app.startup import prepare_database, startup_timer
+
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Response, Form, Query, status
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+import asyncio
 import json
 import os
-import random
 from fastapi.exceptions import RequestValidationError
 from pydantic import ValidationError
 
 
 from app.dependencies import templates
-from app.database import engine, get_db, Base, SessionLocal
-from app import models, schemas, crud, auth
+from app.database import engine, async_engine, get_db, get_async_db, AsyncSessionLocal, SQLALCHEMY_DATABASE_URL, database_stats
+from app import models, schemas, crud, crud_async, auth, pagination, export, rate_import, http_cache, user_stats
 from app.config import settings
 from app.admin import admin_router
-
-Base.metadata.create_all(bind=engine)
-
-def create_initial_admin():
-    db = SessionLocal()
+from app.middleware import CookieTokenMiddleware, MetricsMiddleware, QueryStatsMiddleware
+from app import idempotency, partitions, shared_rates, sql_stats
+from app.metrics import metrics
+from app.rate_cache import rate_cache
+from app.rate_history import rate_history
+from app.rate_stream import rate_broadcaster, parse_pairs, stream_rates
+from app.principal_cache import SharedInvalidations, principal_cache, default_path as principal_cache_path
+from app.idempotency import idempotency_store
+from app.history_writer import history_writer
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_timer.mark("import")
+    # Блокировка файла ждёт синхронно, поэтому уводим подготовку БД из event loop
+    await asyncio.to_thread(prepare_database, startup_timer)
+    shared_watcher = None
+    if principal_cache.max_size > 0:
+        try:
+            principal_cache.attach_shared(SharedInvalidations(
+                settings.PRINCIPAL_CACHE_SHARED_PATH or principal_cache_path(SQLALCHEMY_DATABASE_URL)
+            ))
+        except OSError as e:
+            # Без общих поколений другой воркер держал бы заблокированного пользователя до конца TTL
+            print(f"⚠️ Кеш пользователей выключен: нет общей памяти для инвалидаций ({e})")
+            principal_cache.max_size = 0
+        rate_cache.attach_shared(shared_rates.SharedRates(
+            settings.SHARED_RATES_PATH or shared_rates.default_path(SQLALCHEMY_DATABASE_URL),
+            settings.SHARED_RATES_CAPACITY,
+        ))
+    with startup_timer.phase("warm_up"):
+        # Публикует актуальные курсы в общую память, если она подключена
+        async with AsyncSessionLocal() as db:
+            await rate_cache.rebuild_async(db)
+    if settings.SHARED_RATES_ENABLED:
+        shared_watcher = asyncio.create_task(
+            shared_rates.watch(rate_cache, settings.SHARED_RATES_POLL_MS / 1000)
+        )
+    if settings.HISTORY_WRITE_BEHIND:
+        await history_writer.start()
+    ready = startup_timer.mark_ready()
+    metrics.set_startup_seconds(ready)
+    print(f"✅ Приложение готово за {ready * 1000:.0f} мс (pid {os.getpid()})")
     try:
-        ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
-        ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
-        
-        admin_user = crud.get_user_by_username(db, username=ADMIN_USERNAME)
-        
-        if not admin_user:
-            user_create = schemas.UserCreate(
-                username=ADMIN_USERNAME,
-                password=ADMIN_PASSWORD
-            )
-            admin_user = crud.create_user(db=db, user=user_create)
-            print(f"✅ Администратор '{ADMIN_USERNAME}' успешно создан!")
-        
-        if not admin_user.is_admin:
-            admin_user.is_admin = True
-            db.commit()
-            print(f"✅ Пользователь '{ADMIN_USERNAME}' получил права администратора!")
-            
-    except Exception as e:
-        print(f"❌ Ошибка при создании админа: {str(e)}")
+        yield
     finally:
-        db.close()
-
-create_initial_admin()
+        if shared_watcher is not None:
+            shared_watcher.cancel()
+        rate_cache.detach_shared()
+        principal_cache.detach_shared()
+        await history_writer.stop()
+        await async_engine.dispose()
 
 app = FastAPI(
+    lifespan=lifespan,
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
@@ -57,78 +84,67 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Самый внутренний middleware: роутер записывает найденный маршрут в его scope
+if settings.SQL_STATS_ENABLED:
+    sql_stats.instrument_engine(engine)
+    sql_stats.instrument_engine(async_engine.sync_engine)
+    app.add_middleware(
+        QueryStatsMiddleware,
+        registry=metrics if settings.METRICS_ENABLED else None,
+        server_timing=settings.DEBUG,
+        n_plus_one_threshold=settings.N_PLUS_ONE_THRESHOLD,
+    )
+
+if settings.METRICS_ENABLED:
+    metrics.instrument_pool("sync", engine)
+    metrics.instrument_pool("async", async_engine.sync_engine)
+    app.add_middleware(MetricsMiddleware, registry=metrics)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, idempotency.REPLAYED_HEADER],
 )
 
+app.add_middleware(CookieTokenMiddleware)
+
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 app.include_router(admin_router, prefix="/admin", tags=["admin"])
 
-async def get_exchange_rate(base_currency: str, target_currency: str, db: Session):
-    rate = crud.get_active_currency_rate(db, base_currency.upper(), target_currency.upper())
-    if rate:
-        return rate.rate
-    
-    reverse_rate = crud.get_active_currency_rate(db, target_currency.upper(), base_currency.upper())
-    if reverse_rate:
-        return 1 / reverse_rate.rate
-    
+async def get_exchange_rate(base_currency: str, target_currency: str, db: AsyncSession,
+                            as_of: Optional[datetime] = None):
     base = base_currency.upper()
     target = target_currency.upper()
 
-    demo_rates = {
-        ("USD", "EUR"): 0.92,
-        ("EUR", "USD"): 1.08,
-        ("USD", "RUB"): 90.0,
-        ("EUR", "RUB"): 98.0,
-        ("USD", "GBP"): 0.79,
-        ("GBP", "USD"): 1.27,
-        ("USD", "JPY"): 148.0,
-        ("JPY", "USD"): 0.0068,
-        ("EUR", "GBP"): 0.86,
-        ("GBP", "EUR"): 1.16,
-        ("RUB", "USD"): 0.0111,
-        ("RUB", "EUR"): 0.0102,
-    }
-    
-    if (base, target) in demo_rates:
-        crud.create_currency_rate(db, schemas.CurrencyRateCreate(
-            base_currency=base,
-            target_currency=target,
-            rate=demo_rates[(base, target)]
-        ))
-        return demo_rates[(base, target)]
-    elif base == target:
+    if base == target:
         return 1.0
-    else:
-        demo_rate = round(random.uniform(0.5, 2.0), 4)
-        crud.create_currency_rate(db, schemas.CurrencyRateCreate(
-            base_currency=base,
-            target_currency=target,
-            rate=demo_rate
-        ))
-        return demo_rate
 
-@app.middleware("http")
-async def check_token_middleware(request: Request, call_next):
-    if request.url.path.startswith("/static") or request.url.path in ["/", "/login", "/register", "/docs", "/redoc", "/openapi.json", "/favicon.ico"]:
-        return await call_next(request)
-    
-    if request.url.path.startswith("/api/"):
-        return await call_next(request)
-    
-    auth_header = request.cookies.get("access_token")
-    if auth_header and auth_header.startswith("Bearer "):
-        token = auth_header[7:]
-        request.scope['headers'].append((b'authorization', f'Bearer {token}'.encode()))
-    
-    response = await call_next(request)
-    return response
+    if as_of is not None:
+        rate = await rate_history.rate_at_async(db, base, target, as_of)
+        if rate is None:
+            raise ValueError(f"Курс {base}/{target} на {as_of.isoformat()} не найден")
+        return rate
+
+    rate = await rate_cache.lookup_async(db, base, target)
+    if rate is None:
+        raise ValueError(f"Курс {base}/{target} не найден")
+    return rate
+
+async def save_conversions(db: AsyncSession, conversions: List[schemas.ConversionResponse], user_id: int,
+                           commit: bool = True):
+    # commit=False — запрос с Idempotency-Key: история пишется в транзакции вместе с сохранённым ответом
+    if commit and history_writer.running:
+        ids = await history_writer.submit(conversions, user_id)
+    else:
+        ids = await crud_async.create_conversions(db, conversions, user_id, commit=commit)
+    for conversion, conversion_id in zip(conversions, ids):
+        conversion.id = conversion_id
+        metrics.count_conversion(conversion.from_currency, conversion.to_currency)
+    return conversions
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -143,9 +159,15 @@ async def login_form(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = auth.authenticate_user(db, username, password)
+    try:
+        user = await auth.authenticate_user_async(db, username, password)
+    except auth.PasswordHashingBusy:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": "Сервер перегружен, попробуйте войти ещё раз через несколько секунд"
+        }, status_code=503)
     if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
@@ -171,7 +193,7 @@ async def register_form(
     username: str = Form(...),
     password: str = Form(...),
     password_confirm: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if password != password_confirm:
         return templates.TemplateResponse("register.html", {
@@ -179,14 +201,20 @@ async def register_form(
             "error": "Пароли не совпадают"
         })
     
-    if crud.get_user_by_username(db, username=username):
+    if await crud_async.get_user_by_username(db, username=username):
         return templates.TemplateResponse("register.html", {
             "request": request,
             "error": "Имя пользователя уже занято"
         })
     
     user_create = schemas.UserCreate(username=username, password=password)
-    user = crud.create_user(db=db, user=user_create)
+    try:
+        user = await crud_async.create_user(db=db, user=user_create)
+    except auth.PasswordHashingBusy:
+        return templates.TemplateResponse("register.html", {
+            "request": request,
+            "error": "Сервер перегружен, попробуйте зарегистрироваться ещё раз через несколько секунд"
+        }, status_code=503)
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
@@ -207,13 +235,15 @@ async def logout():
 async def dashboard_page(
     request: Request,
     current_user: schemas.UserInDB = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    recent_conversions = crud.get_user_conversions(db, current_user.id, limit=10)
+    recent_conversions = await crud_async.get_user_conversions(db, current_user.id, limit=10)
+    stats = await user_stats.get_user_stats(db, current_user.id)
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
         "user": current_user,
-        "conversions": recent_conversions
+        "conversions": recent_conversions,
+        "stats": stats
     })
 
 @app.get("/convert", response_class=HTMLResponse)
@@ -233,7 +263,7 @@ async def convert_currency_form(
     from_currency: str = Form(...),
     to_currency: str = Form(...),
     current_user: schemas.UserInDB = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         rate = await get_exchange_rate(from_currency, to_currency, db)
@@ -246,10 +276,10 @@ async def convert_currency_form(
             to_currency=to_currency.upper(),
             converted_amount=round(converted_amount, 2),
             rate_used=rate,
-            timestamp=datetime.now()
+            timestamp=partitions.utc_now()
         )
         
-        db_conversion = crud.create_conversion(db, conversion_response, current_user.id)
+        await save_conversions(db, [conversion_response], current_user.id)
         
         return templates.TemplateResponse("convert.html", {
             "request": request,
@@ -271,36 +301,56 @@ async def convert_currency_form(
             "success": False
         })
 
+HISTORY_PAGE_SIZE = 100
+
 @app.get("/history", response_class=HTMLResponse)
 async def history_page(
     request: Request,
     current_user: schemas.UserInDB = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    cursor: Optional[str] = None
 ):
-    conversions = crud.get_user_conversions(db, current_user.id)
+    try:
+        after = pagination.decode_timestamp_cursor(cursor)
+    except ValueError:
+        return RedirectResponse(url="/history", status_code=303)
+    conversions = await crud_async.get_user_conversions(db, current_user.id, limit=HISTORY_PAGE_SIZE, after=after)
     return templates.TemplateResponse("history.html", {
         "request": request,
         "conversions": conversions,
-        "user": current_user
+        "user": current_user,
+        "cursor": cursor,
+        "next_cursor": pagination.next_timestamp_cursor(conversions, HISTORY_PAGE_SIZE)
     })
 
+def password_hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Password hashing is overloaded, retry in a few seconds",
+        headers={"Retry-After": "1"},
+    )
+
 @app.post("/api/v1/auth/register", response_model=schemas.UserInDB)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await crud_async.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already taken")
-    return crud.create_user(db=db, user=user)
+    try:
+        return await crud_async.create_user(db=db, user=user)
+    except auth.PasswordHashingBusy:
+        raise password_hashing_busy()
 
 @app.post("/api/v1/auth/login", response_model=schemas.Token)
-def login_api(
+async def login_api(
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = auth.authenticate_user(db, username, password)
+    # bcrypt — в ограниченном пуле хеширования, как и у HTML-форм
+    try:
+        user = await auth.authenticate_user_async(db, username, password)
+    except auth.PasswordHashingBusy:
+        raise password_hashing_busy()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -317,14 +367,17 @@ def login_api(
 async def read_users_me(current_user: schemas.UserInDB = Depends(auth.get_current_active_user)):
     return current_user
 
-@app.post("/api/v1/convert", response_model=schemas.ConversionResponse)
-async def convert_currency_api(
-    conversion: schemas.ConversionRequest,
+@app.get("/api/v1/users/me/stats", response_model=schemas.UserStatsResponse)
+async def read_user_stats(
     current_user: schemas.UserInDB = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    return await user_stats.get_user_stats(db, current_user.id)
+
+async def convert_currency(conversion: schemas.ConversionRequest, user_id: int, db: AsyncSession,
+                           commit: bool = True):
     try:
-        rate = await get_exchange_rate(conversion.from_currency, conversion.to_currency, db)
+        rate = await get_exchange_rate(conversion.from_currency, conversion.to_currency, db, conversion.as_of)
         converted_amount = conversion.amount * rate
         
         conversion_response = schemas.ConversionResponse(
@@ -334,41 +387,199 @@ async def convert_currency_api(
             to_currency=conversion.to_currency.upper(),
             converted_amount=round(converted_amount, 2),
             rate_used=rate,
-            timestamp=datetime.now()
+            timestamp=partitions.utc_now()
         )
         
-        db_conversion = crud.create_conversion(db, conversion_response, current_user.id)
-        conversion_response.id = db_conversion.id
+        await save_conversions(db, [conversion_response], user_id, commit=commit)
         
         return conversion_response
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/api/v1/convert", response_model=schemas.ConversionResponse)
+async def convert_currency_api(
+    conversion: schemas.ConversionRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias=idempotency.IDEMPOTENCY_HEADER, min_length=1, max_length=255),
+    current_user: schemas.UserInDB = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if idempotency_key is None:
+        return await convert_currency(conversion, current_user.id, db)
+
+    async def convert_and_encode():
+        return (await convert_currency(conversion, current_user.id, db, commit=False)).model_dump_json()
+
+    # Повтор с тем же ключом получает сохранённый ответ: без пересчёта курса и новой строки в истории
+    try:
+        body, replayed = await idempotency_store.run(
+            db,
+            current_user.id,
+            idempotency_key,
+            idempotency.request_fingerprint(conversion.model_dump_json()),
+            convert_and_encode
+        )
+    except idempotency.IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if replayed:
+        response.headers[idempotency.REPLAYED_HEADER] = "true"
+    return schemas.ConversionResponse.model_validate_json(body)
+
+@app.post("/api/v1/convert/batch", response_model=List[schemas.ConversionResponse])
+async def convert_currency_batch_api(
+    conversions: List[schemas.ConversionRequest],
+    current_user: schemas.UserInDB = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if len(conversions) > settings.CONVERT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many conversions in one batch (max {settings.CONVERT_BATCH_MAX_ITEMS})"
+        )
+    # numpy нужен только здесь и в матрице курсов — не тянем его при импорте приложения
+    import numpy as np
+
+    try:
+        pair_rates = {}
+        for conversion in conversions:
+            key = (conversion.from_currency, conversion.to_currency, conversion.as_of)
+            if key not in pair_rates:
+                pair_rates[key] = await get_exchange_rate(key[0], key[1], db, key[2])
+
+        amounts = np.fromiter((c.amount for c in conversions), dtype=np.float64, count=len(conversions))
+        rates = np.fromiter(
+            (pair_rates[(c.from_currency, c.to_currency, c.as_of)] for c in conversions),
+            dtype=np.float64,
+            count=len(conversions)
+        )
+        converted_amounts = np.round(amounts * rates, 2)
+
+        timestamp = partitions.utc_now()
+        responses = [
+            schemas.ConversionResponse(
+                id=0,
+                amount=conversion.amount,
+                from_currency=conversion.from_currency,
+                to_currency=conversion.to_currency,
+                converted_amount=float(converted_amount),
+                rate_used=float(rate),
+                timestamp=timestamp
+            )
+            for conversion, converted_amount, rate in zip(conversions, converted_amounts, rates)
+        ]
+
+        return await save_conversions(db, responses, current_user.id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/v1/conversions/history", response_model=List[schemas.ConversionHistoryResponse])
 async def get_conversion_history_api(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: schemas.UserInDB = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    conversions = crud.get_user_conversions(db, current_user.id, skip=skip, limit=limit)
+    try:
+        after = pagination.decode_timestamp_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    conversions = await crud_async.get_user_conversions(db, current_user.id, skip=skip, limit=limit, after=after)
+    next_cursor = pagination.next_timestamp_cursor(conversions, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
     return conversions
 
+@app.get("/api/v1/conversions/export")
+async def export_conversion_history_api(
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    from_currency: Optional[str] = Query(None, pattern="^[A-Za-z]{3}$"),
+    to_currency: Optional[str] = Query(None, pattern="^[A-Za-z]{3}$"),
+    current_user: schemas.UserInDB = Depends(auth.get_current_active_user)
+):
+    archived = partitions.ArchiveFilter(
+        current_user.id,
+        date_from=date_from,
+        date_to=date_to,
+        from_currency=from_currency.upper() if from_currency else None,
+        to_currency=to_currency.upper() if to_currency else None
+    )
+    stmt = export.conversion_export_query(
+        archived.user_id,
+        date_from=archived.date_from,
+        date_to=archived.date_to,
+        from_currency=archived.from_currency,
+        to_currency=archived.to_currency
+    )
+    return StreamingResponse(
+        export.EXPORT_FORMATTERS[fmt](stmt, archived),
+        media_type=export.EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="conversions.{fmt}"'}
+    )
+
 @app.get("/api/v1/rates", response_model=List[schemas.CurrencyRateResponse])
 def get_currency_rates_api(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    rates = crud.get_currency_rates(db, skip=skip, limit=limit)
+    try:
+        after_id = pagination.decode_id_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    snapshot = rate_cache.get_snapshot(db)
+    cache_headers = http_cache.rates_cache_headers(snapshot)
+    if http_cache.is_not_modified(request, snapshot):
+        return http_cache.not_modified(cache_headers)
+    response.headers.update(cache_headers)
+    rates = crud.get_currency_rates(db, skip=skip, limit=limit, after_id=after_id)
+    next_cursor = pagination.next_id_cursor(rates, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
     return rates
 
+@app.get("/api/v1/rates/stream")
+async def stream_rates_api(pairs: str = Query(..., description="Пары через запятую: USD/EUR,EUR/GBP")):
+    try:
+        subscribed = parse_pairs(pairs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Сессия нужна только для первой загрузки кэша и не держится всё время подписки
+    snapshot = rate_cache.snapshot
+    if snapshot is None:
+        async with AsyncSessionLocal() as db:
+            snapshot = await rate_cache.get_snapshot_async(db)
+    return StreamingResponse(
+        stream_rates(subscribed, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/v1/rates/{base_currency}/{target_currency}")
 def get_specific_rate_api(
+    request: Request,
+    response: Response,
     base_currency: str,
     target_currency: str,
+    at: Optional[datetime] = None,
     db: Session = Depends(get_db)
 ):
+    snapshot = rate_cache.get_snapshot(db)
+    cache_headers = http_cache.rates_cache_headers(snapshot)
+    if http_cache.is_not_modified(request, snapshot):
+        return http_cache.not_modified(cache_headers)
+    response.headers.update(cache_headers)
+    if at is not None:
+        entry = rate_history.entry_at(db, base_currency.upper(), target_currency.upper(), at)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Currency rate not found")
+        return entry.as_dict()
     rate = crud.get_active_currency_rate(db, base_currency.upper(), target_currency.upper())
     if not rate:
         raise HTTPException(status_code=404, detail="Currency rate not found")
@@ -382,6 +593,19 @@ def create_currency_rate_api(
 ):
     return crud.create_currency_rate(db=db, currency_rate=currency_rate)
 
+@app.post("/api/v1/admin/rates/import")
+async def import_currency_rates_api(
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format", pattern="^(csv|json)$"),
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    fmt = fmt or rate_import.detect_format(content_type=request.headers.get("content-type", ""))
+    try:
+        return await rate_import.import_rates(db, await request.body(), fmt)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.put("/api/v1/admin/rates/{rate_id}", response_model=schemas.CurrencyRateResponse)
 def update_currency_rate_api(
     rate_id: int,
@@ -405,14 +629,82 @@ def delete_currency_rate_api(
         raise HTTPException(status_code=404, detail="Currency rate not found")
     return {"message": "Currency rate deleted successfully"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics_endpoint(reader: Optional[schemas.UserInDB] = Depends(auth.get_metrics_reader)):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/v1/admin/cache/rates")
+def get_rate_cache_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return rate_cache.stats()
+
+@app.get("/api/v1/admin/cache/rate-history")
+def get_rate_history_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return rate_history.stats()
+
+@app.get("/api/v1/admin/cache/principals")
+def get_principal_cache_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return principal_cache.stats()
+
+@app.get("/api/v1/admin/cache/idempotency")
+def get_idempotency_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return idempotency_store.stats()
+
+@app.get("/api/v1/admin/db")
+def get_database_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return database_stats()
+
+@app.get("/api/v1/admin/startup")
+def get_startup_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return startup_timer.stats()
+
+@app.get("/api/v1/admin/history/partitions")
+def get_history_partitions_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    return partitions.status(db.connection())
+
+@app.get("/api/v1/admin/rate-stream")
+def get_rate_stream_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return rate_broadcaster.stats()
+
+@app.get("/api/v1/admin/history-writer")
+def get_history_writer_stats_api(
+    current_user: schemas.UserInDB = Depends(auth.get_current_admin_user)
+):
+    return history_writer.stats()
+
 @app.get("/api/v1/admin/users", response_model=List[schemas.UserInDB])
 def get_all_users_api(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: schemas.UserInDB = Depends(auth.get_current_admin_user),
     db: Session = Depends(get_db)
 ):
-    users = crud.get_users(db, skip=skip, limit=limit)
+    try:
+        after_id = pagination.decode_id_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    next_cursor = pagination.next_id_cursor(users, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
     return users
 
 @app.exception_handler(404)
@@ -0,0 +1,217 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # Последняя ячейка — +Inf
+        self.counts: List[int] = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.total}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class RouteMetrics:
+    __slots__ = ("latency", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses: Dict[int, int] = {}
+
+
+class RouteQueryMetrics:
+    __slots__ = ("queries", "db_seconds", "n_plus_one")
+
+    def __init__(self):
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_seconds = Histogram()
+        self.n_plus_one = 0
+
+
+class PoolMetrics:
+    __slots__ = ("engine", "checkouts", "wait", "lock")
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.checkouts = 0
+        self.wait = Histogram(POOL_WAIT_BUCKETS)
+        # Пул дёргают потоки threadpool, поэтому здесь без блокировки нельзя
+        self.lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True):
+        # Без /metrics счётчики никто не читает — не копим их
+        self.enabled = enabled
+        # route path -> method -> RouteMetrics; вложенные dict, чтобы не собирать кортежи-ключи на каждый запрос
+        self._routes: Dict[str, Dict[str, RouteMetrics]] = {}
+        self._conversions: Dict[str, Dict[str, int]] = {}
+        self._route_queries: Dict[str, RouteQueryMetrics] = {}
+        self._pools: Dict[str, PoolMetrics] = {}
+        self.in_flight = 0
+        self.startup_seconds: Optional[float] = None
+
+    # Вызывается только из event loop, поэтому без блокировок
+    def observe_request(self, method: str, route: Optional[str], status: int, seconds: float):
+        by_method = self._routes.get(route or UNMATCHED_ROUTE)
+        if by_method is None:
+            by_method = self._routes.setdefault(route or UNMATCHED_ROUTE, {})
+        metrics = by_method.get(method)
+        if metrics is None:
+            metrics = by_method.setdefault(method, RouteMetrics())
+        metrics.latency.observe(seconds)
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def observe_queries(self, route: Optional[str], count: int, seconds: float, n_plus_one: bool = False):
+        metrics = self._route_queries.get(route or UNMATCHED_ROUTE)
+        if metrics is None:
+            metrics = self._route_queries.setdefault(route or UNMATCHED_ROUTE, RouteQueryMetrics())
+        metrics.queries.observe(count)
+        metrics.db_seconds.observe(seconds)
+        if n_plus_one:
+            metrics.n_plus_one += 1
+
+    def count_conversion(self, from_currency: str, to_currency: str, count: int = 1):
+        if not self.enabled:
+            return
+        by_target = self._conversions.get(from_currency)
+        if by_target is None:
+            by_target = self._conversions.setdefault(from_currency, {})
+        by_target[to_currency] = by_target.get(to_currency, 0) + count
+
+    def set_startup_seconds(self, seconds: float):
+        self.startup_seconds = seconds
+
+    def instrument_pool(self, name: str, engine):
+        metrics = self._pools[name] = PoolMetrics(engine)
+        # Оборачиваем engine, а не pool: dispose() пересоздаёт пул
+        raw_connection = engine.raw_connection
+
+        # Время checkout = ожидание свободного соединения (или открытие нового)
+        def timed_raw_connection():
+            started = time.perf_counter()
+            connection = raw_connection()
+            elapsed = time.perf_counter() - started
+            with metrics.lock:
+                metrics.checkouts += 1
+                metrics.wait.observe(elapsed)
+            return connection
+
+        engine.raw_connection = timed_raw_connection
+        return metrics
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being served.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+        ]
+        if self.startup_seconds is not None:
+            lines.append("# HELP app_startup_seconds Time from importing the app to the end of lifespan startup.")
+            lines.append("# TYPE app_startup_seconds gauge")
+            lines.append(f"app_startup_seconds {self.startup_seconds:.6f}")
+        lines += [
+            "# HELP http_requests_total Completed HTTP requests by route template and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        routes = [
+            (route, method, metrics)
+            for route, by_method in list(self._routes.items())
+            for method, metrics in list(by_method.items())
+        ]
+        for route, method, metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+
+        lines.append("# HELP http_request_duration_seconds Request latency by route template.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for route, method, metrics in routes:
+            lines.extend(metrics.latency.render(
+                "http_request_duration_seconds", f'method="{method}",route="{_escape(route)}"'
+            ))
+
+        route_queries = list(self._route_queries.items())
+        lines.append("# HELP db_queries_per_request SQL statements executed per request.")
+        lines.append("# TYPE db_queries_per_request histogram")
+        for route, metrics in route_queries:
+            lines.extend(metrics.queries.render("db_queries_per_request", f'route="{_escape(route)}"'))
+        lines.append("# HELP db_time_per_request_seconds Time spent in SQL per request.")
+        lines.append("# TYPE db_time_per_request_seconds histogram")
+        for route, metrics in route_queries:
+            lines.extend(metrics.db_seconds.render("db_time_per_request_seconds", f'route="{_escape(route)}"'))
+        lines.append("# HELP db_n_plus_one_suspected_total Requests that repeated the same statement many times.")
+        lines.append("# TYPE db_n_plus_one_suspected_total counter")
+        for route, metrics in route_queries:
+            lines.append(f'db_n_plus_one_suspected_total{{route="{_escape(route)}"}} {metrics.n_plus_one}')
+
+        lines.append("# HELP db_pool_checkouts_total Connections checked out from the pool.")
+        lines.append("# TYPE db_pool_checkouts_total counter")
+        for name, metrics in self._pools.items():
+            lines.append(f'db_pool_checkouts_total{{pool="{name}"}} {metrics.checkouts}')
+        lines.append("# HELP db_pool_checkout_seconds Time spent waiting for a pool connection.")
+        lines.append("# TYPE db_pool_checkout_seconds histogram")
+        for name, metrics in self._pools.items():
+            with metrics.lock:
+                lines.extend(metrics.wait.render("db_pool_checkout_seconds", f'pool="{name}"'))
+        lines.append("# HELP db_pool_checked_out Connections currently checked out.")
+        lines.append("# TYPE db_pool_checked_out gauge")
+        for name, metrics in self._pools.items():
+            checkedout = getattr(metrics.engine.pool, "checkedout", None)
+            if checkedout is not None:
+                lines.append(f'db_pool_checked_out{{pool="{name}"}} {checkedout()}')
+        lines.append("# HELP db_pool_size Configured pool size.")
+        lines.append("# TYPE db_pool_size gauge")
+        for name, metrics in self._pools.items():
+            size = getattr(metrics.engine.pool, "size", None)
+            if callable(size):
+                lines.append(f'db_pool_size{{pool="{name}"}} {size()}')
+        lines.append("# HELP db_pool_overflow Connections opened beyond the pool size (negative while below it).")
+        lines.append("# TYPE db_pool_overflow gauge")
+        for name, metrics in self._pools.items():
+            overflow = getattr(metrics.engine.pool, "overflow", None)
+            if callable(overflow):
+                lines.append(f'db_pool_overflow{{pool="{name}"}} {overflow()}')
+
+        lines.append("# HELP conversions_total Conversions by currency pair.")
+        lines.append("# TYPE conversions_total counter")
+        for from_currency, by_target in list(self._conversions.items()):
+            for to_currency, count in list(by_target.items()):
+                lines.append(f'conversions_total{{from_currency="{from_currency}",to_currency="{to_currency}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(enabled=settings.METRICS_ENABLED)
@@ -0,0 +1,132 @@
+import time
+from typing import Iterable, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import sql_stats
+from app.metrics import MetricsRegistry
+
+PUBLIC_PATHS = ("/", "/login", "/register", "/docs", "/redoc", "/openapi.json", "/favicon.ico")
+PUBLIC_PREFIXES = ("/static", "/api/")
+
+
+# Переносит JWT из cookie в заголовок Authorization для HTML-страниц
+class CookieTokenMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        cookie_name: str = "access_token",
+        exempt_paths: Iterable[str] = PUBLIC_PATHS,
+        exempt_prefixes: Iterable[str] = PUBLIC_PREFIXES,
+    ):
+        self.app = app
+        self.cookie_name = cookie_name
+        self.exempt_paths = frozenset(exempt_paths)
+        self.exempt_prefixes = tuple(exempt_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path in self.exempt_paths or path.startswith(self.exempt_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        cookie_header = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                await self.app(scope, receive, send)
+                return
+            if name == b"cookie":
+                cookie_header = value
+
+        if cookie_header is not None:
+            token = cookie_parser(cookie_header.decode("latin-1")).get(self.cookie_name)
+            if token and token.startswith("Bearer "):
+                scope = dict(scope)
+                scope["headers"] = [*scope["headers"], (b"authorization", token.encode("latin-1"))]
+
+        await self.app(scope, receive, send)
+
+
+# Считает запросы и задержку по шаблону маршрута. Должен стоять внутри остальных
+# middleware: роутер записывает scope["route"] в тот scope, который получил
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        status = 500
+        started = time.perf_counter()
+
+        # Статус ответа в ASGI виден только в сообщении http.response.start, поэтому
+        # без обёртки над send не обойтись; это одно замыкание на запрос, а middleware
+        # подключается только при METRICS_ENABLED
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        registry.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            registry.in_flight -= 1
+            route = scope.get("route")
+            registry.observe_request(
+                scope["method"],
+                getattr(route, "path", None),
+                status,
+                time.perf_counter() - started,
+            )
+
+
+# Считает SQL-запросы каждого запроса: Server-Timing в режиме отладки,
+# метрики и предупреждение о повторяющихся запросах (похоже на N+1)
+class QueryStatsMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        registry: Optional[MetricsRegistry] = None,
+        server_timing: bool = False,
+        n_plus_one_threshold: int = 5,
+    ):
+        self.app = app
+        self.registry = registry
+        self.server_timing = server_timing
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = sql_stats.begin_request()
+        wrapped_send = send
+        if self.server_timing:
+            async def wrapped_send(message: Message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message).append("Server-Timing", queries.server_timing())
+                await send(message)
+
+        try:
+            await self.app(scope, receive, wrapped_send)
+        finally:
+            sql_stats.finish_request(queries)
+            route = getattr(scope.get("route"), "path", None)
+            repeated = queries.repeated(self.n_plus_one_threshold) if self.n_plus_one_threshold > 0 else {}
+            if self.registry is not None:
+                self.registry.observe_queries(route, queries.count, queries.seconds, bool(repeated))
+            for statement, count in repeated.items():
+                print(f"⚠️ Возможный N+1 в {scope['method']} {route or scope['path']}: {count} x {statement[:200]}")
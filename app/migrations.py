@@ -0,0 +1,201 @@
+import argparse
+import sys
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from app import models, partitions, rate_versions, rollups, user_stats
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+PARTIAL_INDEX_DIALECTS = ("sqlite", "postgresql")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _create_model_index(model, name: str, partial: bool = False):
+    def apply(conn: Connection):
+        if partial and conn.dialect.name not in PARTIAL_INDEX_DIALECTS:
+            return
+        index = next(index for index in model.__table__.indexes if index.name == name)
+        index.create(conn, checkfirst=True)
+    return apply
+
+
+def _normalize_sqlite_conversion_timestamps(conn: Connection):
+    # server_default писал время без микросекунд, а SQLAlchemy хранит его с ними;
+    # для курсорной пагинации строки в SQLite должны сравниваться в одном формате
+    if conn.dialect.name != "sqlite":
+        return
+    conn.execute(text(
+        "UPDATE conversion_history "
+        "SET timestamp = strftime('%Y-%m-%d %H:%M:%f', timestamp) || '000' "
+        "WHERE length(timestamp) = 19"
+    ))
+
+
+def _add_currency_rate_created_at(conn: Connection):
+    # Старые строки получают время последнего изменения — точнее восстановить нельзя
+    columns = {column["name"] for column in inspect(conn).get_columns("currency_rates")}
+    if "created_at" not in columns:
+        column_type = DateTime(timezone=True).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE currency_rates ADD COLUMN created_at {column_type}"))
+    conn.execute(text("UPDATE currency_rates SET created_at = last_updated WHERE created_at IS NULL"))
+
+
+def _add_idempotency_lease_columns(conn: Connection):
+    columns = {column["name"] for column in inspect(conn).get_columns("idempotency_keys")}
+    if "owner" not in columns:
+        conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN owner VARCHAR(32)"))
+    if "heartbeat_at" not in columns:
+        column_type = DateTime(timezone=True).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE idempotency_keys ADD COLUMN heartbeat_at {column_type}"))
+
+
+def _backfill_currency_rate_changes(conn: Connection):
+    # Прежние значения изменённых на месте курсов не сохранились: в журнал попадает
+    # текущее значение с момента создания и выключение — со временем последней правки
+    change = models.CurrencyRateChange.__table__
+    if conn.scalar(select(func.count()).select_from(change)):
+        return
+    rate = models.CurrencyRate.__table__
+    rows = []
+    for rate_id, base, target, value, is_active, created_at, last_updated in conn.execute(
+        select(rate.c.id, rate.c.base_currency, rate.c.target_currency, rate.c.rate,
+               rate.c.is_active, rate.c.created_at, rate.c.last_updated).order_by(rate.c.id)
+    ):
+        created_at = created_at or last_updated
+        row = {"rate_id": rate_id, "base_currency": base, "target_currency": target, "rate": value}
+        rows.append({**row, "is_active": True, "changed_at": created_at})
+        if not is_active:
+            rows.append({**row, "is_active": False, "changed_at": last_updated or created_at})
+    if rows:
+        conn.execute(insert(change), rows)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "currency_rates (base_currency, target_currency, is_active) index",
+              _create_model_index(models.CurrencyRate, "ix_currency_rates_pair_active")),
+    Migration(2, "currency_rates partial index on active rates",
+              _create_model_index(models.CurrencyRate, "ix_currency_rates_active_pair", partial=True)),
+    Migration(3, "conversion_history (user_id, timestamp) index",
+              _create_model_index(models.ConversionHistory, "ix_conversion_history_user_timestamp")),
+    Migration(4, "normalize conversion_history timestamps on SQLite",
+              _normalize_sqlite_conversion_timestamps),
+    Migration(5, "currency_rates.created_at for point-in-time lookups",
+              _add_currency_rate_created_at),
+    Migration(6, "currency_rates (base_currency, target_currency, created_at) index",
+              _create_model_index(models.CurrencyRate, "ix_currency_rates_pair_created")),
+    Migration(7, "backfill user_stats and user_currency_stats from conversion_history",
+              user_stats.rebuild),
+    Migration(8, "backfill conversion_rollups from conversion_history",
+              rollups.rebuild),
+    Migration(9, "conversion_history_all view over monthly partitions",
+              partitions.create_partitioning),
+    Migration(10, "rate_versions counter for ordering rate snapshots",
+              rate_versions.seed),
+    Migration(11, "idempotency_keys owner and heartbeat_at for claim leases",
+              _add_idempotency_lease_columns),
+    Migration(12, "currency_rate_changes log backfilled from currency_rates",
+              _backfill_currency_rate_changes),
+]
+
+
+def get_applied_versions(conn: Connection) -> set:
+    migration_metadata.create_all(bind=conn)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def run_migrations(engine: Engine) -> List[Migration]:
+    with engine.begin() as conn:
+        applied = get_applied_versions(conn)
+
+    applied_now = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        with engine.begin() as conn:
+            migration.apply(conn)
+            conn.execute(insert(schema_migrations).values(version=migration.version, name=migration.name))
+        applied_now.append(migration)
+        print(f"✅ Применена миграция {migration.version}: {migration.name}")
+    return applied_now
+
+
+# === Проверка планов запросов ===
+
+def _hot_queries():
+    rate = models.CurrencyRate
+    history = models.ConversionHistory
+    return {
+        "get_active_currency_rate": (
+            select(rate).where(
+                rate.base_currency == "USD",
+                rate.target_currency == "EUR",
+                rate.is_active == True,
+            ),
+            ("ix_currency_rates_pair_active", "ix_currency_rates_active_pair"),
+        ),
+        "get_user_conversions": (
+            select(history).where(history.user_id == 1)
+            .order_by(history.timestamp.desc(), history.id.desc()).limit(100),
+            ("ix_conversion_history_user_timestamp",),
+        ),
+    }
+
+
+def explain(conn: Connection, stmt) -> str:
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        return "\n".join(row[-1] for row in rows)
+    rows = conn.execute(text(f"EXPLAIN {sql}")).all()
+    return "\n".join(str(row[0]) for row in rows)
+
+
+def check_index_usage(engine: Engine) -> dict:
+    results = {}
+    with engine.connect() as conn:
+        for name, (stmt, indexes) in _hot_queries().items():
+            plan = explain(conn, stmt)
+            results[name] = {
+                "plan": plan,
+                "uses_index": any(index in plan for index in indexes),
+            }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--check", action="store_true", help="проверить, что горячие запросы используют индексы")
+    args = parser.parse_args(argv)
+
+    from app.database import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    if args.check:
+        results = check_index_usage(engine)
+        for name, result in results.items():
+            mark = "✅" if result["uses_index"] else "❌"
+            print(f"{mark} {name}:\n{result['plan']}")
+        if not all(result["uses_index"] for result in results.values()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
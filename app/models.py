@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Boolean, ForeignKey, Index, Text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -23,7 +23,49 @@ class CurrencyRate(Base):
     target_currency = Column(String(3), nullable=False)
     rate = Column(Float, nullable=False)
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), default=func.now())
     is_active = Column(Boolean, default=True)
+    
+    __table_args__ = (
+        Index("ix_currency_rates_pair_active", "base_currency", "target_currency", "is_active"),
+        Index("ix_currency_rates_pair_created", "base_currency", "target_currency", "created_at"),
+        Index(
+            "ix_currency_rates_active_pair", "base_currency", "target_currency",
+            sqlite_where=is_active == True,
+            postgresql_where=is_active == True,
+        ),
+    )
+
+class CurrencyRateChange(Base):
+    __tablename__ = "currency_rate_changes"
+    
+    # Журнал только на добавление: каждая запись в currency_rates оставляет здесь строку
+    # в той же транзакции, поэтому прошлые значения курсов не теряются при правке на месте
+    id = Column(Integer, primary_key=True)
+    rate_id = Column(Integer, nullable=False, index=True)
+    base_currency = Column(String(3), nullable=False)
+    target_currency = Column(String(3), nullable=False)
+    rate = Column(Float, nullable=False)
+    # False — курс выключен или удалён
+    is_active = Column(Boolean, nullable=False)
+    changed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class RateVersion(Base):
+    __tablename__ = "rate_versions"
+    
+    # Одна строка: счётчик увеличивается в той же транзакции, что и любая запись в currency_rates
+    id = Column(Integer, primary_key=True)
+    # Отличает версии этой БД от версий пересозданной или восстановленной из бэкапа
+    epoch = Column(BigInteger, nullable=False)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True))
+
+class IdAllocation(Base):
+    __tablename__ = "id_allocations"
+    
+    # Следующий свободный id таблицы: воркеры резервируют у БД блоки id для отложенной записи
+    name = Column(String(64), primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
 
 class ConversionHistory(Base):
     __tablename__ = "conversion_history"
@@ -37,4 +79,63 @@ class ConversionHistory(Base):
     rate_used = Column(Float, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     
-    user = relationship("User", back_populates="conversions")
\ No newline at end of file
+    user = relationship("User", back_populates="conversions")
+    
+    __table_args__ = (
+        Index("ix_conversion_history_user_timestamp", "user_id", "timestamp"),
+    )
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    conversion_count = Column(Integer, nullable=False, default=0)
+    first_conversion_at = Column(DateTime(timezone=True))
+    last_conversion_at = Column(DateTime(timezone=True))
+
+class UserCurrencyStats(Base):
+    __tablename__ = "user_currency_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    currency = Column(String(3), primary_key=True)
+    conversions_from = Column(Integer, nullable=False, default=0)
+    conversions_to = Column(Integer, nullable=False, default=0)
+    amount_from = Column(Float, nullable=False, default=0.0)
+    amount_to = Column(Float, nullable=False, default=0.0)
+
+class ConversionRollup(Base):
+    __tablename__ = "conversion_rollups"
+    
+    granularity = Column(String(4), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    from_currency = Column(String(3), primary_key=True)
+    to_currency = Column(String(3), primary_key=True)
+    conversion_count = Column(Integer, nullable=False, default=0)
+    amount_total = Column(Float, nullable=False, default=0.0)
+    converted_total = Column(Float, nullable=False, default=0.0)
+
+class ConversionArchive(Base):
+    __tablename__ = "conversion_archives"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    month = Column(String(7), nullable=False, index=True)
+    path = Column(String, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    min_timestamp = Column(DateTime(timezone=True))
+    max_timestamp = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    # NULL, пока первый запрос с этим ключом ещё выполняется
+    status_code = Column(Integer)
+    response_body = Column(Text)
+    # Захват выполняющегося запроса: владелец продлевает heartbeat_at, пока жив
+    owner = Column(String(32))
+    heartbeat_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
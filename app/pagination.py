@@ -0,0 +1,53 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def decode_id_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    values = decode_cursor(cursor)
+    if len(values) != 1 or not isinstance(values[0], int):
+        raise ValueError("Invalid cursor")
+    return values[0]
+
+
+def decode_timestamp_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if cursor is None:
+        return None
+    values = decode_cursor(cursor)
+    if len(values) != 2 or not isinstance(values[0], str) or not isinstance(values[1], int):
+        raise ValueError("Invalid cursor")
+    return datetime.fromisoformat(values[0]), values[1]
+
+
+def next_id_cursor(items, limit: int) -> Optional[str]:
+    if limit <= 0 or len(items) < limit:
+        return None
+    return encode_cursor(items[-1].id)
+
+
+def next_timestamp_cursor(items, limit: int) -> Optional[str]:
+    if limit <= 0 or len(items) < limit:
+        return None
+    return encode_cursor(items[-1].timestamp, items[-1].id)
@@ -0,0 +1,392 @@
+# Помесячное разбиение conversion_history и архивирование старых месяцев.
+#
+# Запись всегда идёт в горячую таблицу conversion_history. Задание (cron или
+# python -m app.partitions) переносит из неё закрытые месяцы старше HISTORY_HOT_MONTHS
+# в помесячные партиции: в Postgres — нативные партиции conversion_history_cold,
+# в SQLite — отдельные таблицы conversion_history_pYYYYMM. Всё вместе видно через
+# представление conversion_history_all. Партиции старше HISTORY_RETENTION_MONTHS
+# выгружаются в gzip NDJSON и удаляются из БД; экспорт читает их оттуда.
+import argparse
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timezone
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import (Column, DateTime, Float, Index, Integer, MetaData, String, Table, column, delete,
+                        func, insert, inspect, select, table, text, update)
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import settings
+from app.startup import file_lock
+
+HOT_TABLE = "conversion_history"
+VIEW_NAME = "conversion_history_all"
+# Только в Postgres: родительская таблица нативных партиций
+COLD_PARENT = "conversion_history_cold"
+_PARTITION_RE = re.compile(r"^conversion_history_p(\d{4})(\d{2})$")
+
+HISTORY_COLUMNS = ("id", "user_id", "amount", "from_currency", "to_currency", "converted_amount", "rate_used", "timestamp")
+
+history_view = table(
+    VIEW_NAME,
+    column("id", Integer),
+    column("user_id", Integer),
+    column("amount", Float),
+    column("from_currency", String),
+    column("to_currency", String),
+    column("converted_amount", Float),
+    column("rate_used", Float),
+    column("timestamp", DateTime(timezone=True)),
+)
+
+
+class ArchiveFilter(NamedTuple):
+    user_id: int
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    from_currency: Optional[str] = None
+    to_currency: Optional[str] = None
+
+
+def utc_now() -> datetime:
+    """Время для conversion_history и производных таблиц: UTC без пояса, как func.now() в SQLite."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def naive_utc(moment: datetime) -> datetime:
+    # SQLite отдаёт время без пояса (в UTC), Postgres — с поясом
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def month_start(moment: datetime) -> datetime:
+    return naive_utc(moment).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def month_key(month: datetime) -> str:
+    return month.strftime("%Y-%m")
+
+
+def partition_name(month: datetime) -> str:
+    return f"conversion_history_p{month:%Y%m}"
+
+
+def _connection(conn):
+    return conn.connection() if isinstance(conn, Session) else conn
+
+
+def _partition_table(name: str) -> Table:
+    hot = models.ConversionHistory.__table__
+    return Table(
+        name,
+        MetaData(),
+        *(Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in hot.columns),
+        Index(f"ix_{name}_user_timestamp", "user_id", "timestamp"),
+    )
+
+
+def list_partitions(conn) -> List[Tuple[datetime, str]]:
+    partitions = []
+    for name in inspect(_connection(conn)).get_table_names():
+        match = _PARTITION_RE.match(name)
+        if match:
+            partitions.append((datetime(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+def history_source(conn):
+    """Колонки горячей таблицы вместе с партициями — если представление уже создано миграцией."""
+    if VIEW_NAME in inspect(_connection(conn)).get_view_names():
+        return history_view.c
+    return models.ConversionHistory.__table__.c
+
+
+def refresh_view(conn):
+    conn = _connection(conn)
+    quote = conn.dialect.identifier_preparer.quote
+    columns = ", ".join(quote(name) for name in HISTORY_COLUMNS)
+    if conn.dialect.name == "postgresql":
+        sources = [HOT_TABLE, COLD_PARENT]
+    else:
+        sources = [HOT_TABLE] + [name for _, name in list_partitions(conn)]
+    body = " UNION ALL ".join(f"SELECT {columns} FROM {quote(source)}" for source in sources)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"CREATE OR REPLACE VIEW {VIEW_NAME} AS {body}"))
+    else:
+        conn.execute(text(f"DROP VIEW IF EXISTS {VIEW_NAME}"))
+        conn.execute(text(f"CREATE VIEW {VIEW_NAME} AS {body}"))
+
+
+def create_partitioning(conn):
+    """Миграция: родительская таблица партиций (Postgres) и представление над всей историей."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {COLD_PARENT} (LIKE {HOT_TABLE} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ("timestamp")'
+        ))
+        conn.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_{COLD_PARENT}_user_timestamp ON {COLD_PARENT} (user_id, "timestamp")'
+        ))
+    refresh_view(conn)
+
+
+def ensure_partition(conn, month: datetime) -> str:
+    name = partition_name(month)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {COLD_PARENT} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+    else:
+        _partition_table(name).create(conn, checkfirst=True)
+    return name
+
+
+def detach_month(conn, month: datetime) -> int:
+    """Переносит строки месяца из горячей таблицы в его партицию. Возвращает число строк."""
+    hot = models.ConversionHistory.__table__
+    window = (hot.c.timestamp >= month) & (hot.c.timestamp < add_months(month, 1))
+    if conn.scalar(select(hot.c.id).where(window).limit(1)) is None:
+        return 0
+    name = ensure_partition(conn, month)
+    # В Postgres строки пишутся в родителя, и он сам раскладывает их по партициям
+    target = _partition_table(COLD_PARENT if conn.dialect.name == "postgresql" else name)
+    moved = conn.execute(insert(target).from_select(
+        list(HISTORY_COLUMNS), select(*(hot.c[column_name] for column_name in HISTORY_COLUMNS)).where(window)
+    )).rowcount
+    conn.execute(delete(hot).where(window))
+    return moved
+
+
+def archive_partition(conn, month: datetime, name: str, archive_dir: str) -> dict:
+    """Выгружает партицию в gzip NDJSON, регистрирует файл и удаляет партицию — в одной транзакции."""
+    key = month_key(month)
+    sequence = conn.scalar(
+        select(func.count()).select_from(models.ConversionArchive).where(models.ConversionArchive.month == key)
+    ) + 1
+    directory = os.path.abspath(os.path.join(archive_dir, HOT_TABLE))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{key}.{sequence}.ndjson.gz")
+
+    partition = _partition_table(name)
+    result = conn.execute(
+        select(*(partition.c[column_name] for column_name in HISTORY_COLUMNS))
+        .order_by(partition.c.timestamp, partition.c.id)
+        .execution_options(yield_per=1000, stream_results=True)
+    )
+    count, first, last = 0, None, None
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as archive:
+            for row in result:
+                record = dict(zip(HISTORY_COLUMNS, row))
+                timestamp = record["timestamp"]
+                if timestamp is not None:
+                    first = timestamp if first is None else first
+                    last = timestamp
+                    record["timestamp"] = timestamp.isoformat()
+                archive.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                count += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    # Файл с этим номером мог остаться от прерванного запуска — он ещё не зарегистрирован, перезаписываем
+    os.replace(tmp_path, path)
+
+    conn.execute(insert(models.ConversionArchive).values(
+        month=key, path=path, row_count=count, min_timestamp=first, max_timestamp=last,
+    ))
+    conn.execute(text(f"DROP TABLE {conn.dialect.identifier_preparer.quote(name)}"))
+    return {"month": key, "path": path, "rows": count}
+
+
+def run(engine, now: Optional[datetime] = None, hot_months: Optional[int] = None,
+        retention_months: Optional[int] = None, archive_dir: Optional[str] = None) -> dict:
+    hot_months = hot_months or settings.HISTORY_HOT_MONTHS
+    retention_months = retention_months or settings.HISTORY_RETENTION_MONTHS
+    archive_dir = archive_dir or settings.HISTORY_ARCHIVE_DIR
+    if hot_months < 1 or retention_months < hot_months:
+        raise ValueError("Need 1 <= hot months <= retention months")
+
+    # Те же часы, что у записи истории: иначе строки у границы месяца попадут не в ту партицию
+    current = month_start(now or utc_now())
+    hot_cutoff = add_months(current, -(hot_months - 1))
+    archive_cutoff = add_months(current, -(retention_months - 1))
+    hot = models.ConversionHistory.__table__
+    summary = {"detached": [], "archived": [], "skipped": []}
+
+    with engine.connect() as conn:
+        oldest = conn.scalar(select(func.min(hot.c.timestamp)))
+        newest_id_at = conn.scalar(
+            select(hot.c.timestamp).where(hot.c.id == select(func.max(hot.c.id)).scalar_subquery())
+        )
+
+    if oldest is not None:
+        month = month_start(oldest)
+        while month < hot_cutoff:
+            # SQLite выдаёт новый id как max(id) + 1: строку с максимальным id из горячей
+            # таблицы не уносим (отложенная запись берёт id из счётчика id_allocations)
+            if engine.dialect.name != "postgresql" and \
+                    newest_id_at is not None and month_start(newest_id_at) == month:
+                summary["skipped"].append(month_key(month))
+                print(f"⚠️ Месяц {month_key(month)} оставлен в горячей таблице: в нём последняя по id конвертация")
+            else:
+                with engine.begin() as conn:
+                    moved = detach_month(conn, month)
+                if moved:
+                    summary["detached"].append({"month": month_key(month), "rows": moved})
+                    print(f"✅ {month_key(month)}: {moved} строк перенесено в партицию")
+            month = add_months(month, 1)
+
+    with engine.connect() as conn:
+        partitions = list_partitions(conn)
+    for month, name in partitions:
+        if month >= archive_cutoff:
+            continue
+        with engine.begin() as conn:
+            archived = archive_partition(conn, month, name, archive_dir)
+            if conn.dialect.name != "postgresql":
+                refresh_view(conn)
+        summary["archived"].append(archived)
+        print(f"✅ {archived['month']}: {archived['rows']} строк выгружено в {archived['path']}")
+
+    if summary["detached"] and engine.dialect.name != "postgresql":
+        with engine.begin() as conn:
+            refresh_view(conn)
+    return summary
+
+
+def status(conn) -> dict:
+    partitions = []
+    for month, name in list_partitions(conn):
+        rows = conn.scalar(select(func.count()).select_from(_partition_table(name)))
+        partitions.append({"month": month_key(month), "table": name, "rows": rows})
+    archives = conn.execute(
+        select(models.ConversionArchive.month, models.ConversionArchive.path, models.ConversionArchive.row_count)
+        .order_by(models.ConversionArchive.month, models.ConversionArchive.id)
+    ).all()
+    return {
+        "hot_rows": conn.scalar(select(func.count()).select_from(models.ConversionHistory.__table__)),
+        "partitions": partitions,
+        "archives": [{"month": month, "path": path, "rows": rows} for month, path, rows in archives],
+        "hot_months": settings.HISTORY_HOT_MONTHS,
+        "retention_months": settings.HISTORY_RETENTION_MONTHS,
+    }
+
+
+def anonymize_user(conn, user_id: int):
+    """Отвязывает историю удалённого пользователя в горячей таблице и партициях: id пользователя может достаться новому."""
+    sources = [models.ConversionHistory.__table__]
+    if _connection(conn).dialect.name == "postgresql":
+        sources.append(_partition_table(COLD_PARENT))
+    else:
+        sources.extend(_partition_table(name) for _, name in list_partitions(conn))
+    for source in sources:
+        conn.execute(update(source).where(source.c.user_id == user_id).values(user_id=None))
+
+
+def user_archives_query(since: Optional[datetime] = None):
+    """Архивы, в которых могут быть строки пользователя с первой конвертацией в since."""
+    archive = models.ConversionArchive
+    stmt = select(archive.path).order_by(archive.month, archive.id)
+    if since is not None:
+        stmt = stmt.where(archive.max_timestamp >= since)
+    return stmt
+
+
+def anonymize_archives(paths: Sequence[str], user_id: int) -> int:
+    """То же для выгруженных месяцев: переписывает архивы без user_id. Возвращает число изменённых файлов."""
+    rewritten = 0
+    for path in paths:
+        # Два удаления не должны переписывать один файл одновременно
+        with file_lock(os.path.join(os.path.dirname(path), ".anonymize.lock")):
+            tmp_path = path + ".anonymize.tmp"
+            changed = False
+            with gzip.open(path, "rt", encoding="utf-8") as source, open(tmp_path, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as archive:
+                    for line in source:
+                        record = json.loads(line)
+                        if record["user_id"] == user_id:
+                            record["user_id"] = None
+                            line = json.dumps(record, ensure_ascii=False) + "\n"
+                            changed = True
+                        archive.write(line.encode("utf-8"))
+                raw.flush()
+                os.fsync(raw.fileno())
+            if changed:
+                os.replace(tmp_path, path)
+                rewritten += 1
+            else:
+                os.remove(tmp_path)
+    return rewritten
+
+
+def has_archives(conn) -> bool:
+    return conn.scalar(select(models.ConversionArchive.id).limit(1)) is not None
+
+
+def _read_archive(path: str, archive_filter: ArchiveFilter, columns: Sequence[str]) -> Iterator[tuple]:
+    date_from = naive_utc(archive_filter.date_from) if archive_filter.date_from else None
+    date_to = naive_utc(archive_filter.date_to) if archive_filter.date_to else None
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            record = json.loads(line)
+            if record["user_id"] != archive_filter.user_id:
+                continue
+            if archive_filter.from_currency is not None and record["from_currency"] != archive_filter.from_currency:
+                continue
+            if archive_filter.to_currency is not None and record["to_currency"] != archive_filter.to_currency:
+                continue
+            if record["timestamp"] is not None:
+                record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+                moment = naive_utc(record["timestamp"])
+                if date_from is not None and moment < date_from:
+                    continue
+                if date_to is not None and moment >= date_to:
+                    continue
+            yield tuple(record[name] for name in columns)
+
+
+def iter_archived(db: Session, archive_filter: ArchiveFilter, columns: Sequence[str]) -> List[Iterator[tuple]]:
+    """По итератору на каждый архивный файл, пересекающийся с интервалом фильтра; строки в порядке (timestamp, id)."""
+    archive = models.ConversionArchive
+    stmt = select(archive.path).order_by(archive.month, archive.id)
+    if archive_filter.date_from is not None:
+        stmt = stmt.where(archive.max_timestamp >= archive_filter.date_from)
+    if archive_filter.date_to is not None:
+        stmt = stmt.where(archive.min_timestamp < archive_filter.date_to)
+    return [_read_archive(path, archive_filter, columns) for path in db.scalars(stmt)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Разбиение истории конвертаций по месяцам и архивирование старых месяцев")
+    parser.add_argument("--hot-months", type=int, default=None,
+                        help=f"месяцев в горячей таблице, включая текущий (по умолчанию {settings.HISTORY_HOT_MONTHS})")
+    parser.add_argument("--retention-months", type=int, default=None,
+                        help=f"месяцев в БД до выгрузки в архив (по умолчанию {settings.HISTORY_RETENTION_MONTHS})")
+    parser.add_argument("--archive-dir", default=None,
+                        help=f"каталог архивов (по умолчанию {settings.HISTORY_ARCHIVE_DIR})")
+    parser.add_argument("--status", action="store_true", help="только показать состояние")
+    args = parser.parse_args(argv)
+
+    from app.database import Base, engine
+    from app.migrations import run_migrations
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    if not args.status:
+        run(engine, hot_months=args.hot_months, retention_months=args.retention_months, archive_dir=args.archive_dir)
+    with engine.connect() as conn:
+        print(json.dumps(status(conn), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
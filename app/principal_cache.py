@@ -0,0 +1,252 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from app import schemas
+from app.config import settings
+from app.startup import database_identity, file_lock
+
+# Формат файла: magic, число слотов, текущее поколение u64, затем слоты u64.
+# Слот пользователя (user_id % slots) хранит поколение его последней инвалидации;
+# совпадение слотов у разных пользователей даёт лишь лишний промах кеша.
+MAGIC = b"PRINCGN1"
+HEADER = struct.Struct("<8sI4xQ")
+HEADER_SIZE = 24
+SLOTS = 4096
+
+_GENERATION_OFFSET = 16
+_U64 = struct.Struct("<Q")
+
+
+def default_path(database_url: str) -> str:
+    digest = hashlib.sha1(database_identity(database_url).encode()).hexdigest()[:12]
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"currency-converter-principals-{digest}.bin")
+
+
+class SharedInvalidations:
+    """Поколения инвалидаций пользователей в mmap-файле, общие для воркеров одного хоста.
+
+    Читаются без блокировок на каждом попадании в кеш; пишутся под файловой блокировкой.
+    """
+
+    def __init__(self, path: str, slots: int = SLOTS):
+        self.path = path
+        self.slots = slots
+        self.size = HEADER_SIZE + slots * 8
+        with file_lock(self.lock_path):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fresh = os.fstat(fd).st_size != self.size
+                if not fresh:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    magic, stored_slots = struct.unpack_from("<8sI", os.read(fd, 12))
+                    fresh = magic != MAGIC or stored_slots != slots
+                if fresh:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                self._mmap = mmap.mmap(fd, self.size)
+            finally:
+                os.close(fd)
+            if fresh:
+                HEADER.pack_into(self._mmap, 0, MAGIC, slots, 0)
+
+    @property
+    def lock_path(self) -> str:
+        return self.path + ".lock"
+
+    def generation(self) -> int:
+        return _U64.unpack_from(self._mmap, _GENERATION_OFFSET)[0]
+
+    def invalidated_at(self, user_id: int) -> int:
+        return _U64.unpack_from(self._mmap, HEADER_SIZE + (user_id % self.slots) * 8)[0]
+
+    def invalidate(self, user_id: int) -> int:
+        with file_lock(self.lock_path):
+            generation = self.generation() + 1
+            # Сначала слот: чтение, взявшее старое поколение, уже увидит инвалидацию
+            _U64.pack_into(self._mmap, HEADER_SIZE + (user_id % self.slots) * 8, generation)
+            _U64.pack_into(self._mmap, _GENERATION_OFFSET, generation)
+            return generation
+
+    def invalidate_all(self) -> int:
+        with file_lock(self.lock_path):
+            generation = self.generation() + 1
+            for slot in range(self.slots):
+                _U64.pack_into(self._mmap, HEADER_SIZE + slot * 8, generation)
+            _U64.pack_into(self._mmap, _GENERATION_OFFSET, generation)
+            return generation
+
+    def close(self):
+        self._mmap.close()
+
+
+class PrincipalCache:
+    """Пользователи по токену. Запись годна, пока пользователя не инвалидировали после её чтения из БД.
+
+    С общим файлом поколений (attach_shared) инвалидация в одном воркере сразу видна остальным:
+    каждое попадание сверяет поколение записи со слотом пользователя в общей памяти.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        # Поколение растёт при каждой инвалидации; для пользователя хранится поколение его последней
+        self._generation = 0
+        self._invalidated_at: Dict[int, int] = {}
+        # Поколения не старше этого забыты: put с ними отбрасывается целиком
+        self._forgotten_before = 0
+        self._shared: Optional[SharedInvalidations] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+        self.stale_puts = 0
+
+    def attach_shared(self, shared: SharedInvalidations):
+        with self._lock:
+            self._shared = shared
+            # Поколения записей были локальными — со слотами общей памяти их не сравнить
+            self._clear()
+
+    def detach_shared(self):
+        with self._lock:
+            shared, self._shared = self._shared, None
+            self._clear()
+        if shared is not None:
+            shared.close()
+
+    def generation(self) -> int:
+        """Берётся до чтения пользователя из БД и передаётся в put."""
+        with self._lock:
+            if self._shared is not None:
+                return self._shared.generation()
+            return self._generation
+
+    def _is_stale(self, user_id: int, generation: int) -> bool:
+        if self._shared is not None:
+            return self._shared.invalidated_at(user_id) > generation
+        return generation < self._forgotten_before or self._invalidated_at.get(user_id, 0) > generation
+
+    def get(self, token: str) -> Optional[schemas.UserInDB]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, principal, generation = entry
+            if expires_at <= now:
+                self._remove(token, principal.id)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if self._shared is not None and self._is_stale(principal.id, generation):
+                # Пользователя изменил или удалил другой воркер
+                self._remove(token, principal.id)
+                self.stale_hits += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return principal
+
+    def put(self, token: str, principal: schemas.UserInDB, token_expires_at: Optional[float] = None,
+            generation: Optional[int] = None):
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl_seconds
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is None:
+                generation = self._shared.generation() if self._shared is not None else self._generation
+            elif self._is_stale(principal.id, generation):
+                # Пока пользователя читали из БД, его инвалидировали — прочитанное могло устареть
+                self.stale_puts += 1
+                return
+            previous = self._entries.pop(token, None)
+            if previous is not None:
+                self._remove_token_index(token, previous[1].id)
+            self._entries[token] = (time.monotonic() + ttl, principal, generation)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                old_token, (_, old_principal, _) = self._entries.popitem(last=False)
+                self._remove_token_index(old_token, old_principal.id)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            tokens = self._tokens_by_user.pop(user_id, set())
+            for token in tokens:
+                self._entries.pop(token, None)
+            if self._shared is not None:
+                self._shared.invalidate(user_id)
+            else:
+                self._generation += 1
+                self._invalidated_at[user_id] = self._generation
+                if len(self._invalidated_at) > max(self.max_size, 1024):
+                    # Не копим историю инвалидаций: чтения, начатые раньше, просто не попадут в кеш
+                    self._invalidated_at.clear()
+                    self._forgotten_before = self._generation
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            if self._shared is not None:
+                self._shared.invalidate_all()
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+        self._generation += 1
+        self._invalidated_at.clear()
+        self._forgotten_before = self._generation
+
+    def _remove(self, token: str, user_id: int):
+        self._entries.pop(token, None)
+        self._remove_token_index(token, user_id)
+
+    def _remove_token_index(self, token: str, user_id: int):
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "shared": self._shared.path if self._shared is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "stale_hits": self.stale_hits,
+            "stale_puts": self.stale_puts,
+        }
+
+
+principal_cache = PrincipalCache(
+    max_size=settings.PRINCIPAL_CACHE_SIZE,
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,255 @@
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, List, Mapping, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models, rate_versions
+from app.rate_versions import RateTableVersion
+
+if TYPE_CHECKING:
+    from app.rate_engine import RateMatrix
+    from app.shared_rates import SharedRates
+
+
+class RateSnapshot:
+    __slots__ = ("rates", "matrix", "version", "last_modified", "source")
+
+    def __init__(self, rates: Mapping[Tuple[str, str], float], version: str = "",
+                 last_modified: Optional[datetime] = None, matrix=None,
+                 source: RateTableVersion = rate_versions.UNKNOWN):
+        self.rates = MappingProxyType(dict(rates))
+        if matrix is None:
+            # rate_engine тянет numpy, поэтому импортируем его при первой сборке снапшота
+            from app.rate_engine import build_rate_matrix
+
+            matrix = build_rate_matrix(self.rates)
+        # RateMatrix или SharedRateMatrix поверх общей памяти — интерфейс одинаковый
+        self.matrix: "RateMatrix" = matrix
+        # Версия таблицы курсов: меняется при любой записи, служит ETag
+        self.version = version
+        self.last_modified = last_modified
+        # Версия rate_versions, прочитанная до выборки курсов: по ней упорядочиваются пересборки
+        self.source = source
+
+    def get(self, base_currency: str, target_currency: str) -> Optional[float]:
+        return self.matrix.get(base_currency, target_currency)
+
+
+class RateCache:
+    def __init__(self):
+        self._snapshot: Optional[RateSnapshot] = None
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Optional[RateSnapshot], RateSnapshot], None]] = []
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.stale_rebuilds = 0
+        # Эпоха процесса, чтобы версии не совпадали после перезапуска
+        self._epoch = format(time.time_ns() // 1000, "x")
+        self._shared: Optional["SharedRates"] = None
+        self._shared_sequence = 0
+        # Сегмент отключён (курсы не поместились); предупреждаем один раз за отключение
+        self._shared_disabled = False
+        self.shared_loads = 0
+        self.rollbacks = 0
+
+    @property
+    def snapshot(self) -> Optional[RateSnapshot]:
+        if self._shared is not None:
+            self.refresh_shared()
+        return self._snapshot
+
+    def attach_shared(self, shared: "SharedRates"):
+        """Дальше курсы живут в общем сегменте: пересборка публикует их туда, остальные воркеры читают оттуда."""
+        with self._lock:
+            self._shared = shared
+            self._shared_sequence = 0
+            self._shared_disabled = False
+
+    def detach_shared(self):
+        with self._lock:
+            self._shared = None
+            self._shared_sequence = 0
+
+    def refresh_shared(self) -> Optional[RateSnapshot]:
+        """Подхватывает снимок, опубликованный другим воркером. Запроса к БД не делает."""
+        shared = self._shared
+        if shared is None:
+            return None
+        if shared.disabled:
+            if not self._shared_disabled:
+                with self._lock:
+                    self._report_shared_disabled()
+                    # Снимок из общей памяти мог устареть — следующий запрос перечитает курсы из БД
+                    self._snapshot = None
+            return None
+        sequence = shared.sequence
+        if sequence == 0 or sequence == self._shared_sequence:
+            return None
+        loaded = shared.load()
+        if loaded is None:
+            return None
+        with self._lock:
+            self._shared_sequence = loaded.sequence
+            self._shared_disabled = False
+            current = self._snapshot
+            if current is not None and not current.source.is_older_than(loaded.source):
+                return None
+            previous = current
+            snapshot = self._shared_snapshot(loaded)
+            self._snapshot = snapshot
+            self.shared_loads += 1
+        self._notify(previous, snapshot)
+        return snapshot
+
+    def _report_shared_disabled(self):
+        self._shared_disabled = True
+        print("⚠️ Общая таблица курсов отключена: валют больше, чем SHARED_RATES_CAPACITY")
+
+    def _shared_snapshot(self, loaded) -> RateSnapshot:
+        self._shared_sequence = loaded.sequence
+        return RateSnapshot(loaded.rates, self._version_tag(loaded.source), loaded.last_modified, loaded.matrix,
+                            source=loaded.source)
+
+    def _version_tag(self, source: RateTableVersion) -> str:
+        # Версия из БД одинакова во всех воркерах и переживает перезапуск — годится для ETag
+        if source != rate_versions.UNKNOWN:
+            return f"{source.epoch:x}-{source.version}"
+        # Счётчика в БД ещё нет (миграции не применялись): версия только этого процесса
+        return f"{self._epoch}-{self.rebuilds}"
+
+    def _notify(self, previous: Optional[RateSnapshot], snapshot: RateSnapshot):
+        for listener in self._listeners:
+            listener(previous, snapshot)
+
+    def add_listener(self, listener: Callable[[Optional[RateSnapshot], RateSnapshot], None]):
+        self._listeners.append(listener)
+
+    def _active_rates_query(self):
+        return select(
+            models.CurrencyRate.base_currency,
+            models.CurrencyRate.target_currency,
+            models.CurrencyRate.rate,
+        ).where(models.CurrencyRate.is_active == True).order_by(models.CurrencyRate.id)
+
+    def _read(self, db: Session) -> Tuple[RateSnapshot, RateTableVersion]:
+        # Версию читаем до курсов: данные не старше версии, которой помечены
+        source = rate_versions.read(db)
+        rows = db.execute(self._active_rates_query()).all()
+        return self._install(rows, source), source
+
+    async def _read_async(self, db: AsyncSession) -> Tuple[RateSnapshot, RateTableVersion]:
+        source = await rate_versions.read_async(db)
+        rows = (await db.execute(self._active_rates_query())).all()
+        return self._install(rows, source), source
+
+    def rebuild(self, db: Session) -> RateSnapshot:
+        snapshot, source = self._read(db)
+        if source.is_older_than(snapshot.source):
+            # Загружена версия новее прочитанной: либо кто-то успел записать курсы, либо БД
+            # откатили (восстановили из бэкапа). Во втором случае заводим новую эпоху и перечитываем.
+            bind = db.get_bind()
+            with bind.begin() as conn:
+                rolled_back = rate_versions.reset_if_behind(conn, snapshot.source)
+            if rolled_back:
+                self._report_rollback(snapshot.source)
+                with bind.connect() as conn:
+                    snapshot, _ = self._read(conn)
+        return snapshot
+
+    async def rebuild_async(self, db: AsyncSession) -> RateSnapshot:
+        snapshot, source = await self._read_async(db)
+        if source.is_older_than(snapshot.source):
+            async with db.bind.begin() as conn:
+                rolled_back = await rate_versions.reset_if_behind_async(conn, snapshot.source)
+            if rolled_back:
+                self._report_rollback(snapshot.source)
+                async with db.bind.connect() as conn:
+                    snapshot, _ = await self._read_async(conn)
+        return snapshot
+
+    def _report_rollback(self, seen: RateTableVersion):
+        self.rollbacks += 1
+        print(f"⚠️ Версия курсов в БД меньше уже загруженной ({seen.version}) — БД откатили, заведена новая эпоха")
+
+    def _install(self, rows, source: RateTableVersion = rate_versions.UNKNOWN) -> RateSnapshot:
+        # При нескольких активных строках на пару выигрывает самая свежая (больший id)
+        rates = {(base, target): rate for base, target, rate in rows}
+        with self._lock:
+            current = self._snapshot
+            if current is not None and source.is_older_than(current.source):
+                # Параллельная пересборка прочитала более новые курсы и уже установила их
+                self.stale_rebuilds += 1
+                return current
+            self.rebuilds += 1
+            snapshot = RateSnapshot(rates, self._version_tag(source), source.updated_at, source=source)
+            shared = self._shared
+            if shared is not None:
+                matrix = snapshot.matrix
+                if shared.publish(matrix.codes, matrix.matrix, rates, source.updated_at, source) is not None:
+                    self._shared_disabled = False
+                    loaded = shared.load()
+                    if loaded is not None and not loaded.source.is_older_than(source):
+                        # Свою копию выбрасываем и читаем из общей памяти, как и остальные воркеры
+                        snapshot = self._shared_snapshot(loaded)
+                elif shared.disabled and not self._shared_disabled:
+                    self._report_shared_disabled()
+            previous = current
+            self._snapshot = snapshot
+        self._notify(previous, snapshot)
+        return snapshot
+
+    def get_snapshot(self, db: Session) -> RateSnapshot:
+        snapshot = self.snapshot
+        if snapshot is None:
+            snapshot = self.rebuild(db)
+        return snapshot
+
+    async def get_snapshot_async(self, db: AsyncSession) -> RateSnapshot:
+        snapshot = self.snapshot
+        if snapshot is None:
+            snapshot = await self.rebuild_async(db)
+        return snapshot
+
+    def lookup(self, db: Session, base_currency: str, target_currency: str) -> Optional[float]:
+        return self._lookup(self.get_snapshot(db), base_currency, target_currency)
+
+    async def lookup_async(self, db: AsyncSession, base_currency: str, target_currency: str) -> Optional[float]:
+        return self._lookup(await self.get_snapshot_async(db), base_currency, target_currency)
+
+    def _lookup(self, snapshot: RateSnapshot, base_currency: str, target_currency: str) -> Optional[float]:
+        rate = snapshot.get(base_currency, target_currency)
+        if rate is not None:
+            self.hits += 1
+            return rate
+        self.misses += 1
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "stale_rebuilds": self.stale_rebuilds,
+            "size": len(snapshot.rates) if snapshot is not None else 0,
+            "currencies": len(snapshot.matrix.codes) if snapshot is not None else 0,
+            "loaded": snapshot is not None,
+            "version": snapshot.version if snapshot is not None else None,
+            "shared_loads": self.shared_loads,
+            "rollbacks": self.rollbacks,
+            "shared_disabled": self._shared_disabled,
+            "shared": self._shared.stats() if self._shared is not None else None,
+        }
+
+
+rate_cache = RateCache()
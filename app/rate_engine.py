@@ -0,0 +1,103 @@
+from typing import Iterable, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+PIVOT_CURRENCIES = ("USD", "EUR")
+
+# Демо-курсы используются только для пар, которые нельзя вывести из курсов в БД,
+# и больше не сохраняются в currency_rates.
+DEMO_RATES = {
+    ("USD", "EUR"): 0.92,
+    ("EUR", "USD"): 1.08,
+    ("USD", "RUB"): 90.0,
+    ("EUR", "RUB"): 98.0,
+    ("USD", "GBP"): 0.79,
+    ("GBP", "USD"): 1.27,
+    ("USD", "JPY"): 148.0,
+    ("JPY", "USD"): 0.0068,
+    ("EUR", "GBP"): 0.86,
+    ("GBP", "EUR"): 1.16,
+    ("RUB", "USD"): 0.0111,
+    ("RUB", "EUR"): 0.0102,
+}
+
+
+class RateMatrix:
+    __slots__ = ("codes", "index", "matrix", "hops")
+
+    def __init__(self, codes: Sequence[str], matrix: np.ndarray, hops: np.ndarray):
+        self.codes = tuple(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.matrix = matrix
+        self.hops = hops
+        self.matrix.flags.writeable = False
+        self.hops.flags.writeable = False
+
+    def get(self, base_currency: str, target_currency: str) -> Optional[float]:
+        i = self.index.get(base_currency)
+        j = self.index.get(target_currency)
+        if i is None or j is None:
+            return None
+        value = self.matrix[i, j]
+        if np.isnan(value):
+            return None
+        return float(value)
+
+
+def _ordered_codes(pairs: Iterable[Tuple[str, str]]) -> list:
+    codes = {code for pair in pairs for code in pair}
+    pivots = [code for code in PIVOT_CURRENCIES if code in codes]
+    return pivots + sorted(codes.difference(pivots))
+
+
+def _resolve(codes: Sequence[str], rates: Mapping[Tuple[str, str], float]):
+    n = len(codes)
+    index = {code: i for i, code in enumerate(codes)}
+    matrix = np.full((n, n), np.nan)
+    hops = np.full((n, n), np.inf)
+
+    if rates:
+        base_idx = np.fromiter((index[b] for b, _ in rates), dtype=np.intp, count=len(rates))
+        target_idx = np.fromiter((index[t] for _, t in rates), dtype=np.intp, count=len(rates))
+        values = np.fromiter(rates.values(), dtype=np.float64, count=len(rates))
+        # Сначала обратные курсы, затем прямые — прямая запись имеет приоритет
+        matrix[target_idx, base_idx] = 1.0 / values
+        hops[target_idx, base_idx] = 1
+        matrix[base_idx, target_idx] = values
+        hops[base_idx, target_idx] = 1
+
+    diagonal = np.arange(n)
+    matrix[diagonal, diagonal] = 1.0
+    hops[diagonal, diagonal] = 0
+
+    # Кратчайший (по числу шагов) путь в графе курсов. Пивотные валюты стоят
+    # первыми в codes, поэтому при равной длине выигрывает путь через USD/EUR.
+    for k in range(n):
+        candidate_hops = hops[:, k, None] + hops[None, k, :]
+        better = candidate_hops < hops
+        if better.any():
+            hops = np.where(better, candidate_hops, hops)
+            matrix = np.where(better, matrix[:, k, None] * matrix[None, k, :], matrix)
+
+    return matrix, hops
+
+
+def build_rate_matrix(
+    rates: Mapping[Tuple[str, str], float],
+    fallback: Optional[Mapping[Tuple[str, str], float]] = DEMO_RATES,
+) -> RateMatrix:
+    fallback = fallback or {}
+    codes = _ordered_codes(list(rates) + list(fallback))
+    matrix, hops = _resolve(codes, rates)
+    if fallback:
+        # Недостающие пары ищем в общем графе, где курсы из БД перекрывают демо-курсы
+        merged = {
+            pair: rate for pair, rate in fallback.items()
+            if pair[::-1] not in rates
+        }
+        merged.update(rates)
+        fallback_matrix, fallback_hops = _resolve(codes, merged)
+        missing = np.isnan(matrix)
+        matrix = np.where(missing, fallback_matrix, matrix)
+        hops = np.where(missing, fallback_hops, hops)
+    return RateMatrix(codes, matrix, hops)
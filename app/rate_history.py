@@ -0,0 +1,237 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models
+from app.rate_cache import rate_cache
+
+if TYPE_CHECKING:
+    from app.rate_engine import RateMatrix
+
+# Сколько матриц курсов (по одной на промежуток между изменениями) держать в памяти
+MAX_MATRICES = 64
+
+
+class RateEntry(NamedTuple):
+    id: int
+    base_currency: str
+    target_currency: str
+    rate: float
+    is_active: bool
+    created_at: datetime
+    last_updated: Optional[datetime]
+
+    def as_dict(self) -> dict:
+        return self._asdict()
+
+
+class RateLog:
+    """Значения одной строки currency_rates во времени."""
+
+    __slots__ = ("timestamps", "entries")
+
+    def __init__(self):
+        self.timestamps: List[datetime] = []
+        self.entries: List[RateEntry] = []
+
+    def add(self, moment: datetime, entry: RateEntry):
+        # Журнал читается по id, а транзакции могут закоммититься не в порядке changed_at
+        index = bisect_right(self.timestamps, moment)
+        self.timestamps.insert(index, moment)
+        self.entries.insert(index, entry)
+
+    def at(self, moment: datetime) -> Optional[RateEntry]:
+        index = bisect_right(self.timestamps, moment)
+        if index == 0:
+            return None
+        return self.entries[index - 1]
+
+
+def normalize_moment(moment: datetime) -> datetime:
+    # В БД время хранится в UTC без часового пояса
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def change_row(rate: models.CurrencyRate, is_active: bool) -> dict:
+    return {
+        "rate_id": rate.id,
+        "base_currency": rate.base_currency,
+        "target_currency": rate.target_currency,
+        "rate": rate.rate,
+        "is_active": bool(is_active),
+    }
+
+
+def record_changes(db: Session, rows: List[dict]):
+    """Вызывается до коммита любой записи в currency_rates, рядом с rate_versions.bump."""
+    if rows:
+        db.execute(insert(models.CurrencyRateChange), rows)
+
+
+async def record_changes_async(db: AsyncSession, rows: List[dict]):
+    if rows:
+        await db.execute(insert(models.CurrencyRateChange), rows)
+
+
+def _changes_query(after_id: int):
+    change = models.CurrencyRateChange
+    return select(
+        change.id, change.rate_id, change.base_currency, change.target_currency,
+        change.rate, change.is_active, change.changed_at,
+    ).where(change.id > after_id).order_by(change.id)
+
+
+class RateHistory:
+    """Курсы на момент времени по журналу currency_rate_changes.
+
+    Журнал только растёт, поэтому после изменения курсов дочитываются лишь новые строки,
+    а промах по уже загруженному журналу окончателен. Курс на момент считается той же
+    матрицей rate_engine, что и текущий: с обратными и кросс-курсами.
+    """
+
+    def __init__(self, max_matrices: int = MAX_MATRICES):
+        self.max_matrices = max_matrices
+        self._logs: Dict[int, RateLog] = {}
+        self._pairs: Dict[Tuple[str, str], List[int]] = {}
+        # Моменты изменений: между соседними набор активных курсов не меняется
+        self._moments: List[datetime] = []
+        self._matrices: "OrderedDict[int, RateMatrix]" = OrderedDict()
+        self._last_change_id = 0
+        # Поколение растёт при каждом изменении курсов; загружено то, что было до loaded
+        self._generation = 1
+        self._loaded_generation = 0
+        self._timeline_version = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matrix_hits = 0
+        self.matrix_builds = 0
+        self.loads = 0
+        self.loaded_changes = 0
+
+    def invalidate(self, *args):
+        with self._lock:
+            self._generation += 1
+
+    def _apply(self, rows: Iterable, generation: int):
+        with self._lock:
+            added = 0
+            for change_id, rate_id, base, target, rate, is_active, changed_at in rows:
+                if change_id <= self._last_change_id:
+                    # Эти строки уже дочитал параллельный запрос
+                    continue
+                moment = normalize_moment(changed_at)
+                log = self._logs.get(rate_id)
+                if log is None:
+                    log = self._logs[rate_id] = RateLog()
+                    self._pairs.setdefault((base, target), []).append(rate_id)
+                created_at = log.timestamps[0] if log.timestamps and log.timestamps[0] <= moment else moment
+                log.add(moment, RateEntry(rate_id, base, target, rate, is_active, created_at, moment))
+                index = bisect_right(self._moments, moment)
+                if index == 0 or self._moments[index - 1] != moment:
+                    self._moments.insert(index, moment)
+                self._last_change_id = change_id
+                added += 1
+            if added:
+                self._matrices.clear()
+                self._timeline_version += 1
+                self.loaded_changes += added
+            self._loaded_generation = max(self._loaded_generation, generation)
+            self.loads += 1
+
+    def _is_current(self) -> bool:
+        return self._loaded_generation >= self._generation
+
+    def load(self, db: Session):
+        generation = self._generation
+        self._apply(db.execute(_changes_query(self._last_change_id)).all(), generation)
+
+    async def load_async(self, db: AsyncSession):
+        generation = self._generation
+        self._apply((await db.execute(_changes_query(self._last_change_id))).all(), generation)
+
+    def _entry_at(self, base_currency: str, target_currency: str, moment: datetime) -> Optional[RateEntry]:
+        with self._lock:
+            self.lookups += 1
+            found = None
+            for rate_id in self._pairs.get((base_currency, target_currency), ()):
+                entry = self._logs[rate_id].at(moment)
+                if entry is not None and entry.is_active and (found is None or entry.id > found.id):
+                    found = entry
+            return found
+
+    def _matrix_at(self, moment: datetime) -> Optional["RateMatrix"]:
+        with self._lock:
+            self.lookups += 1
+            index = bisect_right(self._moments, moment) - 1
+            if index < 0:
+                # Курсов на этот момент ещё не было
+                return None
+            matrix = self._matrices.get(index)
+            if matrix is not None:
+                self._matrices.move_to_end(index)
+                self.matrix_hits += 1
+                return matrix
+            start = self._moments[index]
+            timeline_version = self._timeline_version
+            # Как в rate_cache: активные курсы по порядку id, при дублях пары побеждает последний
+            active = {}
+            for rate_id in sorted(self._logs):
+                entry = self._logs[rate_id].at(start)
+                if entry is not None and entry.is_active:
+                    active[(entry.base_currency, entry.target_currency)] = entry.rate
+
+        # rate_engine тянет numpy, поэтому импортируем его при первой сборке
+        from app.rate_engine import build_rate_matrix
+
+        matrix = build_rate_matrix(active)
+        with self._lock:
+            self.matrix_builds += 1
+            if self._timeline_version == timeline_version:
+                self._matrices[index] = matrix
+                while len(self._matrices) > self.max_matrices:
+                    self._matrices.popitem(last=False)
+        return matrix
+
+    def entry_at(self, db: Session, base_currency: str, target_currency: str, moment: datetime) -> Optional[RateEntry]:
+        """Строка курса пары, действовавшая в момент moment (только прямая пара, как и без at)."""
+        if not self._is_current():
+            self.load(db)
+        return self._entry_at(base_currency, target_currency, normalize_moment(moment))
+
+    async def rate_at_async(self, db: AsyncSession, base_currency: str, target_currency: str,
+                            moment: datetime) -> Optional[float]:
+        if not self._is_current():
+            await self.load_async(db)
+        matrix = self._matrix_at(normalize_moment(moment))
+        if matrix is None:
+            return None
+        return matrix.get(base_currency, target_currency)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": self._loaded_generation > 0,
+                "current": self._is_current(),
+                "rates": len(self._logs),
+                "pairs": len(self._pairs),
+                "entries": sum(len(log.entries) for log in self._logs.values()),
+                "change_moments": len(self._moments),
+                "cached_matrices": len(self._matrices),
+                "lookups": self.lookups,
+                "matrix_hits": self.matrix_hits,
+                "matrix_builds": self.matrix_builds,
+                "loads": self.loads,
+                "loaded_changes": self.loaded_changes,
+            }
+
+
+rate_history = RateHistory()
+rate_cache.add_listener(rate_history.invalidate)
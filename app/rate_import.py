@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+from typing import Dict, List, NamedTuple, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud_async, schemas
+
+IMPORT_FIELDS = ("base_currency", "target_currency", "rate")
+
+
+class ParsedRates(NamedTuple):
+    rates: List[Tuple[int, schemas.CurrencyRateCreate]]
+    errors: List[dict]
+
+
+def detect_format(filename: str = "", content_type: str = "") -> str:
+    if filename.lower().endswith(".json") or "json" in content_type:
+        return "json"
+    return "csv"
+
+
+def _read_csv(content: bytes) -> List[Tuple[int, dict]]:
+    reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+    missing = [field for field in IMPORT_FIELDS if field not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV header must contain: {', '.join(missing)}")
+    return [(reader.line_num, row) for row in reader]
+
+
+def _read_json(content: bytes) -> List[Tuple[int, dict]]:
+    data = json.loads(content)
+    if isinstance(data, dict):
+        data = data.get("rates")
+    if not isinstance(data, list):
+        raise ValueError("JSON must be a list of rates or an object with a 'rates' list")
+    return list(enumerate(data, start=1))
+
+
+def _error_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" if item["loc"] else item["msg"]
+        for item in error.errors()
+    )
+
+
+def parse_rates(content: bytes, fmt: str) -> ParsedRates:
+    raw_rows = _read_json(content) if fmt == "json" else _read_csv(content)
+
+    rates = []
+    errors = []
+    seen: Dict[Tuple[str, str], int] = {}
+    for row_number, raw in raw_rows:
+        if not isinstance(raw, dict):
+            errors.append({"row": row_number, "error": "Row must be an object"})
+            continue
+        values = {field: raw.get(field) for field in IMPORT_FIELDS}
+        for field in ("base_currency", "target_currency"):
+            if isinstance(values[field], str):
+                values[field] = values[field].strip().upper()
+        try:
+            rate = schemas.CurrencyRateCreate(**values)
+        except ValidationError as e:
+            errors.append({"row": row_number, "error": _error_message(e)})
+            continue
+        if rate.base_currency == rate.target_currency:
+            errors.append({"row": row_number, "error": "Base and target currency must differ"})
+            continue
+        pair = (rate.base_currency, rate.target_currency)
+        if pair in seen:
+            errors.append({"row": row_number, "error": f"Duplicate pair {pair[0]}/{pair[1]} (first seen in row {seen[pair]})"})
+            continue
+        seen[pair] = row_number
+        rates.append((row_number, rate))
+    return ParsedRates(rates, errors)
+
+
+async def import_rates(db: AsyncSession, content: bytes, fmt: str) -> dict:
+    parsed = parse_rates(content, fmt)
+    if parsed.rates:
+        result = await crud_async.import_currency_rates(db, [rate for _, rate in parsed.rates])
+    else:
+        result = {"created": 0, "deactivated": 0, "unchanged": 0, "changed_pairs": []}
+    result["rows"] = len(parsed.rates) + len(parsed.errors)
+    result["errors"] = parsed.errors
+    return result
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+
+from app.rate_cache import RateSnapshot, rate_cache
+
+Pair = Tuple[str, str]
+
+HEARTBEAT_SECONDS = 15
+MAX_PAIRS_PER_SUBSCRIPTION = 100
+
+
+def format_pair(pair: Pair) -> str:
+    return f"{pair[0]}/{pair[1]}"
+
+
+def parse_pairs(value: str) -> Tuple[Pair, ...]:
+    pairs = []
+    for item in value.split(","):
+        item = item.strip().upper()
+        if not item:
+            continue
+        base, _, target = item.partition("/")
+        if len(base) != 3 or len(target) != 3 or not (base + target).isalpha():
+            raise ValueError(f"Invalid pair: {item}")
+        pairs.append((base, target))
+    if not pairs:
+        raise ValueError("At least one pair is required")
+    if len(pairs) > MAX_PAIRS_PER_SUBSCRIPTION:
+        raise ValueError(f"Too many pairs (max {MAX_PAIRS_PER_SUBSCRIPTION})")
+    return tuple(dict.fromkeys(pairs))
+
+
+class Subscriber:
+    # Подписчиков могут быть десятки тысяч: никаких очередей, только последнее значение по паре
+    __slots__ = ("pairs", "pending", "version", "event")
+
+    def __init__(self, pairs: Tuple[Pair, ...]):
+        self.pairs = pairs
+        self.pending: Dict[Pair, Optional[float]] = {}
+        self.version: Optional[str] = None
+        self.event = asyncio.Event()
+
+    def take(self) -> Dict[Pair, Optional[float]]:
+        pending, self.pending = self.pending, {}
+        self.event.clear()
+        return pending
+
+
+class RateBroadcaster:
+    def __init__(self):
+        self._by_pair: Dict[Pair, Set[Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, pairs: Iterable[Pair]) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(tuple(pairs))
+        with self._lock:
+            for pair in subscriber.pairs:
+                self._by_pair.setdefault(pair, set()).add(subscriber)
+            self.subscribers += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            for pair in subscriber.pairs:
+                subscribers = self._by_pair.get(pair)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._by_pair[pair]
+            self.subscribers -= 1
+
+    def on_rates_changed(self, previous: Optional[RateSnapshot], snapshot: RateSnapshot):
+        # Вызывается из потока, который перестроил кэш; доставка идёт в цикле событий
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        with self._lock:
+            watched = list(self._by_pair)
+        if not watched:
+            return
+        changes = {}
+        for pair in watched:
+            rate = snapshot.get(*pair)
+            if previous is None or previous.get(*pair) != rate:
+                changes[pair] = rate
+        if changes:
+            loop.call_soon_threadsafe(self._publish, changes, snapshot.version)
+
+    def _publish(self, changes: Dict[Pair, Optional[float]], version: str):
+        self.published += 1
+        touched = set()
+        with self._lock:
+            for pair, rate in changes.items():
+                for subscriber in self._by_pair.get(pair, ()):
+                    subscriber.pending[pair] = rate
+                    subscriber.version = version
+                    touched.add(subscriber)
+        for subscriber in touched:
+            subscriber.event.set()
+        self.delivered += len(touched)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "watched_pairs": len(self._by_pair),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
+
+
+def _sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_rates(pairs: Tuple[Pair, ...], snapshot: RateSnapshot) -> AsyncIterator[str]:
+    subscriber = rate_broadcaster.subscribe(pairs)
+    # Снимок берём уже после подписки, чтобы не потерять изменение между ними
+    snapshot = rate_cache.snapshot or snapshot
+    try:
+        yield _sse(
+            "snapshot",
+            {format_pair(pair): snapshot.get(*pair) for pair in subscriber.pairs},
+            snapshot.version,
+        )
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.event.wait(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            changes = subscriber.take()
+            if changes:
+                yield _sse("rates", {format_pair(pair): rate for pair, rate in changes.items()}, subscriber.version)
+    finally:
+        rate_broadcaster.unsubscribe(subscriber)
+
+
+rate_broadcaster = RateBroadcaster()
+rate_cache.add_listener(rate_broadcaster.on_rates_changed)
@@ -0,0 +1,127 @@
+import time
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models
+
+ROW_ID = 1
+
+
+class RateTableVersion(NamedTuple):
+    epoch: int
+    version: int
+    updated_at: Optional[datetime]
+
+    def is_older_than(self, other: "RateTableVersion") -> bool:
+        # Эпоха — время заведения счётчика: пересозданная БД или сброс эпохи побеждают старые версии
+        return (self.epoch, self.version) < (other.epoch, other.version)
+
+
+UNKNOWN = RateTableVersion(0, 0, None)
+
+
+def new_epoch() -> int:
+    return time.time_ns() // 1000
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def current_query():
+    table = models.RateVersion
+    return select(table.epoch, table.version, table.updated_at).where(table.id == ROW_ID)
+
+
+def _bump_statement():
+    table = models.RateVersion
+    return update(table).where(table.id == ROW_ID).values(version=table.version + 1)
+
+
+def _seed_statement(version: int = 1):
+    return insert(models.RateVersion).values(
+        id=ROW_ID, epoch=new_epoch(), version=version, updated_at=_utcnow().replace(microsecond=0)
+    )
+
+
+def next_updated_at(previous: Optional[datetime]) -> datetime:
+    """Время изменения для Last-Modified: строго растёт с точностью до секунды.
+
+    If-Modified-Since сравнивается по секундам, поэтому две записи в одну секунду
+    иначе дали бы одинаковый Last-Modified и ложный 304 для клиента между ними.
+    """
+    now = _utcnow().replace(microsecond=0)
+    if previous is None:
+        return now
+    if previous.tzinfo is None:
+        previous = previous.replace(tzinfo=timezone.utc)
+    return max(now, previous.replace(microsecond=0) + timedelta(seconds=1))
+
+
+def _touch_statement(previous: Optional[datetime]):
+    table = models.RateVersion
+    return update(table).where(table.id == ROW_ID).values(updated_at=next_updated_at(previous))
+
+
+def read(db: Session) -> RateTableVersion:
+    row = db.execute(current_query()).first()
+    return RateTableVersion(*row) if row else UNKNOWN
+
+
+async def read_async(db: AsyncSession) -> RateTableVersion:
+    row = (await db.execute(current_query())).first()
+    return RateTableVersion(*row) if row else UNKNOWN
+
+
+def bump(db: Session):
+    """Вызывается до коммита любой записи в currency_rates: вставки, изменения и удаления."""
+    # Сначала UPDATE — он берёт блокировку строки, и предыдущее время читается уже под ней
+    if db.execute(_bump_statement()).rowcount == 0:
+        db.execute(_seed_statement())
+        return
+    db.execute(_touch_statement(read(db).updated_at))
+
+
+async def bump_async(db: AsyncSession):
+    if (await db.execute(_bump_statement())).rowcount == 0:
+        await db.execute(_seed_statement())
+        return
+    await db.execute(_touch_statement((await read_async(db)).updated_at))
+
+
+def seed(conn: Connection):
+    if conn.execute(current_query()).first() is None:
+        conn.execute(_seed_statement())
+
+
+def reset_if_behind(conn: Connection, seen: RateTableVersion) -> bool:
+    """Если версия в БД меньше уже виденной (БД восстановили из бэкапа), заводит новую эпоху.
+
+    Иначе снимки, собранные до отката, считались бы новее данных в БД.
+    """
+    latest = read(conn)
+    if latest == UNKNOWN or not latest.is_older_than(seen):
+        return False
+    table = models.RateVersion
+    conn.execute(
+        update(table).where(table.id == ROW_ID, table.epoch == latest.epoch, table.version == latest.version)
+        .values(epoch=max(new_epoch(), seen.epoch + 1), updated_at=next_updated_at(seen.updated_at))
+    )
+    return True
+
+
+async def reset_if_behind_async(conn, seen: RateTableVersion) -> bool:
+    latest = await read_async(conn)
+    if latest == UNKNOWN or not latest.is_older_than(seen):
+        return False
+    table = models.RateVersion
+    await conn.execute(
+        update(table).where(table.id == ROW_ID, table.epoch == latest.epoch, table.version == latest.version)
+        .values(epoch=max(new_epoch(), seen.epoch + 1), updated_at=next_updated_at(seen.updated_at))
+    )
+    return True
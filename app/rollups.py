@@ -0,0 +1,180 @@
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models, partitions
+from app.user_stats import UPSERT_DIALECTS, Merge, execute_upserts, execute_upserts_async
+
+GRANULARITIES = ("hour", "day")
+
+# Не даём строить отчёт по слишком большому числу корзин
+MAX_BUCKETS = {
+    "hour": 24 * 31,
+    "day": 366 * 2,
+}
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def bucket_step(granularity: str) -> timedelta:
+    return timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+
+
+def rollup_upserts(dialect_name: str, rows: List[dict]) -> list:
+    buckets: Dict[Tuple[str, datetime, str, str], list] = {}
+    for row in rows:
+        timestamp = row.get("timestamp") or partitions.utc_now()
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(timestamp, granularity), row["from_currency"], row["to_currency"])
+            totals = buckets.get(key)
+            if totals is None:
+                totals = buckets[key] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += row["amount"]
+            totals[2] += row["converted_amount"]
+    if not buckets:
+        return []
+
+    rollups = models.ConversionRollup.__table__
+    values = [
+        {
+            "granularity": granularity,
+            "bucket_start": start,
+            "from_currency": from_currency,
+            "to_currency": to_currency,
+            "conversion_count": count,
+            "amount_total": amount_total,
+            "converted_total": converted_total,
+        }
+        for (granularity, start, from_currency, to_currency), (count, amount_total, converted_total) in buckets.items()
+    ]
+    keys = (rollups.c.granularity, rollups.c.bucket_start, rollups.c.from_currency, rollups.c.to_currency)
+    totals = ("conversion_count", "amount_total", "converted_total")
+
+    upsert = UPSERT_DIALECTS.get(dialect_name)
+    if upsert is None:
+        return [
+            Merge(
+                update(rollups)
+                .where(*(key == row[key.name] for key in keys))
+                .values({column: rollups.c[column] + row[column] for column in totals}),
+                insert(rollups).values(row),
+            )
+            for row in values
+        ]
+
+    stmt = upsert(rollups).values(values)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: rollups.c[column] + excluded[column] for column in totals},
+    )
+    return [stmt]
+
+
+def apply_conversions(db: Session, rows: List[dict]):
+    execute_upserts(db, rollup_upserts(db.get_bind().dialect.name, rows))
+
+
+async def apply_conversions_async(db: AsyncSession, rows: List[dict]):
+    await execute_upserts_async(db, rollup_upserts(db.bind.dialect.name, rows))
+
+
+def default_range(granularity: str, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    now = now or partitions.utc_now()
+    date_to = bucket_start(now, granularity) + bucket_step(granularity)
+    span = timedelta(hours=48) if granularity == "hour" else timedelta(days=30)
+    return date_to - span, date_to
+
+
+def validate_range(granularity: str, date_from: datetime, date_to: datetime):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    if date_to <= date_from:
+        raise ValueError("date_to must be after date_from")
+    if (date_to - date_from) / bucket_step(granularity) > MAX_BUCKETS[granularity]:
+        raise ValueError(f"Range is too long for {granularity} buckets (max {MAX_BUCKETS[granularity]})")
+
+
+def rollup_query(
+    granularity: str,
+    date_from: datetime,
+    date_to: datetime,
+    from_currency: Optional[str] = None,
+    to_currency: Optional[str] = None,
+):
+    rollup = models.ConversionRollup
+    stmt = select(rollup).where(
+        rollup.granularity == granularity,
+        rollup.bucket_start >= bucket_start(date_from, granularity),
+        rollup.bucket_start < date_to,
+    )
+    if from_currency is not None:
+        stmt = stmt.where(rollup.from_currency == from_currency)
+    if to_currency is not None:
+        stmt = stmt.where(rollup.to_currency == to_currency)
+    return stmt.order_by(rollup.bucket_start, rollup.from_currency, rollup.to_currency)
+
+
+async def get_rollups(db: AsyncSession, granularity: str, date_from: datetime, date_to: datetime,
+                      from_currency: Optional[str] = None, to_currency: Optional[str] = None):
+    validate_range(granularity, date_from, date_to)
+    return (await db.scalars(rollup_query(granularity, date_from, date_to, from_currency, to_currency))).all()
+
+
+def _bucket_expression(dialect_name: str, granularity: str, column):
+    if dialect_name == "postgresql":
+        return func.date_trunc(granularity, column)
+    # Формат совпадает с тем, как SQLAlchemy хранит DateTime в SQLite
+    pattern = "%Y-%m-%d %H:00:00.000000" if granularity == "hour" else "%Y-%m-%d 00:00:00.000000"
+    return func.strftime(pattern, column)
+
+
+def rebuild(conn):
+    """Пересчитывает корзины целиком из истории в БД (без выгруженных в архив месяцев). Принимает Session или Connection."""
+    history = partitions.history_source(conn)
+    dialect_name = conn.get_bind().dialect.name if isinstance(conn, Session) else conn.dialect.name
+    conn.execute(delete(models.ConversionRollup))
+    for granularity in GRANULARITIES:
+        bucket = _bucket_expression(dialect_name, granularity, history.timestamp)
+        conn.execute(insert(models.ConversionRollup).from_select(
+            ["granularity", "bucket_start", "from_currency", "to_currency",
+             "conversion_count", "amount_total", "converted_total"],
+            select(
+                literal(granularity),
+                bucket,
+                history.from_currency,
+                history.to_currency,
+                func.count(),
+                func.sum(history.amount),
+                func.sum(history.converted_amount),
+            ).group_by(bucket, history.from_currency, history.to_currency),
+        ))
+    return conn.execute(select(func.count()).select_from(models.ConversionRollup)).scalar()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пересчёт почасовых и посуточных сводок конвертаций")
+    parser.parse_args(argv)
+
+    from app.database import Base, engine
+    from app.migrations import run_migrations
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    with engine.begin() as conn:
+        buckets = rebuild(conn)
+    print(f"✅ Сводки пересчитаны: {buckets} корзин")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, validator
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from decimal import Decimal
 
@@ -49,6 +49,7 @@ class CurrencyRateResponse(CurrencyRateBase):
     id: int
     is_active: bool
     last_updated: datetime
+    created_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
@@ -57,6 +58,7 @@ class ConversionRequest(BaseModel):
     amount: float = Field(..., gt=0)
     from_currency: str = Field(..., min_length=3, max_length=3, pattern="^[A-Z]{3}$")
     to_currency: str = Field(..., min_length=3, max_length=3, pattern="^[A-Z]{3}$")
+    as_of: Optional[datetime] = None
     
     @validator('from_currency', 'to_currency')
     def currency_uppercase(cls, v):
@@ -87,6 +89,22 @@ class ConversionHistoryResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CurrencyStats(BaseModel):
+    currency: str
+    conversions_from: int
+    conversions_to: int
+    amount_from: float
+    amount_to: float
+    
+    class Config:
+        from_attributes = True
+
+class UserStatsResponse(BaseModel):
+    conversion_count: int = 0
+    first_conversion_at: Optional[datetime] = None
+    last_conversion_at: Optional[datetime] = None
+    currencies: List[CurrencyStats] = []
+
 class RegisterForm(BaseModel):
     username: str = Field(..., min_length=3, max_length=50)
     password: str = Field(..., min_length=6)
@@ -96,4 +114,15 @@ class RegisterForm(BaseModel):
     def passwords_match(cls, v, values):
         if "password" in values and v != values["password"]:
             raise ValueError("Пароли не совпадают")
-        return v
\ No newline at end of file
+        return v
+
+class ConversionRollupResponse(BaseModel):
+    bucket_start: datetime
+    from_currency: str
+    to_currency: str
+    conversion_count: int
+    amount_total: float
+    converted_total: float
+    
+    class Config:
+        from_attributes = True
@@ -0,0 +1,286 @@
+import asyncio
+import calendar
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+from app.rate_versions import RateTableVersion
+from app.startup import database_identity, file_lock
+
+# Формат сегмента (little-endian, все смещения кратны 8):
+#   заголовок, 64 байта: magic, capacity, активный слот, номер публикации, флаги
+#   два слота одинакового размера; писатель всегда пишет в неактивный слот,
+#   так что снимок, который читают воркеры, не меняется у них под ногами:
+#     generation u64 — seqlock: нечётное значение, пока слот переписывается
+#     номер публикации u64, эпоха и версия rate_versions u64,
+#     count u32, last_modified f64 (UTC, NaN — неизвестно)
+#     коды валют по 4 байта, матрица курсов count x count float64,
+#     флаги прямых курсов count x count uint8
+# Публикации упорядочены по (эпоха, версия) из БД, а не по времени изменения курсов:
+# удаление самого свежего курса отодвигает max(last_updated) назад, а версия растёт всегда.
+MAGIC = b"RATESHM2"
+HEADER = struct.Struct("<8sIIQ8xI")
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct("<QQQQI4xd")
+SLOT_HEADER_SIZE = 48
+CODE_SIZE = 4
+
+_ACTIVE_OFFSET = 12
+_SEQUENCE_OFFSET = 16
+_FLAGS_OFFSET = 32
+FLAG_DISABLED = 1
+
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+
+def _align8(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def default_path(database_url: str) -> str:
+    digest = hashlib.sha1(database_identity(database_url).encode()).hexdigest()[:12]
+    # /dev/shm — память без записи на диск; на других системах хватит и временного каталога
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"currency-converter-rates-{digest}.bin")
+
+
+def _to_timestamp(moment: Optional[datetime]) -> float:
+    if moment is None:
+        return float("nan")
+    # Как и в http_cache: время без пояса считаем UTC
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(moment.timetuple()) + moment.microsecond / 1_000_000
+
+
+def _from_timestamp(value: float) -> Optional[datetime]:
+    if value != value:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+
+
+class SharedSnapshot(NamedTuple):
+    sequence: int
+    source: RateTableVersion
+    matrix: "SharedRateMatrix"
+    rates: Dict[Tuple[str, str], float]
+    last_modified: Optional[datetime]
+
+
+class SharedRateMatrix:
+    """Матрица курсов прямо поверх mmap, без копии в памяти воркера.
+
+    Если слот успели переписать (снимок устарел на две публикации), значение
+    берётся из актуального слота — курс может оказаться новее, но не «рваным».
+    """
+    __slots__ = ("codes", "index", "_segment", "_count", "_values", "_generation", "_expected")
+
+    def __init__(self, segment: "SharedRates", slot: int, generation: int, codes: Sequence[str]):
+        self.codes = tuple(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self._segment = segment
+        self._count = len(self.codes)
+        offset = segment.slot_offset(slot)
+        matrix_offset = offset + segment.matrix_offset
+        self._values = segment.view[matrix_offset:matrix_offset + self._count * self._count * 8].cast("d")
+        self._generation = segment.view[offset:offset + 8].cast("Q")
+        self._expected = generation
+
+    def get(self, base_currency: str, target_currency: str) -> Optional[float]:
+        if self._generation[0] != self._expected:
+            return self._segment.lookup(base_currency, target_currency)
+        i = self.index.get(base_currency)
+        j = self.index.get(target_currency)
+        if i is None or j is None:
+            return None
+        value = self._values[i * self._count + j]
+        if self._generation[0] != self._expected:
+            return self._segment.lookup(base_currency, target_currency)
+        if value != value:
+            return None
+        return value
+
+
+class SharedRates:
+    def __init__(self, path: str, capacity: int):
+        # Чётная ёмкость — чтобы блок кодов тоже был выровнен по 8 байт
+        self.capacity = capacity + (capacity & 1)
+        self.path = path
+        self.codes_offset = SLOT_HEADER_SIZE
+        self.matrix_offset = self.codes_offset + self.capacity * CODE_SIZE
+        self.direct_offset = self.matrix_offset + self.capacity * self.capacity * 8
+        self.slot_size = _align8(self.direct_offset + self.capacity * self.capacity)
+        self.size = HEADER_SIZE + 2 * self.slot_size
+
+        self._lock = threading.Lock()
+        self._current: Optional[SharedSnapshot] = None
+        self.publishes = 0
+        self.loads = 0
+        self.retries = 0
+
+        with file_lock(self.lock_path):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fresh = os.fstat(fd).st_size != self.size
+                if not fresh:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    magic, stored_capacity = struct.unpack_from("<8sI", os.read(fd, 12))
+                    fresh = magic != MAGIC or stored_capacity != self.capacity
+                if fresh:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                self._mmap = mmap.mmap(fd, self.size)
+            finally:
+                os.close(fd)
+            if fresh:
+                HEADER.pack_into(self._mmap, 0, MAGIC, self.capacity, 0, 0, 0)
+        self.view = memoryview(self._mmap)
+
+    @property
+    def lock_path(self) -> str:
+        return self.path + ".lock"
+
+    def slot_offset(self, slot: int) -> int:
+        return HEADER_SIZE + slot * self.slot_size
+
+    @property
+    def sequence(self) -> int:
+        """Номер последней публикации; 0 — сегмент ещё пуст."""
+        return _U64.unpack_from(self._mmap, _SEQUENCE_OFFSET)[0]
+
+    def published_source(self) -> Optional[RateTableVersion]:
+        if self.sequence == 0:
+            return None
+        slot = _U32.unpack_from(self._mmap, _ACTIVE_OFFSET)[0]
+        _, _, epoch, version, _, last_modified = SLOT_HEADER.unpack_from(self._mmap, self.slot_offset(slot))
+        return RateTableVersion(epoch, version, _from_timestamp(last_modified))
+
+    @property
+    def disabled(self) -> bool:
+        return bool(_U32.unpack_from(self._mmap, _FLAGS_OFFSET)[0] & FLAG_DISABLED)
+
+    def publish(self, codes: Sequence[str], matrix, rates: Dict[Tuple[str, str], float],
+                last_modified: Optional[datetime], source: RateTableVersion) -> Optional[int]:
+        """Записывает матрицу в неактивный слот и переключает на него.
+
+        Возвращает номер публикации; если в сегменте уже та же или более новая версия курсов,
+        ничего не пишет. None — не поместилось: сегмент отключается для всех воркеров,
+        пока курсы снова не поместятся при следующей публикации.
+        """
+        import numpy as np
+
+        count = len(codes)
+        with self._lock, file_lock(self.lock_path):
+            if count > self.capacity:
+                _U32.pack_into(self._mmap, _FLAGS_OFFSET, FLAG_DISABLED)
+                return None
+            if self.disabled:
+                # Валют снова не больше ёмкости (или это новый запуск) — включаем сегмент обратно
+                _U32.pack_into(self._mmap, _FLAGS_OFFSET, 0)
+
+            published = self.published_source()
+            if published is not None and not published.is_older_than(source):
+                # Другой воркер уже опубликовал эти или более новые курсы
+                return self.sequence
+            active = _U32.unpack_from(self._mmap, _ACTIVE_OFFSET)[0]
+            slot = 1 - active
+            offset = self.slot_offset(slot)
+            generation = _U64.unpack_from(self._mmap, offset)[0] + 1
+            sequence = self.sequence + 1
+
+            _U64.pack_into(self._mmap, offset, generation)
+            self._mmap[offset + self.codes_offset:offset + self.codes_offset + count * CODE_SIZE] = b"".join(
+                code.encode("ascii").ljust(CODE_SIZE, b"\0") for code in codes
+            )
+            values = np.frombuffer(self._mmap, dtype=np.float64, count=count * count, offset=offset + self.matrix_offset)
+            values[:] = np.asarray(matrix, dtype=np.float64).ravel()
+            index = {code: i for i, code in enumerate(codes)}
+            direct = np.zeros(count * count, dtype=np.uint8)
+            for base, target in rates:
+                direct[index[base] * count + index[target]] = 1
+            self._mmap[offset + self.direct_offset:offset + self.direct_offset + count * count] = direct.tobytes()
+            del values
+            SLOT_HEADER.pack_into(self._mmap, offset, generation + 1, sequence, source.epoch, source.version,
+                                  count, _to_timestamp(last_modified))
+
+            _U32.pack_into(self._mmap, _ACTIVE_OFFSET, slot)
+            _U64.pack_into(self._mmap, _SEQUENCE_OFFSET, sequence)
+            self.publishes += 1
+            return sequence
+
+    def load(self) -> Optional[SharedSnapshot]:
+        """Читает активный слот без блокировок: повторяет, пока не увидит согласованное состояние."""
+        while True:
+            sequence = self.sequence
+            if sequence == 0:
+                return None
+            current = self._current
+            if current is not None and current.sequence == sequence:
+                return current
+
+            slot = _U32.unpack_from(self._mmap, _ACTIVE_OFFSET)[0]
+            offset = self.slot_offset(slot)
+            generation, slot_sequence, epoch, version, count, last_modified = SLOT_HEADER.unpack_from(self._mmap, offset)
+            if generation & 1 or slot_sequence != sequence:
+                self.retries += 1
+                continue
+            raw_codes = bytes(self._mmap[offset + self.codes_offset:offset + self.codes_offset + count * CODE_SIZE])
+            direct = bytes(self._mmap[offset + self.direct_offset:offset + self.direct_offset + count * count])
+            codes = [
+                raw_codes[i:i + CODE_SIZE].rstrip(b"\0").decode("ascii")
+                for i in range(0, len(raw_codes), CODE_SIZE)
+            ]
+            matrix = SharedRateMatrix(self, slot, generation, codes)
+            values = matrix._values
+            rates = {
+                (codes[position // count], codes[position % count]): values[position]
+                for position, flag in enumerate(direct) if flag
+            }
+            if _U64.unpack_from(self._mmap, offset)[0] != generation:
+                self.retries += 1
+                continue
+
+            snapshot = SharedSnapshot(
+                sequence, RateTableVersion(epoch, version, _from_timestamp(last_modified)), matrix, rates,
+                _from_timestamp(last_modified)
+            )
+            self._current = snapshot
+            self.loads += 1
+            return snapshot
+
+    def lookup(self, base_currency: str, target_currency: str) -> Optional[float]:
+        snapshot = self.load()
+        if snapshot is None:
+            return None
+        return snapshot.matrix.get(base_currency, target_currency)
+
+    def stats(self) -> dict:
+        published = self.published_source()
+        return {
+            "path": self.path,
+            "capacity": self.capacity,
+            "bytes": self.size,
+            "sequence": self.sequence,
+            "epoch": published.epoch if published is not None else None,
+            "rates_version": published.version if published is not None else None,
+            "disabled": self.disabled,
+            "publishes": self.publishes,
+            "loads": self.loads,
+            "retries": self.retries,
+        }
+
+
+async def watch(cache, interval: float):
+    """Замечает публикации других воркеров, даже если к этому никто не обращается (нужно SSE-подписчикам)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            cache.refresh_shared()
+        except Exception as e:
+            print(f"⚠️ Не удалось обновить курсы из общей памяти: {e}")
@@ -0,0 +1,94 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+
+class RequestQueries:
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # Текст запроса -> сколько раз выполнен; параметры не учитываются
+        self.statements: Dict[str, int] = {}
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.count} queries"'
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+_captures: List[List[RequestQueries]] = []
+
+
+def current_queries() -> Optional[RequestQueries]:
+    return _current.get()
+
+
+def begin_request() -> RequestQueries:
+    queries = RequestQueries()
+    _current.set(queries)
+    return queries
+
+
+def finish_request(queries: RequestQueries):
+    for captured in _captures:
+        captured.append(queries)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = _current.get()
+    if queries is None:
+        return
+    started = conn.info.get("query_started")
+    if started:
+        queries.record(statement, time.perf_counter() - started.pop())
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Падает, если код внутри блока или любой завершившийся в нём запрос сделал больше limit запросов к БД."""
+    direct = RequestQueries()
+    token = _current.set(direct)
+    captured: List[RequestQueries] = []
+    _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        _captures.remove(captured)
+        _current.reset(token)
+
+    for queries in [direct, *captured]:
+        if queries.count > limit:
+            statements = "\n".join(
+                f"  {count} x {statement}"
+                for statement, count in sorted(queries.statements.items(), key=lambda item: -item[1])
+            )
+            raise AssertionError(f"Expected at most {limit} queries, got {queries.count}:\n{statements}")
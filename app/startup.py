@@ -0,0 +1,186 @@
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+from app.config import settings
+
+
+class StartupTimer:
+    def __init__(self):
+        # Отсчёт идёт с импорта этого модуля, то есть почти с начала импорта app.main
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready_seconds: Optional[float] = None
+        self.one_time_work: List[str] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def mark(self, name: str):
+        """Фиксирует фазу, которая длилась с конца предыдущей (например, импорт модулей)."""
+        self.phases[name] = time.perf_counter() - self.started - sum(self.phases.values())
+
+    def mark_ready(self) -> float:
+        self.ready_seconds = time.perf_counter() - self.started
+        return self.ready_seconds
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "ready_seconds": round(self.ready_seconds, 4) if self.ready_seconds is not None else None,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "one_time_work": list(self.one_time_work),
+        }
+
+
+def database_identity(database_url: str) -> str:
+    """Строка, одинаковая для всех процессов, работающих с одной БД, и разная для разных БД.
+
+    Путь SQLite-файла в URL бывает относительным (sqlite:///./app.db) — разворачиваем его
+    в абсолютный, иначе два развёртывания на одном хосте делили бы блокировки и общую память.
+    """
+    from sqlalchemy.engine import make_url
+
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        database = url.database or ""
+        if not database or database == ":memory:" or "mode=memory" in database:
+            # У каждого процесса своя база в памяти
+            return f"sqlite::memory:{os.getpid()}"
+        if not database.startswith("file:"):
+            database = os.path.realpath(database)
+        return f"sqlite:{database}"
+    return url.render_as_string(hide_password=True)
+
+
+def default_lock_path(database_url: str) -> str:
+    digest = hashlib.sha1(database_identity(database_url).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"currency-converter-startup-{digest}.lock")
+
+
+@contextmanager
+def file_lock(path: str):
+    """Межпроцессная блокировка на файле: воркеры uvicorn выполняют защищённый участок по очереди."""
+    with open(path, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            lock_file.seek(0)
+            # LK_LOCK сам ждёт около 10 секунд и затем бросает OSError, поэтому ждём в цикле
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            yield
+
+
+def try_lock_file(lock_file) -> bool:
+    """Неблокирующий захват открытого файла; блокировка живёт, пока файл открыт."""
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+    if msvcrt is not None:
+        lock_file.seek(0)
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    return True
+
+
+def create_initial_admin(db) -> bool:
+    from app import crud, schemas
+
+    ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+    ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
+    changed = False
+
+    try:
+        admin_user = crud.get_user_by_username(db, username=ADMIN_USERNAME)
+
+        if not admin_user:
+            user_create = schemas.UserCreate(
+                username=ADMIN_USERNAME,
+                password=ADMIN_PASSWORD
+            )
+            admin_user = crud.create_user(db=db, user=user_create)
+            changed = True
+            print(f"✅ Администратор '{ADMIN_USERNAME}' успешно создан!")
+
+        if not admin_user.is_admin:
+            admin_user.is_admin = True
+            db.commit()
+            changed = True
+            print(f"✅ Пользователь '{ADMIN_USERNAME}' получил права администратора!")
+
+    except Exception as e:
+        print(f"❌ Ошибка при создании админа: {str(e)}")
+    return changed
+
+
+def prepare_database(timer: Optional[StartupTimer] = None) -> List[str]:
+    """Создаёт схему, применяет миграции и заводит админа.
+
+    Все шаги идемпотентны; под блокировкой первый воркер выполняет их, а остальные
+    только убеждаются, что делать уже нечего. Возвращает список реально сделанной работы.
+    """
+    from app.database import Base, SessionLocal, engine, SQLALCHEMY_DATABASE_URL
+    from app.migrations import run_migrations
+
+    timer = timer or StartupTimer()
+    done = []
+    lock_path = settings.STARTUP_LOCK_PATH or default_lock_path(SQLALCHEMY_DATABASE_URL)
+    waiting = time.perf_counter()
+    with file_lock(lock_path):
+        timer.phases["lock_wait"] = time.perf_counter() - waiting
+        with timer.phase("schema"):
+            Base.metadata.create_all(bind=engine)
+            applied = run_migrations(engine)
+        if applied:
+            done.append(f"migrations:{','.join(str(migration.version) for migration in applied)}")
+        with timer.phase("admin"):
+            db = SessionLocal()
+            try:
+                if create_initial_admin(db):
+                    done.append("admin")
+            finally:
+                db.close()
+    timer.one_time_work.extend(done)
+    return done
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,236 @@
+import argparse
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from sqlalchemy import Insert, Update, case, delete, func, insert, literal, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models, partitions, schemas
+
+UPSERT_DIALECTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+class Merge(NamedTuple):
+    """Прибавление к строке для СУБД без INSERT ... ON CONFLICT: UPDATE, а если строки ещё нет — INSERT."""
+    update: Update
+    insert: Insert
+
+
+def _aggregate(rows: Iterable[dict]):
+    users: Dict[int, list] = {}
+    currencies: Dict[Tuple[int, str], list] = {}
+    for row in rows:
+        user_id = row["user_id"]
+        timestamp = row.get("timestamp") or partitions.utc_now()
+        user = users.get(user_id)
+        if user is None:
+            users[user_id] = [1, timestamp, timestamp]
+        else:
+            user[0] += 1
+            user[1] = min(user[1], timestamp)
+            user[2] = max(user[2], timestamp)
+
+        source = currencies.setdefault((user_id, row["from_currency"]), [0, 0, 0.0, 0.0])
+        source[0] += 1
+        source[2] += row["amount"]
+        target = currencies.setdefault((user_id, row["to_currency"]), [0, 0, 0.0, 0.0])
+        target[1] += 1
+        target[3] += row["converted_amount"]
+    return users, currencies
+
+
+def _earliest(column, value):
+    return case((column.is_(None), value), (value < column, value), else_=column)
+
+
+def _latest(column, value):
+    return case((column.is_(None), value), (value > column, value), else_=column)
+
+
+def stats_upserts(dialect_name: str, rows: List[dict]) -> list:
+    # Счётчики прибавляются в самой БД, поэтому параллельные записи не теряют друг друга
+    users, currencies = _aggregate(rows)
+    if not users:
+        return []
+
+    user_stats = models.UserStats.__table__
+    user_rows = [
+        {"user_id": user_id, "conversion_count": count, "first_conversion_at": first, "last_conversion_at": last}
+        for user_id, (count, first, last) in users.items()
+    ]
+    currency_stats = models.UserCurrencyStats.__table__
+    currency_rows = [
+        {
+            "user_id": user_id,
+            "currency": currency,
+            "conversions_from": conversions_from,
+            "conversions_to": conversions_to,
+            "amount_from": amount_from,
+            "amount_to": amount_to,
+        }
+        for (user_id, currency), (conversions_from, conversions_to, amount_from, amount_to) in currencies.items()
+    ]
+    totals = ("conversions_from", "conversions_to", "amount_from", "amount_to")
+
+    upsert = UPSERT_DIALECTS.get(dialect_name)
+    if upsert is None:
+        return [
+            Merge(
+                update(user_stats).where(user_stats.c.user_id == row["user_id"]).values(
+                    conversion_count=user_stats.c.conversion_count + row["conversion_count"],
+                    first_conversion_at=_earliest(user_stats.c.first_conversion_at, row["first_conversion_at"]),
+                    last_conversion_at=_latest(user_stats.c.last_conversion_at, row["last_conversion_at"]),
+                ),
+                insert(user_stats).values(row),
+            )
+            for row in user_rows
+        ] + [
+            Merge(
+                update(currency_stats)
+                .where(currency_stats.c.user_id == row["user_id"], currency_stats.c.currency == row["currency"])
+                .values({column: currency_stats.c[column] + row[column] for column in totals}),
+                insert(currency_stats).values(row),
+            )
+            for row in currency_rows
+        ]
+
+    user_stmt = upsert(user_stats).values(user_rows)
+    excluded = user_stmt.excluded
+    user_stmt = user_stmt.on_conflict_do_update(
+        index_elements=[user_stats.c.user_id],
+        set_={
+            "conversion_count": user_stats.c.conversion_count + excluded.conversion_count,
+            "first_conversion_at": _earliest(user_stats.c.first_conversion_at, excluded.first_conversion_at),
+            "last_conversion_at": _latest(user_stats.c.last_conversion_at, excluded.last_conversion_at),
+        },
+    )
+
+    currency_stmt = upsert(currency_stats).values(currency_rows)
+    excluded = currency_stmt.excluded
+    currency_stmt = currency_stmt.on_conflict_do_update(
+        index_elements=[currency_stats.c.user_id, currency_stats.c.currency],
+        set_={column: currency_stats.c[column] + excluded[column] for column in totals},
+    )
+    return [user_stmt, currency_stmt]
+
+
+def execute_upserts(db: Session, statements: list):
+    for stmt in statements:
+        if not isinstance(stmt, Merge):
+            db.execute(stmt)
+            continue
+        if db.execute(stmt.update).rowcount:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(stmt.insert)
+        except IntegrityError:
+            # Строку между UPDATE и INSERT вставила параллельная транзакция
+            db.execute(stmt.update)
+
+
+async def execute_upserts_async(db: AsyncSession, statements: list):
+    for stmt in statements:
+        if not isinstance(stmt, Merge):
+            await db.execute(stmt)
+            continue
+        if (await db.execute(stmt.update)).rowcount:
+            continue
+        try:
+            async with db.begin_nested():
+                await db.execute(stmt.insert)
+        except IntegrityError:
+            await db.execute(stmt.update)
+
+
+def apply_conversions(db: Session, rows: List[dict]):
+    execute_upserts(db, stats_upserts(db.get_bind().dialect.name, rows))
+
+
+async def apply_conversions_async(db: AsyncSession, rows: List[dict]):
+    await execute_upserts_async(db, stats_upserts(db.bind.dialect.name, rows))
+
+
+async def get_user_stats(db: AsyncSession, user_id: int) -> schemas.UserStatsResponse:
+    user = await db.get(models.UserStats, user_id)
+    if user is None:
+        return schemas.UserStatsResponse()
+    currencies = (await db.scalars(
+        select(models.UserCurrencyStats)
+        .where(models.UserCurrencyStats.user_id == user_id)
+        .order_by(models.UserCurrencyStats.currency)
+    )).all()
+    return schemas.UserStatsResponse(
+        conversion_count=user.conversion_count,
+        first_conversion_at=user.first_conversion_at,
+        last_conversion_at=user.last_conversion_at,
+        currencies=[schemas.CurrencyStats.model_validate(currency) for currency in currencies],
+    )
+
+
+def rebuild(conn):
+    """Пересчитывает статистику целиком из истории в БД (без выгруженных в архив месяцев). Принимает Session или Connection."""
+    history = partitions.history_source(conn)
+    conn.execute(delete(models.UserCurrencyStats))
+    conn.execute(delete(models.UserStats))
+
+    conn.execute(insert(models.UserStats).from_select(
+        ["user_id", "conversion_count", "first_conversion_at", "last_conversion_at"],
+        select(history.user_id, func.count(), func.min(history.timestamp), func.max(history.timestamp))
+        .where(history.user_id.is_not(None))
+        .group_by(history.user_id),
+    ))
+
+    sides = union_all(
+        select(
+            history.user_id.label("user_id"),
+            history.from_currency.label("currency"),
+            literal(1).label("conversions_from"),
+            literal(0).label("conversions_to"),
+            history.amount.label("amount_from"),
+            literal(0.0).label("amount_to"),
+        ).where(history.user_id.is_not(None)),
+        select(
+            history.user_id,
+            history.to_currency,
+            literal(0),
+            literal(1),
+            literal(0.0),
+            history.converted_amount,
+        ).where(history.user_id.is_not(None)),
+    ).subquery()
+    conn.execute(insert(models.UserCurrencyStats).from_select(
+        ["user_id", "currency", "conversions_from", "conversions_to", "amount_from", "amount_to"],
+        select(
+            sides.c.user_id,
+            sides.c.currency,
+            func.sum(sides.c.conversions_from),
+            func.sum(sides.c.conversions_to),
+            func.sum(sides.c.amount_from),
+            func.sum(sides.c.amount_to),
+        ).group_by(sides.c.user_id, sides.c.currency),
+    ))
+    return conn.execute(select(func.count()).select_from(models.UserStats)).scalar()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пересчёт статистики пользователей по истории конвертаций")
+    parser.parse_args(argv)
+
+    from app.database import Base, engine
+    from app.migrations import run_migrations
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    with engine.begin() as conn:
+        users = rebuild(conn)
+    print(f"✅ Статистика пересчитана: {users} пользователей")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Задержка конкурентных запросов: синхронная Session против AsyncSession.
+
+Оба маршрута — ``async def`` и читают последние 100 конвертаций пользователя,
+как /api/v1/conversions/history. Пока идёт нагрузка, параллельно опрашивается
+пустой маршрут /ping: его задержка показывает, насколько блокируется event loop.
+При concurrency больше размера пула синхронного движка (5 + 10) вариант /sync
+упирается в ожидание соединения прямо в event loop и висит до pool_timeout.
+
+    python -m benchmarks.async_db --requests 200 --concurrency 10 --rows 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def seed(rows):
+    from sqlalchemy import insert
+    from app.database import Base, SessionLocal, engine
+    from app import models
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = models.User(username="bench", hashed_password="-")
+        db.add(user)
+        db.commit()
+        start = datetime(2024, 1, 1)
+        db.execute(insert(models.ConversionHistory), [
+            {
+                "user_id": user.id,
+                "amount": 100.0,
+                "from_currency": "USD",
+                "to_currency": "EUR",
+                "converted_amount": 92.0,
+                "rate_used": 0.92,
+                "timestamp": start + timedelta(seconds=i),
+            }
+            for i in range(rows)
+        ])
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def build_app(user_id):
+    from fastapi import Depends, FastAPI
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import Session
+    from app import crud, crud_async
+    from app.database import get_async_db, get_db
+
+    bench_app = FastAPI()
+
+    @bench_app.get("/sync")
+    async def sync_history(db: Session = Depends(get_db)):
+        return len(crud.get_user_conversions(db, user_id))
+
+    @bench_app.get("/async")
+    async def async_history(db: AsyncSession = Depends(get_async_db)):
+        return len(await crud_async.get_user_conversions(db, user_id))
+
+    @bench_app.get("/ping")
+    async def ping():
+        return "pong"
+
+    return bench_app
+
+
+async def drive(bench_app, path, requests, concurrency):
+    import httpx
+    from app.database import async_engine
+
+    transport = httpx.ASGITransport(app=bench_app)
+    latencies = []
+    ping_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        async def pinger():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/ping")
+                ping_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.005)
+
+        ping_task = asyncio.create_task(pinger())
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await ping_task
+
+    await async_engine.dispose()
+
+    return {
+        "route": path,
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency": summarize(latencies),
+        "ping_latency": summarize(ping_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench-async-db-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/bench.db"
+    user_id = seed(args.rows)
+    bench_app = build_app(user_id)
+
+    results = {
+        "rows": args.rows,
+        "before_sync_session": asyncio.run(drive(bench_app, "/sync", args.requests, args.concurrency)),
+        "after_async_session": asyncio.run(drive(bench_app, "/async", args.requests, args.concurrency)),
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
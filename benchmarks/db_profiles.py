@@ -0,0 +1,143 @@
+"""Чтение под конкурентной записью: профили движка БД basic и sqlite (WAL).
+
+Писатели в отдельных потоках пачками вставляют строки в conversion_history и
+держат транзакцию открытой --write-hold мс, как это делает /api/v1/convert
+вместе с обновлением статистики. Читатели параллельно выбирают активные курсы
+тем же запросом, что и /api/v1/rates при промахе кэша. В режиме rollback journal
+коммит писателя требует эксклюзивной блокировки и читатели ждут его; в WAL
+читатели работают со своим снимком и не ждут писателей. Каждый читатель и
+писатель — отдельный процесс, так что задержки не смешиваются с GIL.
+
+    python -m benchmarks.db_profiles --seconds 5 --readers 2 --writers 1
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.async_db import summarize
+
+CURRENCIES = ("EUR", "GBP", "JPY", "RUB", "CHF", "CNY")
+
+
+def _worker(role, index, url, profile, args, deadline):
+    """Один читатель или писатель в своём процессе со своим движком, чтобы GIL не смешивался с блокировками SQLite."""
+    from sqlalchemy import insert, select
+    from sqlalchemy.exc import OperationalError
+    from app import models
+    from app.database import make_engine
+
+    engine = make_engine(url, profile)
+    latencies, errors = [], 0
+    rates_query = select(models.CurrencyRate).where(models.CurrencyRate.is_active == True)
+    rows = [
+        {
+            "user_id": None,
+            "amount": 100.0,
+            "from_currency": "USD",
+            "to_currency": CURRENCIES[(index + i) % len(CURRENCIES)],
+            "converted_amount": 92.0,
+            "rate_used": 0.92,
+            "timestamp": datetime.now(),
+        }
+        for i in range(args.batch)
+    ]
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            if role == "read":
+                with engine.connect() as conn:
+                    conn.execute(rates_query).all()
+            else:
+                with engine.begin() as conn:
+                    conn.execute(insert(models.ConversionHistory), rows)
+                    time.sleep(args.write_hold / 1000)
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    engine.dispose()
+    return role, latencies, errors
+
+
+def run_profile(profile, args, tmpdir):
+    from concurrent.futures import ProcessPoolExecutor
+    from sqlalchemy import insert
+    from app import models
+    from app.database import Base, make_engine, pool_stats
+
+    url = f"sqlite:///{tmpdir}/{profile}.db"
+    engine = make_engine(url, profile)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.CurrencyRate), [
+            {"base_currency": "USD", "target_currency": target, "rate": 1.0 + i, "is_active": True}
+            for i, target in enumerate(CURRENCIES)
+        ])
+
+    roles = [("read", i) for i in range(args.readers)] + [("write", i) for i in range(args.writers)]
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    with ProcessPoolExecutor(max_workers=len(roles)) as executor:
+        # Небольшой запас, чтобы все процессы успели стартовать до начала замера
+        deadline = time.time() + 1 + args.seconds
+        futures = [executor.submit(_worker, role, index, url, profile, args, deadline) for role, index in roles]
+        for future in futures:
+            role, values, failed = future.result()
+            latencies[role].extend(values)
+            errors[role] += failed
+
+    with engine.connect() as conn:
+        journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+    pool = pool_stats(engine)
+    engine.dispose()
+    return {
+        "journal_mode": journal_mode,
+        "reads": {**summarize(latencies["read"]), "errors": errors["read"],
+                  "stalled": sum(1 for value in latencies["read"] if value * 1000 >= args.stall_ms),
+                  "per_sec": round(len(latencies["read"]) / args.seconds, 1)},
+        "writes": {**summarize(latencies["write"]), "errors": errors["write"],
+                   "per_sec": round(len(latencies["write"]) / args.seconds, 1)},
+        "pool": pool,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--writers", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=50, help="строк в одной транзакции записи")
+    parser.add_argument("--write-hold", type=float, default=5.0,
+                        help="сколько мс писатель держит транзакцию после вставки")
+    parser.add_argument("--stall-ms", type=float, default=25.0,
+                        help="чтение дольше этого порога считается застрявшим за писателем")
+    parser.add_argument("--profiles", default="basic,sqlite")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench-db-profiles-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/app.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+
+    result = {
+        "meta": {
+            "seconds": args.seconds,
+            "readers": args.readers,
+            "writers": args.writers,
+            "batch": args.batch,
+            "write_hold_ms": args.write_hold,
+            "stall_ms": args.stall_ms,
+        },
+        "profiles": {},
+    }
+    for profile in args.profiles.split(","):
+        print(f"⏳ Профиль {profile}...", file=sys.stderr)
+        result["profiles"][profile] = run_profile(profile.strip(), args, tmpdir)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
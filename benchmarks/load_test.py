@@ -0,0 +1,225 @@
+"""Нагрузочный тест всего приложения: пропускная способность и p50/p95/p99 по маршрутам.
+
+Поднимает app.main (вместе с lifespan) на временной SQLite-базе и гоняет через
+httpx.ASGITransport смесь запросов: логин, конвертация, история и список курсов.
+Каждый воркер выбирает операции по весам из --mix генератором с фиксированным
+--seed, поэтому прогоны на разных коммитах можно сравнивать между собой.
+Результат — JSON в stdout или в файл из --output.
+
+    python -m benchmarks.load_test --requests 2000 --concurrency 20 \\
+        --mix login=1,convert=10,history=5,rates=5 --output run.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.async_db import summarize
+
+DEFAULT_MIX = "login=1,convert=10,history=5,rates=5"
+PASSWORD = "bench-password"
+CURRENCIES = ("EUR", "GBP", "JPY", "RUB", "CHF", "CNY")
+
+ROUTES = {
+    "login": "POST /api/v1/auth/login",
+    "convert": "POST /api/v1/convert",
+    "history": "GET /api/v1/conversions/history",
+    "rates": "GET /api/v1/rates",
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"неизвестная операция: {name}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("нужна хотя бы одна операция с ненулевым весом")
+    return mix
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed(users, history_rows):
+    from sqlalchemy import insert
+    from app import auth, crud, models, schemas
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for target, rate in zip(CURRENCIES, (0.92, 0.79, 148.0, 90.0, 0.88, 7.2)):
+            crud.create_currency_rate(db, schemas.CurrencyRateCreate(base_currency="USD", target_currency=target, rate=rate))
+
+        hashed_password = auth.get_password_hash(PASSWORD)
+        user_ids = []
+        for i in range(users):
+            user = models.User(username=f"bench{i}", hashed_password=hashed_password)
+            db.add(user)
+            db.flush()
+            user_ids.append(user.id)
+        db.commit()
+
+        start = datetime(2024, 1, 1)
+        db.execute(insert(models.ConversionHistory), [
+            {
+                "user_id": user_ids[i % users],
+                "amount": 100.0,
+                "from_currency": "USD",
+                "to_currency": CURRENCIES[i % len(CURRENCIES)],
+                "converted_amount": 92.0,
+                "rate_used": 0.92,
+                "timestamp": start + timedelta(seconds=i),
+            }
+            for i in range(history_rows)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+async def run_load(args):
+    import httpx
+    from app.main import app
+
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def login(username):
+                return await client.post("/api/v1/auth/login", data={"username": username, "password": PASSWORD})
+
+            async def worker(index, count):
+                rng = random.Random(args.seed + index)
+                username = f"bench{index % args.users}"
+                response = await login(username)
+                response.raise_for_status()
+                headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+                for _ in range(count):
+                    name = rng.choices(names, weights)[0]
+                    started = time.perf_counter()
+                    if name == "login":
+                        response = await login(username)
+                    elif name == "convert":
+                        from_currency, to_currency = rng.sample(("USD",) + CURRENCIES, 2)
+                        response = await client.post("/api/v1/convert", headers=headers, json={
+                            "amount": round(rng.uniform(1, 1000), 2),
+                            "from_currency": from_currency,
+                            "to_currency": to_currency,
+                        })
+                    elif name == "history":
+                        response = await client.get("/api/v1/conversions/history", headers=headers, params={"limit": 50})
+                    else:
+                        response = await client.get("/api/v1/rates")
+                    latencies[name].append(time.perf_counter() - started)
+                    if response.status_code >= 400:
+                        errors[name] += 1
+
+            per_worker = [args.requests // args.concurrency] * args.concurrency
+            for i in range(args.requests % args.concurrency):
+                per_worker[i] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(i, count) for i, count in enumerate(per_worker)))
+            elapsed = time.perf_counter() - started
+
+    routes = {}
+    for name in names:
+        routes[ROUTES[name]] = {
+            **summarize(latencies[name]),
+            "errors": errors[name],
+            "requests_per_sec": round(len(latencies[name]) / elapsed, 1),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "total": {
+            "requests": total,
+            "errors": sum(errors.values()),
+            "seconds": round(elapsed, 3),
+            "requests_per_sec": round(total / elapsed, 1),
+            **{key: value for key, value in summarize([v for values in latencies.values() for v in values]).items()
+               if key != "count"},
+        },
+        "routes": routes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"веса операций, по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history-rows", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bcrypt-rounds", type=int, default=None,
+                        help="стоимость bcrypt для тестовых пользователей (по умолчанию из настроек)")
+    parser.add_argument("--output", help="куда записать JSON вместо stdout")
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте app.*, поэтому окружение задаётся до него
+    tmpdir = tempfile.mkdtemp(prefix="bench-load-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/bench.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    # Иначе каждый прогон оставлял бы свой сегмент курсов в /dev/shm
+    os.environ["SHARED_RATES_PATH"] = os.path.join(tmpdir, "rates.bin")
+    if args.bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    # Схему готовим заранее, чтобы засеять данные до lifespan; вывод миграций не должен попасть в JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        from app.startup import prepare_database
+        prepare_database()
+        seed(args.users, args.history_rows)
+
+    result = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "users": args.users,
+            "history_rows": args.history_rows,
+            "seed": args.seed,
+            "bcrypt_rounds": int(os.environ.get("BCRYPT_ROUNDS", "12")),
+            "history_write_behind": os.environ.get("HISTORY_WRITE_BEHIND", "false"),
+        },
+    }
+    with contextlib.redirect_stdout(sys.stderr):
+        result.update(asyncio.run(run_load(args)))
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"✅ Результаты записаны в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Запросов в секунду для GET /api/v1/rates с разными вариантами cookie-middleware.
+
+Варианты: без middleware, прежний @app.middleware("http") (BaseHTTPMiddleware)
+и CookieTokenMiddleware на чистом ASGI. Маршрут повторяет get_currency_rates_api
+и читает курсы из временной SQLite-базы.
+
+    python -m benchmarks.middleware --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+
+def legacy_check_token_middleware(app):
+    from fastapi import Request
+
+    @app.middleware("http")
+    async def check_token_middleware(request: Request, call_next):
+        if request.url.path.startswith("/static") or request.url.path in ["/", "/login", "/register", "/docs", "/redoc", "/openapi.json", "/favicon.ico"]:
+            return await call_next(request)
+
+        if request.url.path.startswith("/api/"):
+            return await call_next(request)
+
+        auth_header = request.cookies.get("access_token")
+        if auth_header and auth_header.startswith("Bearer "):
+            token = auth_header[7:]
+            request.scope['headers'].append((b'authorization', f'Bearer {token}'.encode()))
+
+        return await call_next(request)
+
+
+def build_app(variant):
+    from typing import List
+    from fastapi import Depends, FastAPI
+    from sqlalchemy.orm import Session
+    from app import crud, schemas
+    from app.database import get_db
+    from app.middleware import CookieTokenMiddleware
+
+    bench_app = FastAPI()
+
+    @bench_app.get("/api/v1/rates", response_model=List[schemas.CurrencyRateResponse])
+    def get_currency_rates_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+        return crud.get_currency_rates(db, skip=skip, limit=limit)
+
+    if variant == "base_http_middleware":
+        legacy_check_token_middleware(bench_app)
+    elif variant == "asgi_middleware":
+        bench_app.add_middleware(CookieTokenMiddleware)
+    return bench_app
+
+
+def seed():
+    from app import crud, schemas
+    from app.database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        for target, rate in (("EUR", 0.92), ("RUB", 90.0), ("GBP", 0.79), ("JPY", 148.0)):
+            crud.create_currency_rate(db, schemas.CurrencyRateCreate(base_currency="USD", target_currency=target, rate=rate))
+    finally:
+        db.close()
+
+
+async def drive(bench_app, requests, concurrency):
+    import httpx
+
+    transport = httpx.ASGITransport(app=bench_app)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get("/api/v1/rates", cookies={"access_token": "Bearer x"})
+                response.raise_for_status()
+
+        await one()
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench-middleware-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/bench.db"
+    seed()
+
+    results = {}
+    for variant in ("no_middleware", "base_http_middleware", "asgi_middleware"):
+        elapsed = asyncio.run(drive(build_app(variant), args.requests, args.concurrency))
+        results[variant] = {
+            "requests": args.requests,
+            "seconds": round(elapsed, 3),
+            "requests_per_sec": round(args.requests / elapsed, 1),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
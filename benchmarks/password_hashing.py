@@ -0,0 +1,48 @@
+"""Пропускная способность входа (bcrypt verify) на одно ядро при разной стоимости.
+
+Для каждого значения BCRYPT_ROUNDS хешируется пароль, затем в течение
+--seconds секунд в одном потоке выполняется verify — как при входе в систему.
+Результат — логинов в секунду на ядро и ожидаемое число на все ядра хоста.
+
+    python -m benchmarks.password_hashing --costs 10 11 12 13 --seconds 3
+"""
+import argparse
+import json
+import os
+import time
+
+from passlib.context import CryptContext
+
+
+def measure(rounds, seconds):
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    hashed = context.hash("benchmark-password")
+    verifications = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        context.verify("benchmark-password", hashed)
+        verifications += 1
+    elapsed = time.perf_counter() - started
+    per_core = verifications / elapsed
+    cores = os.cpu_count() or 1
+    return {
+        "rounds": rounds,
+        "verifications": verifications,
+        "ms_per_login": round(elapsed / verifications * 1000, 2),
+        "logins_per_sec_per_core": round(per_core, 2),
+        "logins_per_sec_all_cores": round(per_core * cores, 2),
+        "cores": cores,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--costs", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    print(json.dumps([measure(rounds, args.seconds) for rounds in args.costs], indent=2))
+
+
+if __name__ == "__main__":
+    main()
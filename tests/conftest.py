@@ -0,0 +1,12 @@
+"""Все файлы тестов (БД, журнал, архивы, общая память) — во временном каталоге, а не в рабочем."""
+import os
+import tempfile
+
+_tmpdir = tempfile.mkdtemp(prefix="test-currency-converter-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/app.db")
+os.environ.setdefault("SHARED_RATES_PATH", os.path.join(_tmpdir, "rates.bin"))
+os.environ.setdefault("PRINCIPAL_CACHE_SHARED_PATH", os.path.join(_tmpdir, "principals.bin"))
+os.environ.setdefault("HISTORY_JOURNAL_DIR", os.path.join(_tmpdir, "history_journal"))
+os.environ.setdefault("HISTORY_ARCHIVE_DIR", os.path.join(_tmpdir, "archive"))
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.pop("ASYNC_DATABASE_URL", None)
@@ -0,0 +1,41 @@
+"""API входа и регистрации хеширует пароли в ограниченном пуле и при перегрузке отвечает 503."""
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def test_register_and_login(client):
+    response = client.post("/api/v1/auth/register", json={"username": "api-user", "password": "secret1"})
+    assert response.status_code == 200, response.text
+    assert response.json()["username"] == "api-user"
+    assert client.post("/api/v1/auth/register",
+                       json={"username": "api-user", "password": "secret2"}).status_code == 400
+
+    response = client.post("/api/v1/auth/login", data={"username": "api-user", "password": "secret1"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    assert client.get("/api/v1/users/me", headers={"Authorization": f"Bearer {token}"}).json()["username"] == "api-user"
+    assert client.post("/api/v1/auth/login", data={"username": "api-user", "password": "wrong"}).status_code == 401
+
+
+def test_busy_hash_pool_returns_503(client, monkeypatch):
+    # Все места в пуле хеширования заняты
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(main.auth, "_hash_slots", slots)
+
+    response = client.post("/api/v1/auth/login", data={"username": "admin", "password": "admin123"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert client.post("/api/v1/auth/register",
+                       json={"username": "busy-user", "password": "secret1"}).status_code == 503
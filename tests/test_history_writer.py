@@ -0,0 +1,124 @@
+"""Отложенная запись истории: журнал переживает падение, повтор не дублирует строки, плохая строка откладывается."""
+import asyncio
+import glob
+import json
+import os
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app import crud, crud_async, models, partitions, schemas
+from app.database import AsyncSessionLocal, SessionLocal, async_engine
+from app.history_writer import HistoryJournal, HistoryWriter
+from app.startup import prepare_database
+
+
+@pytest.fixture(scope="module")
+def user_id():
+    prepare_database()
+    with SessionLocal() as db:
+        return crud.create_user(db, schemas.UserCreate(username="journal-user", password="secret1")).id
+
+
+def _run(coroutine):
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            # Соединения aiosqlite привязаны к циклу событий этого теста
+            await async_engine.dispose()
+
+    return asyncio.run(run())
+
+
+def _writer(directory) -> HistoryWriter:
+    return HistoryWriter(max_queue_size=100, batch_size=10, flush_interval=0.01, id_block_size=10,
+                         journal_dir=str(directory), retry_max_seconds=0.05)
+
+
+async def _rows(user_id, count, **overrides):
+    async with AsyncSessionLocal() as db:
+        ids = await crud_async.reserve_conversion_ids(db, count)
+    return [
+        {"id": conversion_id, "user_id": user_id, "amount": 1.0, "from_currency": "USD", "to_currency": "EUR",
+         "converted_amount": 0.9, "rate_used": 0.9, "timestamp": partitions.utc_now(), **overrides}
+        for conversion_id in ids
+    ]
+
+
+async def _insert(rows):
+    async with AsyncSessionLocal() as db:
+        await crud_async.insert_conversion_rows(db, rows)
+
+
+async def _start_and_stop(writer: HistoryWriter):
+    await writer.start()
+    await writer.stop()
+
+
+def _stored(ids):
+    with SessionLocal() as db:
+        return db.scalars(select(models.ConversionHistory.id).where(models.ConversionHistory.id.in_(ids))).all()
+
+
+def test_recover_replays_journal_of_dead_writer_once(user_id, tmp_path):
+    rows = _run(_rows(user_id, 3))
+    ids = [row["id"] for row in rows]
+    # Процесс успел записать первую строку, но не удалить сегмент, и упал
+    _run(_insert(rows[:1]))
+    journal = HistoryJournal(str(tmp_path), rotate_rows=100)
+    journal.append(rows)
+    journal._segment.file.close()
+
+    writer = _writer(tmp_path)
+    _run(_start_and_stop(writer))
+
+    assert sorted(_stored(ids)) == ids
+    assert writer.recovered_rows == 3
+    assert glob.glob(os.path.join(tmp_path, "history-*.ndjson")) == []
+
+    again = _writer(tmp_path)
+    _run(_start_and_stop(again))
+    assert again.recovered_rows == 0
+    assert sorted(_stored(ids)) == ids
+
+
+def test_retry_after_ambiguous_commit_does_not_duplicate(user_id, tmp_path, monkeypatch):
+    rows = _run(_rows(user_id, 5))
+    ids = [row["id"] for row in rows]
+    insert_conversion_rows = crud_async.insert_conversion_rows
+    calls = []
+
+    async def commit_then_fail(db, batch):
+        calls.append(len(batch))
+        await insert_conversion_rows(db, batch)
+        if len(calls) == 1:
+            # Коммит прошёл, но ответ БД потерялся
+            raise OperationalError("COMMIT", {}, Exception("connection lost"))
+
+    monkeypatch.setattr(crud_async, "insert_conversion_rows", commit_then_fail)
+    writer = _writer(tmp_path)
+
+    assert _run(writer._write(rows)) is True
+
+    assert sorted(_stored(ids)) == ids
+    assert writer.flush_errors == 1
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count()).select_from(models.ConversionHistory)
+                         .where(models.ConversionHistory.id.in_(ids))) == 5
+
+
+def test_rejected_row_goes_to_rejected_file(user_id, tmp_path):
+    good = _run(_rows(user_id, 2))
+    bad = _run(_rows(user_id, 1, from_currency=None))
+    writer = _writer(tmp_path)
+
+    assert _run(writer._write([good[0], bad[0], good[1]])) is True
+
+    assert sorted(_stored([row["id"] for row in good + bad])) == [row["id"] for row in good]
+    assert writer.rejected_rows == 1
+    [path] = glob.glob(os.path.join(tmp_path, "rejected-*.ndjson"))
+    with open(path, encoding="utf-8") as file:
+        assert [json.loads(line)["id"] for line in file] == [bad[0]["id"]]
+
@@ -0,0 +1,161 @@
+"""POST /api/v1/convert с Idempotency-Key: повтор, конфликт, параллельные дубли, брошенный и упавший захват."""
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, insert, select
+
+from app import crud, idempotency, main, models, schemas
+from app.database import SessionLocal
+from app.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, idempotency_store
+from app.main import app
+
+BODY = {"amount": 100, "from_currency": "DKK", "to_currency": "PLN"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def admin_headers(client):
+    response = client.post("/api/v1/auth/login", data={"username": "admin", "password": "admin123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.post("/api/v1/admin/rates", headers=headers,
+                           json={"base_currency": "DKK", "target_currency": "PLN", "rate": 0.58})
+    assert response.status_code == 200
+    return headers
+
+
+@pytest.fixture(scope="module")
+def user(client, admin_headers):
+    with SessionLocal() as db:
+        user = crud.create_user(db, schemas.UserCreate(username="idempotent-user", password="secret1"))
+    response = client.post("/api/v1/auth/login", data={"username": "idempotent-user", "password": "secret1"})
+    return user.id, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _convert(client, headers, key, body=BODY):
+    return client.post("/api/v1/convert", headers={**headers, IDEMPOTENCY_HEADER: key}, json=body)
+
+
+def _history_count(user_id):
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(models.ConversionHistory)
+                         .where(models.ConversionHistory.user_id == user_id))
+
+
+def _key_row(user_id, key):
+    with SessionLocal() as db:
+        return db.execute(select(models.IdempotencyKey.status_code, models.IdempotencyKey.owner).where(
+            models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.key == key
+        )).first()
+
+
+def test_replay_returns_stored_response(client, user):
+    user_id, headers = user
+    before = _history_count(user_id)
+
+    first = _convert(client, headers, "replay")
+    second = _convert(client, headers, "replay")
+    # Из таблицы, а не из LRU воркера
+    idempotency_store.clear()
+    third = _convert(client, headers, "replay")
+
+    assert first.status_code == second.status_code == third.status_code == 200
+    assert REPLAYED_HEADER not in first.headers
+    assert second.headers[REPLAYED_HEADER] == "true"
+    assert third.headers[REPLAYED_HEADER] == "true"
+    assert first.json() == second.json() == third.json()
+    assert _history_count(user_id) == before + 1
+
+
+def test_different_body_with_same_key_is_rejected(client, user):
+    _, headers = user
+    assert _convert(client, headers, "reused").status_code == 200
+
+    response = _convert(client, headers, "reused", {**BODY, "amount": 5})
+
+    assert response.status_code == 422
+
+
+def test_concurrent_duplicate_waits_for_first_request(client, user, monkeypatch):
+    user_id, headers = user
+    convert_currency = main.convert_currency
+
+    async def slow_convert(*args, **kwargs):
+        # Держим первый запрос, пока остальные не встанут в ожидание
+        await asyncio.sleep(0.3)
+        return await convert_currency(*args, **kwargs)
+
+    monkeypatch.setattr(main, "convert_currency", slow_convert)
+    before, waits = _history_count(user_id), idempotency_store.waits
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(_convert(client, headers, "concurrent")))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [response.status_code for response in responses] == [200] * 5
+    assert len({response.json()["id"] for response in responses}) == 1
+    assert idempotency_store.waits > waits
+    assert _history_count(user_id) == before + 1
+
+
+def _abandoned_claim(user_id, key, last_seen):
+    request_hash = idempotency.request_fingerprint(schemas.ConversionRequest(**BODY).model_dump_json())
+    with SessionLocal() as db:
+        db.execute(insert(models.IdempotencyKey).values(
+            user_id=user_id, key=key, request_hash=request_hash, created_at=last_seen,
+            expires_at=datetime.now(timezone.utc) + timedelta(hours=1), owner="dead" * 8, heartbeat_at=last_seen,
+        ))
+        db.commit()
+
+
+def test_expired_lease_is_taken_over(client, user):
+    user_id, headers = user
+    last_seen = datetime.now(timezone.utc) - timedelta(seconds=idempotency_store.lock_timeout_seconds + 5)
+    _abandoned_claim(user_id, "abandoned", last_seen)
+    takeovers = idempotency_store.takeovers
+
+    response = _convert(client, headers, "abandoned")
+
+    assert response.status_code == 200
+    assert REPLAYED_HEADER not in response.headers
+    assert idempotency_store.takeovers == takeovers + 1
+    status_code, owner = _key_row(user_id, "abandoned")
+    assert status_code == 200 and owner != "dead" * 8
+
+
+def test_live_lease_is_not_taken_over(client, user, monkeypatch):
+    user_id, headers = user
+    monkeypatch.setattr(idempotency_store, "wait_seconds", 0.2)
+    _abandoned_claim(user_id, "live", datetime.now(timezone.utc))
+
+    response = _convert(client, headers, "live")
+
+    assert response.status_code == 409
+    assert _key_row(user_id, "live") == (None, "dead" * 8)
+
+
+def test_failed_request_releases_its_claim(client, user, admin_headers):
+    user_id, headers = user
+    body = {**BODY, "to_currency": "HUF"}
+    before = _history_count(user_id)
+
+    assert _convert(client, headers, "failed", body).status_code == 400
+    assert _key_row(user_id, "failed") is None
+
+    response = client.post("/api/v1/admin/rates", headers=admin_headers,
+                           json={"base_currency": "DKK", "target_currency": "HUF", "rate": 52.0})
+    assert response.status_code == 200
+    retried = _convert(client, headers, "failed", body)
+    assert retried.status_code == 200
+    assert REPLAYED_HEADER not in retried.headers
+    assert _history_count(user_id) == before + 1
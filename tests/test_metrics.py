@@ -0,0 +1,36 @@
+"""/metrics не отдаётся анонимно: нужен METRICS_TOKEN сборщика или токен администратора."""
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, schemas
+from app.config import settings
+from app.database import SessionLocal
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def _bearer(client, username, password):
+    response = client.post("/api/v1/auth/login", data={"username": username, "password": password})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_metrics_require_admin(client):
+    with SessionLocal() as db:
+        crud.create_user(db, schemas.UserCreate(username="metrics-user", password="secret1"))
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=_bearer(client, "metrics-user", "secret1")).status_code == 403
+    response = client.get("/metrics", headers=_bearer(client, "admin", "admin123"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+
+def test_metrics_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong-secret"}).status_code == 401
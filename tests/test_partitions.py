@@ -0,0 +1,68 @@
+"""Закрытые месяцы уходят в партиции и архив, но остаются видны в истории и экспорте."""
+import json
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+
+from app import crud, models, partitions, schemas
+from app.database import SessionLocal, engine
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def user(client):
+    with SessionLocal() as db:
+        user = crud.create_user(db, schemas.UserCreate(username="partition-user", password="secret1"))
+    response = client.post("/api/v1/auth/login", data={"username": "partition-user", "password": "secret1"})
+    return user.id, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _history_row(user_id, timestamp, amount):
+    return {"user_id": user_id, "amount": amount, "from_currency": "USD", "to_currency": "EUR",
+            "converted_amount": amount * 0.9, "rate_used": 0.9, "timestamp": timestamp}
+
+
+def test_closed_months_are_detached_and_archived(client, user, tmp_path):
+    user_id, headers = user
+    current = partitions.month_start(partitions.utc_now())
+    previous = partitions.add_months(current, -1)
+    archived = partitions.add_months(current, -3)
+    rows = [
+        _history_row(user_id, archived + timedelta(days=5), 1.0),
+        _history_row(user_id, current - timedelta(seconds=1), 2.0),
+        # Ровно начало месяца по UTC — строка остаётся в горячей таблице
+        _history_row(user_id, current, 3.0),
+        _history_row(user_id, partitions.utc_now(), 4.0),
+    ]
+    with SessionLocal() as db:
+        db.execute(insert(models.ConversionHistory), rows)
+        db.commit()
+
+    summary = partitions.run(engine, hot_months=1, retention_months=2, archive_dir=str(tmp_path))
+
+    assert partitions.month_key(previous) in [entry["month"] for entry in summary["detached"]]
+    assert partitions.month_key(archived) in [entry["month"] for entry in summary["archived"]]
+    history = partitions.history_view
+    hot = models.ConversionHistory.__table__
+    with engine.connect() as conn:
+        assert sorted(conn.scalars(select(history.c.amount).where(history.c.user_id == user_id))) == [2.0, 3.0, 4.0]
+        assert sorted(conn.scalars(select(hot.c.amount).where(hot.c.user_id == user_id))) == [3.0, 4.0]
+        assert [month for month, _ in partitions.list_partitions(conn)] == [previous]
+
+    response = client.get("/api/v1/conversions/export", params={"format": "ndjson"}, headers=headers)
+    assert response.status_code == 200
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["amount"] for row in exported] == [1.0, 2.0, 3.0, 4.0]
+
+    date_from = (previous + timedelta(days=1)).isoformat()
+    response = client.get("/api/v1/conversions/export", params={"format": "ndjson", "date_from": date_from},
+                          headers=headers)
+    assert [json.loads(line)["amount"] for line in response.text.splitlines()] == [2.0, 3.0, 4.0]
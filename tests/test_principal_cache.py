@@ -0,0 +1,73 @@
+"""Инвалидация пользователя в одном воркере должна сразу действовать во всех."""
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+from app import schemas
+from app.principal_cache import PrincipalCache, SharedInvalidations
+
+
+def _principal(user_id: int, is_admin: bool = False) -> schemas.UserInDB:
+    return schemas.UserInDB(id=user_id, username=f"user{user_id}", is_active=True, is_admin=is_admin,
+                            created_at=datetime(2024, 1, 1))
+
+
+@pytest.fixture
+def workers():
+    path = os.path.join(tempfile.mkdtemp(prefix="test-principals-"), "principals.bin")
+    first, second = PrincipalCache(100, 60), PrincipalCache(100, 60)
+    # Отдельный mmap на каждый «воркер», как у разных процессов
+    first.attach_shared(SharedInvalidations(path))
+    second.attach_shared(SharedInvalidations(path))
+    yield first, second
+    first.detach_shared()
+    second.detach_shared()
+
+
+def test_invalidation_in_one_worker_evicts_entry_in_another(workers):
+    first, second = workers
+    second.put("admin-token", _principal(1, is_admin=True), generation=second.generation())
+    second.put("other-token", _principal(2), generation=second.generation())
+    assert second.get("admin-token") is not None
+
+    first.invalidate_user(1)
+
+    assert second.get("admin-token") is None
+    assert second.get("other-token") is not None
+    assert second.stats()["stale_hits"] == 1
+
+
+def test_read_started_before_remote_invalidation_is_not_cached(workers):
+    first, second = workers
+    generation = second.generation()
+    # Пока второй воркер читает пользователя из БД, первый его блокирует
+    first.invalidate_user(1)
+
+    second.put("token", _principal(1), generation=generation)
+
+    assert second.get("token") is None
+    assert second.stats()["stale_puts"] == 1
+
+
+def test_clear_invalidates_all_workers(workers):
+    first, second = workers
+    second.put("token", _principal(7), generation=second.generation())
+
+    first.clear()
+
+    assert second.get("token") is None
+
+
+def test_local_cache_without_shared_segment():
+    cache = PrincipalCache(100, 60)
+    generation = cache.generation()
+    cache.invalidate_user(1)
+    cache.put("stale", _principal(1), generation=generation)
+    assert cache.get("stale") is None
+
+    cache.put("token", _principal(1), generation=cache.generation())
+    assert cache.get("token") is not None
+    cache.invalidate_user(1)
+    assert cache.get("token") is None
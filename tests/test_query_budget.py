@@ -0,0 +1,65 @@
+"""Горячие маршруты держат число SQL-запросов: кеши курсов и пользователей, пакетная вставка истории."""
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, schemas, sql_stats
+from app.database import SessionLocal
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def headers(client):
+    with SessionLocal() as db:
+        crud.create_user(db, schemas.UserCreate(username="budget-user", password="secret1"))
+    response = client.post("/api/v1/auth/login", data={"username": "budget-user", "password": "secret1"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    admin = client.post("/api/v1/auth/login", data={"username": "admin", "password": "admin123"})
+    admin_headers = {"Authorization": f"Bearer {admin.json()['access_token']}"}
+    for base, target, rate in (("AUD", "CAD", 0.9), ("CAD", "MXN", 13.0)):
+        response = client.post("/api/v1/admin/rates", headers=admin_headers,
+                               json={"base_currency": base, "target_currency": target, "rate": rate})
+        assert response.status_code == 200
+    return headers
+
+
+def _within_budget(limit, call, status_code=200):
+    # Первый вызов прогревает кеши; бюджет — для установившегося режима
+    call()
+    with sql_stats.assert_max_queries(limit) as captured:
+        response = call()
+    assert response.status_code == status_code, response.text
+    # Иначе запрос прошёл мимо QueryStatsMiddleware и бюджет ничего не проверил
+    assert len(captured) == 1
+
+
+def test_convert(client, headers):
+    # История, статистика пользователя, его валют и сводки; курс и пользователь — из кеша
+    _within_budget(4, lambda: client.post("/api/v1/convert", headers=headers,
+                                          json={"amount": 10, "from_currency": "AUD", "to_currency": "MXN"}))
+
+
+def test_convert_batch_does_not_grow_with_size(client, headers):
+    batch = [{"amount": amount, "from_currency": "AUD", "to_currency": "CAD"} for amount in range(1, 51)]
+    batch += [{"amount": 1, "from_currency": "CAD", "to_currency": "AUD"}] * 20
+    _within_budget(4, lambda: client.post("/api/v1/convert/batch", headers=headers, json=batch))
+
+
+def test_history_page(client, headers):
+    _within_budget(1, lambda: client.get("/history", headers=headers))
+
+
+def test_rates_list(client, headers):
+    _within_budget(1, lambda: client.get("/api/v1/rates", headers=headers))
+    _within_budget(1, lambda: client.get("/api/v1/rates"))
+
+
+def test_rates_not_modified_skips_the_database(client, headers):
+    etag = client.get("/api/v1/rates").headers["ETag"]
+    _within_budget(0, lambda: client.get("/api/v1/rates", headers={"If-None-Match": etag}), status_code=304)
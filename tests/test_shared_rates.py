@@ -0,0 +1,95 @@
+"""Общая таблица курсов не должна держать удалённый курс и данные до отката БД."""
+import os
+import tempfile
+import time
+
+_tmpdir = tempfile.mkdtemp(prefix="test-shared-rates-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmpdir}/app.db"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["SHARED_RATES_ENABLED"] = "true"
+os.environ["SHARED_RATES_PATH"] = os.path.join(_tmpdir, "rates.bin")
+os.environ["HISTORY_WRITE_BEHIND"] = "false"
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.database import SessionLocal
+from app.main import app
+from app.rate_cache import RateCache, rate_cache
+from app.rate_versions import RateTableVersion
+from app.shared_rates import SharedRates
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def admin_headers(client):
+    response = client.post("/api/v1/auth/login", data={"username": "admin", "password": "admin123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _create_rate(client, headers, base, target, rate):
+    response = client.post("/api/v1/admin/rates", headers=headers,
+                           json={"base_currency": base, "target_currency": target, "rate": rate})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def _convert(client, headers, base, target):
+    return client.post("/api/v1/convert", headers=headers,
+                       json={"amount": 1, "from_currency": base, "to_currency": target})
+
+
+def test_deleting_newest_rate_removes_it_from_shared_rates(client, admin_headers):
+    _create_rate(client, admin_headers, "USD", "CHF", 0.8)
+    # max(last_updated) с точностью до секунды: после удаления SEK он уходит назад
+    time.sleep(1.1)
+    sek_id = _create_rate(client, admin_headers, "USD", "SEK", 10.5)
+    assert _convert(client, admin_headers, "USD", "SEK").json()["rate_used"] == 10.5
+
+    assert client.delete(f"/api/v1/admin/rates/{sek_id}", headers=admin_headers).status_code == 200
+
+    assert _convert(client, admin_headers, "USD", "SEK").status_code == 400
+    assert _convert(client, admin_headers, "USD", "CHF").json()["rate_used"] == 0.8
+    assert rate_cache.stats()["shared"] is not None
+
+
+def test_restored_database_wins_over_newer_shared_segment(client, admin_headers):
+    _create_rate(client, admin_headers, "USD", "NOK", 10.0)
+    _create_rate(client, admin_headers, "USD", "NOK", 11.0)
+    assert _convert(client, admin_headers, "USD", "NOK").json()["rate_used"] == 11.0
+
+    # «Бэкап»: версия курсов в БД меньше той, что уже лежит в общей памяти
+    with SessionLocal() as db:
+        db.execute(text("UPDATE rate_versions SET version = 1"))
+        db.execute(text("UPDATE currency_rates SET rate = 9.0 WHERE target_currency = 'NOK' AND is_active"))
+        db.commit()
+        rate_cache.rebuild(db)
+
+    assert rate_cache.stats()["rollbacks"] == 1
+    assert _convert(client, admin_headers, "USD", "NOK").json()["rate_used"] == 9.0
+
+
+def test_oversized_table_disables_segment_until_it_fits_again(tmp_path, capsys):
+    path = str(tmp_path / "small.bin")
+    cache = RateCache()
+    # Пять базовых валют матрицы плюс одна
+    cache.attach_shared(SharedRates(path, capacity=6))
+    cache._install([("USD", "EUR", 0.9), ("USD", "CHF", 0.8), ("USD", "SEK", 10.5)], RateTableVersion(1, 1, None))
+    for _ in range(3):
+        # Воркер, прочитавший курсы из БД, работает со своей копией
+        assert cache.snapshot.get("USD", "SEK") == 10.5
+    assert cache.stats()["shared_disabled"]
+    assert capsys.readouterr().out.count("Общая таблица курсов отключена") == 1
+
+    # Валют снова не больше ёмкости — сегмент включается, другие воркеры читают из него
+    cache._install([("USD", "EUR", 0.9)], RateTableVersion(1, 2, None))
+    assert not cache.stats()["shared_disabled"]
+    other = RateCache()
+    other.attach_shared(SharedRates(path, capacity=6))
+    assert other.snapshot.get("USD", "EUR") == 0.9
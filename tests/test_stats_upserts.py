@@ -0,0 +1,63 @@
+"""СУБД без INSERT ... ON CONFLICT получают те же счётчики через UPDATE, а затем INSERT."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app import models, rollups, user_stats
+from app.database import Base
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/stats.db")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _row(user_id, from_currency, to_currency, amount, timestamp):
+    return {"user_id": user_id, "from_currency": from_currency, "to_currency": to_currency, "amount": amount,
+            "converted_amount": amount * 2, "timestamp": timestamp}
+
+
+@pytest.mark.parametrize("dialect_name", ["sqlite", "mysql"])
+def test_user_stats_accumulate(db, dialect_name):
+    first = [_row(1, "USD", "EUR", 10.0, datetime(2024, 5, 2)), _row(1, "EUR", "USD", 1.0, datetime(2024, 5, 3))]
+    second = [_row(1, "USD", "GBP", 5.0, datetime(2024, 5, 1)), _row(2, "USD", "EUR", 3.0, datetime(2024, 5, 4))]
+    user_stats.execute_upserts(db, user_stats.stats_upserts(dialect_name, first))
+    user_stats.execute_upserts(db, user_stats.stats_upserts(dialect_name, second))
+    db.commit()
+
+    user = db.get(models.UserStats, 1)
+    assert user.conversion_count == 3
+    assert user.first_conversion_at == datetime(2024, 5, 1)
+    assert user.last_conversion_at == datetime(2024, 5, 3)
+    usd = db.scalars(select(models.UserCurrencyStats).where(
+        models.UserCurrencyStats.user_id == 1, models.UserCurrencyStats.currency == "USD"
+    )).one()
+    assert (usd.conversions_from, usd.conversions_to, usd.amount_from, usd.amount_to) == (2, 1, 15.0, 2.0)
+    assert db.get(models.UserStats, 2).conversion_count == 1
+
+
+@pytest.mark.parametrize("dialect_name", ["sqlite", "mysql"])
+def test_rollups_accumulate(db, dialect_name):
+    moment = datetime(2024, 5, 2, 10, 15)
+    rollups.execute_upserts(db, rollups.rollup_upserts(dialect_name, [_row(1, "USD", "EUR", 10.0, moment)]))
+    rollups.execute_upserts(db, rollups.rollup_upserts(dialect_name, [
+        _row(2, "USD", "EUR", 5.0, moment.replace(minute=40)),
+        _row(2, "USD", "EUR", 1.0, moment.replace(hour=11)),
+    ]))
+    db.commit()
+
+    buckets = {
+        (bucket.granularity, bucket.bucket_start): (bucket.conversion_count, bucket.amount_total)
+        for bucket in db.scalars(select(models.ConversionRollup))
+    }
+    assert buckets == {
+        ("hour", datetime(2024, 5, 2, 10)): (2, 15.0),
+        ("hour", datetime(2024, 5, 2, 11)): (1, 1.0),
+        ("day", datetime(2024, 5, 2)): (3, 16.0),
+    }